@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+#
+# Benchmark serial transports on a pseudo terminal pair
+#
+# A child process answers Modbus RTU read requests on the master side of a pty,
+# trickling each response out in a few chunks like a UART would. The benchmark
+# sends requests on the device side and reads the responses through:
+#  - pySerial (serial.Serial, select + read per chunk)
+#  - minimalmodbus.TermiosTransport (VMIN/VTIME frame reads into a preallocated buffer)
+# Both go through the same pty, so the differences in round trip and cpu time
+# are the Python and system call overhead of the read path. The Modbus silent
+# period is not included, as it is the same for both.
+#
+import argparse
+import os
+import statistics
+import time
+import tty
+
+import minimalmodbus
+import serial
+
+# ---------------- CONFIG ----------------
+TRANSACTIONS = 2000
+REGISTERS = 8           # read per request, like the jtracer realtime block
+CHUNKS = 4              # pieces the response is written in
+CHUNK_GAP_S = 0.0003    # between pieces, about 4 bytes at 115200 baud
+TIMEOUT_S = 1.0
+# ----------------------------------------
+
+MODE = minimalmodbus.MODE_RTU
+
+
+def request_and_size(registers=REGISTERS):
+    payload = minimalmodbus._num_to_two_bytes(0x3100) + minimalmodbus._num_to_two_bytes(registers)
+    request = minimalmodbus._embed_payload(1, MODE, 4, payload)
+    return request, minimalmodbus._predict_response_size(MODE, 4, payload)
+
+
+def respond(fd, registers, chunks, gap):
+    """Answer each request on the pty master, until the other side goes away."""
+    body = bytes([1, 4, 2 * registers]) + bytes(range(2 * registers))
+    response = body + minimalmodbus._calculate_crc(body)
+    step = -(-len(response) // chunks)
+    pending = b""
+    while True:
+        try:
+            data = os.read(fd, 256)
+        except OSError:
+            return
+        if not data:
+            return
+        pending += data
+        while len(pending) >= 8:
+            pending = pending[8:]
+            for i in range(0, len(response), step):
+                if i:
+                    time.sleep(gap)
+                os.write(fd, response[i:i + step])
+
+
+def run(name, write, read, request, size, transactions):
+    times = []
+    cpu = time.process_time()
+    for _ in range(transactions):
+        t0 = time.perf_counter()
+        write(request)
+        answer = read(size)
+        times.append(time.perf_counter() - t0)
+        if len(answer) != size:
+            raise IOError(f"{name}: got {len(answer)} of {size} bytes")
+    cpu = (time.process_time() - cpu) / transactions
+    times.sort()
+    print(f"{name:18s} mean {statistics.mean(times) * 1e6:7.1f} us"
+          f"  p50 {times[len(times) // 2] * 1e6:7.1f} us  p99 {times[len(times) * 99 // 100] * 1e6:7.1f} us"
+          f"  cpu {cpu * 1e6:6.1f} us")
+    return statistics.mean(times), cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pySerial against the termios transport on a pty pair")
+    parser.add_argument("-n", type=int, default=TRANSACTIONS, help="transactions per transport, default %(default)s")
+    parser.add_argument("--chunks", type=int, default=CHUNKS, help="pieces per response, default %(default)s")
+    parser.add_argument("--gap", type=float, default=CHUNK_GAP_S, help="seconds between pieces, default %(default)s")
+    args = parser.parse_args()
+
+    master, device = os.openpty()
+    tty.setraw(master)
+    name = os.ttyname(device)
+    pid = os.fork()
+    if pid == 0:
+        os.close(device)
+        respond(master, REGISTERS, args.chunks, args.gap)
+        os._exit(0)
+    os.close(master)
+
+    request, size = request_and_size()
+    print(f"{args.n} transactions of {len(request)} + {size} bytes on {name}, "
+          f"response in {args.chunks} pieces {args.gap * 1e6:.0f} us apart")
+
+    port = serial.Serial(name, 115200, timeout=TIMEOUT_S)
+    pyserial = run("pySerial", port.write, port.read, request, size, args.n)
+    port.close()
+
+    transport = minimalmodbus.TermiosTransport(name, 115200, TIMEOUT_S)
+    termios_ = run("TermiosTransport", transport.write, transport.read_exact, request, size, args.n)
+    transport.close()
+
+    print(f"TermiosTransport: {(pyserial[0] - termios_[0]) * 1e6:+.1f} us round trip, "
+          f"{(pyserial[1] - termios_[1]) * 1e6:+.1f} us cpu saved per transaction")
+    os.close(device)
+    os.kill(pid, 15)
+    os.waitpid(pid, 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,29 @@
 #!/usr/bin/env python3
 #
-# EPEVER Tracer 3210AN Settings Utility (24V LiFePO4, staged + atomic writes @115200)
+# EPEVER Tracer 3210AN Settings Utility (24V LiFePO4, planned + atomic writes @115200)
 #
 # Strategy:
 #  - Keep baud at 115200 (your unit communicates reliably at this speed).
-#  - Set battery type = USER (FC06).
-#  - Probe FC16 with a no-op write on 0x9006..0x9008 to confirm block writes are allowed.
-#  - Stage writes to satisfy constraints and avoid exception 04:
-#      A) Raise Float to a temporary safe level (>= BR + 1.20 V, default 28.0 V).
-#      B) Write Eq/Boost/Float atomically (FC16) to 28.4/28.4/<temp>.
-#      C) Lower Float to final 27.60 V (>= BR + 1.20 V).
+#  - Set battery type = USER (FC06), unless it already is.
+#  - Read the setpoints and the battery type in one batch, only the registers used
+#    (0x9003..0x9009 and 0x9010), so addresses the unit refuses in between do not
+#    matter; the dump, the planner and the final verification all use such snapshots.
+#  - Compute the final targets.
+#  - Plan the fewest FC06/FC16 writes that reach the targets, skipping registers
+#    already at target, such that no write leaves the unit in a state breaking
+#    the constraints below (the unit answers such a write with exception 04):
+#      Over-voltage Disconnect > Charging Limit >= Equalize >= Boost >= Float
+#      Float >= Boost Reconnect + 1.20 V, Over-voltage Disconnect > Over-voltage Reconnect
+#  - Writes read the registers back in the same FC23 transaction where the unit supports it.
+#  - If the unit refuses a block write, replan and write with FC06 only.
 #
+import heapq
 import minimalmodbus
+import os
 import serial
 import time
 import sys
+from math import inf
 
 # ---------------- CONFIG ----------------
 PORT = "/dev/ttyUSB0"
@@ -23,28 +32,73 @@ BAUDRATE = 115200
 TIMEOUT_S = 1.2
 DEBUG = True
 
-# Registers (decimal for EPEver A/AN)
+# Registers (decimal for EPEver A/AN), shared with jt_epever_settings.py
+REG_BATTERY_CAPACITY   = 36865  # 0x9001 (Ah)
+REG_TEMP_COMPENSATION  = 36866  # 0x9002
 REG_OVERVOLT_RECONNECT = 36867  # 0x9003 (read)
-REG_CHARGING_LIMIT     = 36868  # 0x9004 (write FC06 if adjusted)
-REG_OVERVOLT_DISCONNECT= 36869  # 0x9005 (write FC06 if adjusted)
-REG_EQUALIZE_VOLT      = 36870  # 0x9006 (block write start)
+REG_CHARGING_LIMIT     = 36868  # 0x9004
+REG_OVERVOLT_DISCONNECT= 36869  # 0x9005
+REG_EQUALIZE_VOLT      = 36870  # 0x9006
 REG_BOOST_VOLT         = 36871  # 0x9007
 REG_FLOAT_VOLT         = 36872  # 0x9008
 REG_BOOST_RECONNECT    = 36873  # 0x9009 (Charging Return) — treat read-only
+REG_LOW_VOLT_RECONNECT = 36874  # 0x900A
+REG_UNDERVOLT_RECOVER  = 36875  # 0x900B
+REG_UNDERVOLT_WARNING  = 36876  # 0x900C
+REG_LOW_VOLT_DISCONNECT= 36877  # 0x900D
+REG_DISCHARGING_LIMIT  = 36878  # 0x900E
 REG_BATTERY_TYPE       = 36880  # 0x9010
+REG_RTC                = 36883  # 0x9013..0x9015 (sec/min, hour/day, month/year)
+
+SETPOINT_REGS = range(REG_OVERVOLT_RECONNECT, REG_BOOST_RECONNECT + 1)
+SNAPSHOT_REGS = list(SETPOINT_REGS) + [REG_BATTERY_TYPE]
+WRITABLE_REGS = range(REG_CHARGING_LIMIT, REG_FLOAT_VOLT + 1)
+REG_NAMES = {
+    REG_OVERVOLT_RECONNECT: "OVR", REG_CHARGING_LIMIT: "CL", REG_OVERVOLT_DISCONNECT: "OVD",
+    REG_EQUALIZE_VOLT: "Eq", REG_BOOST_VOLT: "Boost", REG_FLOAT_VOLT: "Float", REG_BOOST_RECONNECT: "BR",
+    REG_LOW_VOLT_RECONNECT: "LVR", REG_UNDERVOLT_RECOVER: "UVWR", REG_UNDERVOLT_WARNING: "UVW",
+    REG_LOW_VOLT_DISCONNECT: "LVD", REG_DISCHARGING_LIMIT: "DLV",
+}
+SETTING_NAMES = {
+    REG_BATTERY_CAPACITY: "Battery Capacity", REG_TEMP_COMPENSATION: "Temp Compensation",
+    REG_OVERVOLT_RECONNECT: "Over-voltage Reconnect", REG_CHARGING_LIMIT: "Charging Limit Voltage",
+    REG_OVERVOLT_DISCONNECT: "Over-voltage Disconnect", REG_EQUALIZE_VOLT: "Equalize Voltage",
+    REG_BOOST_VOLT: "Boost Voltage", REG_FLOAT_VOLT: "Float Voltage", REG_BOOST_RECONNECT: "Boost Reconnect Voltage",
+    REG_LOW_VOLT_RECONNECT: "Low Voltage Reconnect", REG_UNDERVOLT_RECOVER: "Under-voltage Warning Reconnect",
+    REG_UNDERVOLT_WARNING: "Under-voltage Warning", REG_LOW_VOLT_DISCONNECT: "Low Voltage Disconnect",
+    REG_DISCHARGING_LIMIT: "Discharging Limit", REG_BATTERY_TYPE: "Battery Type",
+    REG_RTC: "RTC sec/min", REG_RTC + 1: "RTC hour/day", REG_RTC + 2: "RTC month/year",
+}
+# Holding register ranges (first, last) in the EPEver A/AN protocol document, plus the
+# battery type; a block read touching an address outside them may fail with exception 02
+SETTING_RANGES = [
+    (0x9000, REG_DISCHARGING_LIMIT), (REG_BATTERY_TYPE, REG_BATTERY_TYPE), (REG_RTC, 0x9021),
+    (0x903D, 0x903F), (0x9042, 0x904D), (0x9065, 0x9065), (0x9067, 0x9067), (0x9069, 0x906E),
+    (0x9070, 0x9070),
+]
 
 # 24V LiFePO4 targets (constraints applied at runtime)
 NEW_BATTERY_TYPE       = 3      # USER
 EQ_TARGET              = 28.4   # V
 BOOST_TARGET           = 28.4   # V
 FLOAT_FINAL            = 27.6   # V (>= BR + 1.20)
-FLOAT_TEMP_RAISE       = 28.0   # V (temporary raise for staging)
 MIN_FLOAT_MARGIN_V     = 1.20   # Float >= BR + margin
 
 PRE_WRITE_SLEEP_S      = 0.02
-POST_WRITE_SLEEP_S     = 0.60
+SETTLE_CEILING_S       = 3.0    # longest wait for a write to read back as written
+SETTLE_FILE            = os.path.expanduser("~/.cache/jtracer/settle.json")  # learned commit latencies
 # ----------------------------------------
 
+# (higher register, lower register, minimum difference in 0.01 V, description)
+CONSTRAINTS = [
+    (REG_OVERVOLT_DISCONNECT, REG_CHARGING_LIMIT,     1, "OVD > CL"),
+    (REG_OVERVOLT_DISCONNECT, REG_OVERVOLT_RECONNECT, 1, "OVD > OVR"),
+    (REG_CHARGING_LIMIT,      REG_EQUALIZE_VOLT,      0, "CL >= Eq"),
+    (REG_EQUALIZE_VOLT,       REG_BOOST_VOLT,         0, "Eq >= Boost"),
+    (REG_BOOST_VOLT,          REG_FLOAT_VOLT,         0, "Boost >= Float"),
+    (REG_FLOAT_VOLT,          REG_BOOST_RECONNECT,    int(round(MIN_FLOAT_MARGIN_V * 100)), "Float >= BR + 1.20"),
+]
+
 
 def init_instrument():
     inst = minimalmodbus.Instrument(PORT, UNIT_ID, mode=minimalmodbus.MODE_RTU)
@@ -55,194 +109,266 @@ def init_instrument():
     inst.serial.timeout  = TIMEOUT_S
     inst.clear_buffers_before_each_transaction = True
     inst.debug = DEBUG
+    # Interactive tool: background pollers on the same bus give way to us
+    inst.bus_lock = minimalmodbus.BusLock(PORT, priority=True, timeout=30)
+    # Writes wait until they read back, for the latency learned in earlier runs
+    inst.settle = minimalmodbus.SettleTracker(SETTLE_FILE, ceiling=SETTLE_CEILING_S)
     return inst
 
 
 def sleep_brief(): time.sleep(PRE_WRITE_SLEEP_S)
-def sleep_settle(): time.sleep(POST_WRITE_SLEEP_S)
 
 
-def r_u16(inst, reg):
-    return inst.read_register(reg, 0, functioncode=3, signed=False)
+class SettingsSnapshot:
+    """Holding registers SNAPSHOT_REGS, read in one batch.
 
+    Shared by the dump, the planner and the final verification, so that each
+    register is read once per phase instead of once per use. Instrument.batch()
+    merges adjacent registers into block reads, but never spans registers that
+    are not asked for, which the unit may refuse.
+    """
 
-def r_v(inst, reg):
-    return r_u16(inst, reg) / 100.0
+    def __init__(self, values):
+        self.values = dict(values)
 
+    @classmethod
+    def read(cls, inst, regs=SNAPSHOT_REGS):
+        with inst.batch() as batch:
+            reads = {reg: batch.read_register(reg, functioncode=3) for reg in regs}
+        return cls({reg: r.result() for reg, r in reads.items()})
 
-def w_u16_fc06(inst, reg, value):
-    sleep_brief()
-    inst.write_register(reg, value, 0, functioncode=6)
-    sleep_settle()
+    def __getitem__(self, reg):
+        return self.values[reg]
 
+    def registers(self, regs):
+        return {reg: self[reg] for reg in regs}
 
-def w_v_fc06(inst, reg, volts):
-    w_u16_fc06(inst, reg, int(round(volts * 100)))
-    return r_v(inst, reg)
+    def updated(self, writes):
+        """Copy with the (start register, [values]) writes applied."""
+        values = dict(self.values)
+        for start, vals in writes:
+            values.update((start + i, v) for i, v in enumerate(vals))
+        return SettingsSnapshot(values)
 
+    def diff(self, other):
+        """List of (register, this value, other value) where the snapshots differ."""
+        return [(reg, a, other[reg]) for reg, a in sorted(self.values.items()) if a != other[reg]]
 
-def w_block_fc16(inst, start_reg, values_u16):
-    sleep_brief()
-    inst.write_registers(start_reg, values_u16)  # FC16
-    sleep_settle()
 
+def w_u16_verify(inst, start_reg, values_u16, single=False, previous=None):
+    """Write registers and return their read-back, as soon as the unit has committed them.
 
-def dump_settings(inst, header="Current Charger Settings"):
+    The first read-back comes with the write, in one FC23 round trip if the unit supports
+    it; with single, each register is written with FC06 and read back separately. Until
+    the registers read as written twice in a row they are polled with backoff, starting at
+    the latency learned for that register range, up to SETTLE_CEILING_S. Pass the previous
+    values if known, so a write that changes nothing does not teach a latency.
+    """
+    sleep_brief()
+    if single:
+        for i, value in enumerate(values_u16):
+            inst.write_register(start_reg + i, value, functioncode=6)
+        readback = None
+    else:
+        readback = inst.read_write_registers(start_reg, values_u16, start_reg, len(values_u16))
+    written_at = time.monotonic()
+    return inst.settle.wait(inst, start_reg, values_u16, written_at=written_at, readback=readback,
+                            previous=previous)
+
+
+def dump_settings(snapshot, header="Current Charger Settings"):
     print(f"\n{header}:")
-    for name, reg, is_volt in [
-        ("Over-voltage Reconnect", REG_OVERVOLT_RECONNECT, True),
-        ("Charging Limit Voltage", REG_CHARGING_LIMIT,     True),
-        ("Over-voltage Disconnect",REG_OVERVOLT_DISCONNECT,True),
-        ("Equalize Voltage",       REG_EQUALIZE_VOLT,      True),
-        ("Boost Voltage",          REG_BOOST_VOLT,         True),
-        ("Float Voltage",          REG_FLOAT_VOLT,         True),
-        ("Boost Reconnect Voltage",REG_BOOST_RECONNECT,    True),
-        ("Battery Type",           REG_BATTERY_TYPE,       False),
-    ]:
-        try:
-            val = r_u16(inst, reg)
-            if is_volt:
-                print(f"  {name:25s}: {val/100:.2f} V")
-            else:
-                btypes = {0: "Sealed", 1: "Gel", 2: "Flooded", 3: "User"}
-                print(f"  {name:25s}: {val} ({btypes.get(val,'Unknown')})")
-        except Exception as e:
-            print(f"  {name:25s}: ERROR ({e})")
+    for reg in SNAPSHOT_REGS:
+        name, val = SETTING_NAMES[reg], snapshot[reg]
+        if reg != REG_BATTERY_TYPE:
+            print(f"  {name:25s}: {val/100:.2f} V")
+        else:
+            btypes = {0: "Sealed", 1: "Gel", 2: "Flooded", 3: "User"}
+            print(f"  {name:25s}: {val} ({btypes.get(val,'Unknown')})")
     print()
 
 
-def compute_targets(inst):
-    # Read current values
-    ov_reconn = r_v(inst, REG_OVERVOLT_RECONNECT)
-    chg_limit = r_v(inst, REG_CHARGING_LIMIT)
-    ov_disc   = r_v(inst, REG_OVERVOLT_DISCONNECT)
-    eq_now    = r_v(inst, REG_EQUALIZE_VOLT)
-    bo_now    = r_v(inst, REG_BOOST_VOLT)
-    fl_now    = r_v(inst, REG_FLOAT_VOLT)
-    br_now    = r_v(inst, REG_BOOST_RECONNECT)
-
-    min_float_allowed = round(br_now + MIN_FLOAT_MARGIN_V, 2)
-
-    # Stage A temp float
-    fl_temp = max(FLOAT_TEMP_RAISE, min_float_allowed)
-
-    # Stage B block targets (keep float at temp to ease constraints)
-    eq_blk = max(EQ_TARGET, fl_temp)
-    bo_blk = max(BOOST_TARGET, fl_temp)
-    fl_blk = fl_temp
-
-    # Stage C final float
-    fl_final = max(FLOAT_FINAL, min_float_allowed)
-
-    # Keep CL and OVD consistent and safe
-    chg_limit_new = chg_limit
-    if chg_limit_new < eq_blk:
-        chg_limit_new = eq_blk
-    ov_disc_new = ov_disc
-    if ov_disc_new <= chg_limit_new:
-        ov_disc_new = round(chg_limit_new + 0.30, 2)
-
-    return {
-        "ov_reconn": ov_reconn,
-        "chg_limit_new": chg_limit_new,
-        "ov_disc_new": ov_disc_new,
-        "eq_blk": eq_blk,
-        "bo_blk": bo_blk,
-        "fl_blk": fl_blk,
-        "fl_final": fl_final,
-        "br_now": br_now,
-        "min_float_allowed": min_float_allowed,
+def compute_targets(current):
+    """Final setpoints in 0.01 V for the registers that should change, all constraints met."""
+    cv = lambda volts: int(round(volts * 100))
+    fl = max(cv(FLOAT_FINAL), current[REG_BOOST_RECONNECT] + cv(MIN_FLOAT_MARGIN_V))
+    bo = max(cv(BOOST_TARGET), fl)
+    eq = max(cv(EQ_TARGET), bo)
+    cl = max(current[REG_CHARGING_LIMIT], eq)
+    ovd = current[REG_OVERVOLT_DISCONNECT]
+    if ovd <= max(cl, current[REG_OVERVOLT_RECONNECT]):
+        ovd = max(cl, current[REG_OVERVOLT_RECONNECT]) + 30
+    targets = {
+        REG_CHARGING_LIMIT: cl,
+        REG_OVERVOLT_DISCONNECT: ovd,
+        REG_EQUALIZE_VOLT: eq,
+        REG_BOOST_VOLT: bo,
+        REG_FLOAT_VOLT: fl,
     }
-
-
-def main():
-    inst = init_instrument()
-
-    dump_settings(inst, "Reading current settings")
-
-    # Battery type USER via FC06 (works on your unit)
-    print("Ensuring battery type = User/Custom (FC06)...")
-    try:
-        w_u16_fc06(inst, REG_BATTERY_TYPE, NEW_BATTERY_TYPE)
-        bt = r_u16(inst, REG_BATTERY_TYPE)
-        if bt != NEW_BATTERY_TYPE:
-            print(f"Warning: battery type readback = {bt}, not User/Custom!")
-    except Exception as e:
-        print("Error setting battery type:", e)
-        sys.exit(1)
-
-    # Compute staged targets
-    tg = compute_targets(inst)
-    print("Plan:")
-    print(f"  Stage A: raise Float to {tg['fl_blk']:.2f} V (BR={tg['br_now']:.2f}, min Float={tg['min_float_allowed']:.2f})")
-    print(f"  Stage B: block write Eq/Boost/Float = {tg['eq_blk']:.2f}/{tg['bo_blk']:.2f}/{tg['fl_blk']:.2f} V")
-    print(f"  Stage C: lower Float to {tg['fl_final']:.2f} V")
-    print(f"  Charging Limit (>= Eq): {tg['chg_limit_new']:.2f} V; Over-voltage Disconnect (> CL): {tg['ov_disc_new']:.2f} V")
-
-    # Quick no-op FC16 test on 0x9006..0x9008 (write current values back)
+    return {reg: v for reg, v in targets.items() if v != current[reg]}
+
+
+def violations(values, constraints=CONSTRAINTS):
+    return {text for high, low, margin, text in constraints if values[high] < values[low] + margin}
+
+
+def plan_writes(current, targets, blocks=True, writable=WRITABLE_REGS, constraints=CONSTRAINTS):
+    """Shortest sequence of writes taking the setpoints from current to targets.
+
+    current holds every register the constraints refer to; only writable ones are written.
+
+    Returns a list of (start register, [values]) writes, one FC06 or FC16 each.
+    Every write sets its registers to their final value; a block may also rewrite
+    registers that already hold theirs to bridge a gap. After each write no
+    constraint may be broken that was not already broken before the first one.
+    Among plans with the fewest writes, the one writing the fewest registers wins.
+    """
+    final = {**current, **targets}
+    if violations(final, constraints):
+        raise ValueError(f"Target setpoints break constraints: {sorted(violations(final, constraints))}")
+    if set(targets) - set(writable):
+        raise ValueError(f"Not writable: {sorted(set(targets) - set(writable))}")
+    tolerated = violations(current, constraints)
+    pending = frozenset(targets)
+    regs = [r for r in sorted(current) if r in writable]
+    ops = []
+    for i in range(len(regs)):
+        for j in range(i, len(regs) if blocks else i + 1):
+            if regs[j] - regs[i] != j - i:
+                break  # not contiguous
+            ops.append(regs[i:j + 1])
+
+    # Dijkstra over the set of registers already written, cost (writes, registers)
+    queue = [((0, 0), 0, frozenset(), [])]
+    best = {frozenset(): (0, 0)}
+    tie = 0
+    while queue:
+        cost, _, done, plan = heapq.heappop(queue)
+        if done == pending:
+            return [(op[0], [final[r] for r in op]) for op in plan]
+        if best.get(done, cost) < cost:
+            continue
+        values = {r: final[r] if r in done else current[r] for r in current}
+        for op in ops:
+            written = pending.intersection(op) - done
+            if not written:
+                continue
+            after = {**values, **{r: final[r] for r in op}}
+            if not violations(after, constraints) <= tolerated:
+                continue
+            state = done | written
+            new_cost = (cost[0] + 1, cost[1] + len(op))
+            if new_cost < best.get(state, (inf, inf)):
+                best[state] = new_cost
+                tie += 1
+                heapq.heappush(queue, (new_cost, tie, state, plan + [op]))
+    raise ValueError("No write order keeps the setpoints valid at every step")
+
+
+def write_code(inst, values, single=False):
+    """Function code w_u16_verify uses for the write, as far as known yet."""
+    if single:
+        return "FC06"
+    if inst.read_write_supported:
+        return "FC23"
+    return "FC16" if len(values) > 1 else "FC06"
+
+
+def describe_write(start, values, fc=None):
+    names = "/".join(REG_NAMES.get(start + i, f"0x{start + i:04X}") for i in range(len(values)))
+    text = f"{names} = " + "/".join(f"{v / 100:.2f}" for v in values) + " V"
+    return f"{fc} {text}" if fc else text
+
+
+def execute_plan(inst, plan, current, single=False):
+    """Perform the writes, starting from the current setpoints and checking each read-back.
+
+    With single, each register is written with FC06.
+    """
+    current = dict(current)
+    for start, values in plan:
+        previous = [current[start + i] for i in range(len(values))]
+        readback = w_u16_verify(inst, start, values, single, previous)
+        current.update((start + i, v) for i, v in enumerate(readback))
+        print(f"  {describe_write(start, values, write_code(inst, values, single))}")
+        if DEBUG and inst.settle.last_latency is not None:
+            print(f"    settled in {inst.settle.last_latency * 1000:.0f} ms")
+        if readback != values:
+            raise IOError(f"Readback {readback} differs from {values}")
+
+
+def write_setpoints(inst, current, read, targets_for, writable=WRITABLE_REGS, constraints=CONSTRAINTS):
+    """Plan and perform the writes taking the setpoints from current to targets_for(current).
+
+    If the unit refuses a write, the setpoints are re-read with read() and the rest is
+    replanned and written with FC06 only. Returns (current, plan), the setpoints the
+    completed plan started from and that plan. Raises ValueError if no plan exists.
+    """
+    targets = targets_for(current)
+    if not targets:
+        return current, []
+    plan = plan_writes(current, targets, writable=writable, constraints=constraints)
+    print(f"Plan ({len(plan)} write{'s' if len(plan) != 1 else ''}):")
+    for start, values in plan:
+        print(f"  {describe_write(start, values)}")
+    print("Writing:")
     try:
-        eq_cur, bo_cur, fl_cur = r_v(inst, REG_EQUALIZE_VOLT), r_v(inst, REG_BOOST_VOLT), r_v(inst, REG_FLOAT_VOLT)
-        print("FC16 no-op probe on 0x9006..0x9008...")
-        w_block_fc16(inst, REG_EQUALIZE_VOLT, [int(round(x*100)) for x in (eq_cur, bo_cur, fl_cur)])
-        print("  FC16 probe OK (device responded).")
-    except Exception as e:
-        print("  FC16 probe failed (device refused/ignored block writes):", e)
-        print("  We can still proceed (falls back to FC06 where possible), but block write may be refused.")
+        execute_plan(inst, plan, current)
+    except minimalmodbus.SlaveReportedException as e:
+        # Some firmwares refuse FC16/FC23 for setpoints: replan from what the unit holds now
+        print("Write refused:", e)
+        current = read()
+        plan = plan_writes(current, targets_for(current), False, writable, constraints)
+        print(f"Retrying with single-register writes ({len(plan)}):")
+        execute_plan(inst, plan, current, single=True)
+    return current, plan
+
+
+def configure(inst):
+    snap = SettingsSnapshot.read(inst)
+    dump_settings(snap, "Reading current settings")
+
+    # Battery type USER (FC06, or FC23 write + read-back)
+    if snap[REG_BATTERY_TYPE] != NEW_BATTERY_TYPE:
+        print("Setting battery type = User/Custom...")
+        try:
+            bt = w_u16_verify(inst, REG_BATTERY_TYPE, [NEW_BATTERY_TYPE], previous=[snap[REG_BATTERY_TYPE]])[0]
+            if bt != NEW_BATTERY_TYPE:
+                print(f"Warning: battery type readback = {bt}, not User/Custom!")
+        except Exception as e:
+            print("Error setting battery type:", e)
+            sys.exit(1)
+        # The unit may load other setpoints with the new type
+        snap = SettingsSnapshot.read(inst)
 
-    # Stage A: raise Float (FC06)
+    current = snap.registers(SETPOINT_REGS)
     try:
-        print("Stage A: raising Float (FC06)...")
-        fl_after = w_v_fc06(inst, REG_FLOAT_VOLT, tg["fl_blk"])
-        print(f"  Float now: {fl_after:.2f} V")
-    except Exception as e:
-        print("Stage A failed (raising Float):", e)
+        current, plan = write_setpoints(
+            inst, current, lambda: SettingsSnapshot.read(inst).registers(SETPOINT_REGS), compute_targets)
+    except ValueError as e:
+        print("Planning failed:", e)
         sys.exit(1)
-
-    # Pre-adjust CL/OVD if needed (FC06)
-    try:
-        if abs(r_v(inst, REG_CHARGING_LIMIT) - tg["chg_limit_new"]) > 1e-3:
-            print("Updating Charging Limit (FC06)...")
-            w_v_fc06(inst, REG_CHARGING_LIMIT, tg["chg_limit_new"])
-        if abs(r_v(inst, REG_OVERVOLT_DISCONNECT) - tg["ov_disc_new"]) > 1e-3:
-            print("Updating Over-voltage Disconnect (FC06)...")
-            w_v_fc06(inst, REG_OVERVOLT_DISCONNECT, tg["ov_disc_new"])
     except Exception as e:
-        print("Pre-block consistency writes failed (continuing):", e)
+        print("Write failed:", e)
+        sys.exit(1)
+    if not plan:
+        print("All setpoints already at target.")
 
-    # Stage B: block write Eq/Boost/Float (0x9006..0x9008)
-    try:
-        print("Stage B: writing Eq/Boost/Float as FC16 block...")
-        vals = [int(round(v * 100)) for v in [tg["eq_blk"], tg["bo_blk"], tg["fl_blk"]]]
-        w_block_fc16(inst, REG_EQUALIZE_VOLT, vals)
-        # Readback
-        eq_r = r_v(inst, REG_EQUALIZE_VOLT)
-        bo_r = r_v(inst, REG_BOOST_VOLT)
-        fl_r = r_v(inst, REG_FLOAT_VOLT)
-        print(f"  Readback: Eq={eq_r:.2f} V, Boost={bo_r:.2f} V, Float={fl_r:.2f} V")
-    except Exception as e:
-        print("Stage B block write failed:", e)
-        # Fallback: FC06 singles in dependency-safe order
-        try:
-            print("Fallback: FC06 singles (Float→Boost→Equalize)...")
-            fl_r = w_v_fc06(inst, REG_FLOAT_VOLT, tg["fl_blk"])
-            bo_r = w_v_fc06(inst, REG_BOOST_VOLT, max(tg["bo_blk"], fl_r))
-            eq_r = w_v_fc06(inst, REG_EQUALIZE_VOLT, max(tg["eq_blk"], bo_r))
-            print(f"  Readback: Eq={eq_r:.2f} V, Boost={bo_r:.2f} V, Float={fl_r:.2f} V")
-        except Exception as e2:
-            print("Fallback singles failed:", e2)
-            sys.exit(1)
+    # One block read, compared with what the plan should have left behind
+    final = SettingsSnapshot.read(inst)
+    dump_settings(final, "Verifying final settings")
+    expected = snap.updated([(SETPOINT_REGS.start, [current[reg] for reg in SETPOINT_REGS])] + plan)
+    mismatches = expected.diff(final)
+    for reg, want, actual in mismatches:
+        print(f"Mismatch at 0x{reg:04X}: expected {want}, unit has {actual}")
+    print("Done." if not mismatches else "Done, with mismatches.")
 
-    # Stage C: lower Float to final target (FC06)
-    try:
-        print("Stage C: lowering Float to final target (FC06)...")
-        fl_final_r = w_v_fc06(inst, REG_FLOAT_VOLT, tg["fl_final"])
-        print(f"  Float now: {fl_final_r:.2f} V")
-    except Exception as e:
-        print("Stage C failed (lowering Float):", e)
-        print("Keeping Float at raised value.")
 
-    dump_settings(inst, "Verifying final settings")
-    print("Done.")
+def main():
+    inst = init_instrument()
+    # Hold the bus for the whole staged sequence, not just per transaction
+    with inst.bus_lock:
+        configure(inst)
 
 
 if __name__ == "__main__":
@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
-import minimalmodbus, serial, time, sys
+import minimalmodbus, serial, time, sys, os
 
 PORT="/dev/ttyUSB0"; UNIT_ID=1; BAUDRATE=115200; TIMEOUT_S=1.2; DEBUG=True
+SETTLE_CEILING_S=3.0; SETTLE_FILE=os.path.expanduser("~/.cache/jtracer/settle.json")  # shared with jt_epever_config.py
 REG_BATTERY_CAPACITY   = 36865  # 0x9001 (Ah)
 REG_EQUALIZE_VOLT      = 36870  # 0x9006
 REG_BOOST_VOLT         = 36871  # 0x9007
@@ -12,20 +13,29 @@ def init_inst():
     inst.serial.baudrate=BAUDRATE; inst.serial.bytesize=8; inst.serial.parity=serial.PARITY_NONE
     inst.serial.stopbits=1; inst.serial.timeout=TIMEOUT_S
     inst.clear_buffers_before_each_transaction=True; inst.debug=DEBUG
+    inst.bus_lock=minimalmodbus.BusLock(PORT, priority=True, timeout=30)
+    inst.settle=minimalmodbus.SettleTracker(SETTLE_FILE, ceiling=SETTLE_CEILING_S)
     return inst
 
 def r_u16(inst, reg): return inst.read_register(reg, 0, functioncode=3, signed=False)
 def r_v(inst, reg): return r_u16(inst, reg)/100.0
 
+def settled(inst, reg, vals, readback=None):
+    """Poll until the same-value write reads back, instead of sleeping a fixed time.
+
+    The write changes nothing, so the shared settle file does not learn its latency.
+    """
+    rb=inst.settle.wait(inst, reg, vals, readback=readback, previous=vals)
+    return rb, "read back as written" if rb==vals else "did not read back as written"
+
 def try_fc06_same(inst, reg, label, scale=1):
     try:
         cur = r_u16(inst, reg)
         print(f"Reading {label}: OK (raw={cur})")
         time.sleep(0.02)
         inst.write_register(reg, cur, 0, functioncode=6)
-        time.sleep(0.5)
-        rb = r_u16(inst, reg)
-        print(f"FC06 write-back SAME to {label}: OK (readback={rb})")
+        rb, how = settled(inst, reg, [cur])
+        print(f"FC06 write-back SAME to {label}: OK (readback={rb[0]}, {how})")
         return True
     except Exception as e:
         print(f"FC06 write-back SAME to {label}: FAIL ({e})")
@@ -37,26 +47,43 @@ def try_fc16_same_block(inst, start_reg, labels):
         print("Reading block", labels, "OK:", vals)
         time.sleep(0.02)
         inst.write_registers(start_reg, vals)  # FC16
-        time.sleep(0.5)
-        rb=[r_u16(inst, start_reg+i) for i in range(len(labels))]
-        print("FC16 write-back SAME block to", labels, "OK:", rb)
+        rb, how = settled(inst, start_reg, vals)
+        print("FC16 write-back SAME block to", labels, "OK:", rb, how)
         return True
     except Exception as e:
         print("FC16 write-back SAME block to", labels, "FAIL:", e)
         return False
 
+def try_fc23_same_block(inst, start_reg, labels):
+    try:
+        vals=[r_u16(inst, start_reg+i) for i in range(len(labels))]
+        time.sleep(0.02)
+        rb=inst.read_write_registers(start_reg, vals, start_reg, len(vals))  # FC23
+        rb, how = settled(inst, start_reg, vals, rb)
+        if not inst.read_write_supported:
+            print("FC23 write+read SAME block to", labels, "not supported (used FC16 + FC03):", rb)
+            return False
+        print("FC23 write+read SAME block to", labels, "OK:", rb, how)
+        return True
+    except Exception as e:
+        print("FC23 write+read SAME block to", labels, "FAIL:", e)
+        return False
+
 def main():
     inst=init_inst()
     print("— Diagnostic: Modbus write permissions —")
 
-    cap_ok = try_fc06_same(inst, REG_BATTERY_CAPACITY, "Battery Capacity (0x9001)")
-    fl_ok  = try_fc06_same(inst, REG_FLOAT_VOLT, "Float Voltage (0x9008)")
-    blk_ok = try_fc16_same_block(inst, REG_EQUALIZE_VOLT, ["Eq(0x9006)","Boost(0x9007)","Float(0x9008)"])
+    with inst.bus_lock:
+        cap_ok = try_fc06_same(inst, REG_BATTERY_CAPACITY, "Battery Capacity (0x9001)")
+        fl_ok  = try_fc06_same(inst, REG_FLOAT_VOLT, "Float Voltage (0x9008)")
+        blk_ok = try_fc16_same_block(inst, REG_EQUALIZE_VOLT, ["Eq(0x9006)","Boost(0x9007)","Float(0x9008)"])
+        rw_ok  = try_fc23_same_block(inst, REG_EQUALIZE_VOLT, ["Eq(0x9006)","Boost(0x9007)","Float(0x9008)"])
 
     print("\nSummary:")
     print(f"  FC06 Battery Capacity same-value write: {'OK' if cap_ok else 'FAIL'}")
     print(f"  FC06 Float same-value write:           {'OK' if fl_ok else 'FAIL'}")
     print(f"  FC16 Eq/Boost/Float no-op block:       {'OK' if blk_ok else 'FAIL'}")
+    print(f"  FC23 Eq/Boost/Float write+read block:  {'OK' if rw_ok else 'not supported'}")
 
     if not cap_ok and not fl_ok and not blk_ok:
         print("\nConclusion: Device is rejecting parameter writes via Modbus (likely locked).")
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+#
+# EPEVER Tracer holding register snapshot, diff and restore
+#
+#   python jt_epever_settings.py dump tracer-{unit}.json --units 1 2 3
+#   python jt_epever_settings.py diff before.json after.json
+#   python jt_epever_settings.py restore tracer-{unit}.json --units 1 2 3 [--dry-run]
+#
+# Strategy:
+#  - The first dump reads the setting ranges of the EPEver protocol document (and the
+#    register map) shared with jt_epever_config.py. Firmwares lack some of them, and a
+#    block read touching a missing address fails with exception 02, so only blocks the
+#    unit refuses are bisected down to the readable ranges. The snapshot file records
+#    them, and later dumps given --like FILE read each range with one request (at most
+#    125 registers). Further units in one run reuse the ranges of the first, and only
+#    rediscover if the unit refuses them.
+#  - Restore reads the unit's current values the same way and writes only the registers
+#    that differ:
+#      1) Registers outside the charge setpoint constraints, as coalesced FC16 blocks
+#         (FC06 singles if the unit refuses blocks). Once they read back, the unit is
+#         read until it stops changing, as a new battery type loads other setpoints.
+#      2) The constrained voltage setpoints, in the order found by the jt_epever_config.py
+#         planner, so no write leaves the unit in a state it answers with exception 04;
+#         as there, a refused write is replanned and written with FC06 only.
+#    The real-time clock is never restored. A final snapshot is diffed against the file.
+#
+import argparse
+import json
+import sys
+import time
+
+import minimalmodbus
+import serial
+
+import jt_epever_config as config
+
+# ---------------- CONFIG ----------------
+PORT = "/dev/ttyUSB0"
+BAUDRATE = 115200
+TIMEOUT_S = 1.2
+DISCOVER_TIMEOUT_S = 0.1    # plus reply time; a refused read waits this long, the library expects a full reply
+DEBUG = False
+
+SKIP_ON_RESTORE = range(config.REG_RTC, config.REG_RTC + 3)  # real-time clock
+# ----------------------------------------
+
+FORMAT = "jt-epever-settings"
+VERSION = 1
+
+# EPEver voltage setpoint rules, in 0.01 V: the charging rules of jt_epever_config.py, plus
+# (higher register, lower register, minimum difference, description) for the low voltage ones
+CONSTRAINTS = config.CONSTRAINTS + [
+    (config.REG_BOOST_RECONNECT,     config.REG_LOW_VOLT_RECONNECT,  1, "BR > LVR"),
+    (config.REG_LOW_VOLT_RECONNECT,  config.REG_LOW_VOLT_DISCONNECT, 1, "LVR > LVD"),
+    (config.REG_UNDERVOLT_RECOVER,   config.REG_UNDERVOLT_WARNING,   1, "UVWR > UVW"),
+    (config.REG_UNDERVOLT_WARNING,   config.REG_DISCHARGING_LIMIT,   0, "UVW >= DLV"),
+    (config.REG_LOW_VOLT_DISCONNECT, config.REG_DISCHARGING_LIMIT,   0, "LVD >= DLV"),
+]
+CONSTRAINED_REGS = range(config.REG_OVERVOLT_RECONNECT, config.REG_DISCHARGING_LIMIT + 1)
+
+
+def init_instrument(port, unit, baudrate=BAUDRATE):
+    inst = minimalmodbus.Instrument(port, unit, mode=minimalmodbus.MODE_RTU)
+    inst.serial.baudrate = baudrate
+    inst.serial.bytesize = 8
+    inst.serial.parity   = serial.PARITY_NONE
+    inst.serial.stopbits = 1
+    inst.serial.timeout  = TIMEOUT_S
+    inst.clear_buffers_before_each_transaction = True
+    inst.debug = DEBUG
+    inst.bus_lock = minimalmodbus.BusLock(port, priority=True, timeout=30)
+    inst.settle = minimalmodbus.SettleTracker(config.SETTLE_FILE, ceiling=config.SETTLE_CEILING_S)
+    return inst
+
+
+def blocks(start, end, size=125):
+    """Split start..end (inclusive) into requests of at most size registers."""
+    return [(a, min(size, end + 1 - a)) for a in range(start, end + 1, size)]
+
+
+def discover(inst, start, count, found):
+    """Read start..start+count-1, bisecting blocks the unit refuses. Adds readable (start, values) to found."""
+    inst.serial.timeout = DISCOVER_TIMEOUT_S + (5 + 2 * count) * 11 / inst.serial.baudrate
+    try:
+        found.append((start, inst.read_registers(start, count, functioncode=3)))
+    except minimalmodbus.IllegalRequestError:
+        if count > 1:
+            half = count // 2
+            discover(inst, start, half, found)
+            discover(inst, start + half, count - half, found)
+
+
+def merge_ranges(chunks):
+    """Join adjacent (start, values) chunks into (start, count) ranges of at most 125 registers."""
+    ranges = []
+    for start, values in sorted(chunks):
+        if ranges and ranges[-1][0] + ranges[-1][1] == start and ranges[-1][1] + len(values) <= 125:
+            ranges[-1][1] += len(values)
+        else:
+            ranges.append([start, len(values)])
+    return ranges
+
+
+def read_registers(inst, ranges=None):
+    """Return ({register: value}, readable ranges) with the fewest block reads the known ranges allow."""
+    chunks = []
+    if ranges is None:
+        timeout = inst.serial.timeout
+        try:
+            for first, last in config.SETTING_RANGES:
+                for start, count in blocks(first, last):
+                    discover(inst, start, count, chunks)
+        finally:
+            inst.serial.timeout = timeout
+    else:
+        with inst.batch() as b:
+            chunks = [(start, b.read_registers(start, count, functioncode=3)) for start, count in ranges]
+        chunks = [(start, r.result()) for start, r in chunks]
+    values = {start + i: v for start, vals in chunks for i, v in enumerate(vals)}
+    return values, merge_ranges(chunks)
+
+
+def dump(inst, path, ranges=None):
+    """Write a snapshot of the unit to path, and return its readable ranges."""
+    t0 = time.monotonic()
+    try:
+        values, ranges = read_registers(inst, ranges)
+    except minimalmodbus.IllegalRequestError:
+        print(f"Unit {inst.address}: known ranges refused, discovering")
+        values, ranges = read_registers(inst)
+    snapshot = {
+        "format": FORMAT,
+        "version": VERSION,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "port": inst.serial.port,
+        "unit": inst.address,
+        "ranges": ranges,
+        "registers": {f"0x{reg:04X}": v for reg, v in sorted(values.items())},
+    }
+    with open(path, "w") as f:
+        json.dump(snapshot, f, indent=1)
+    print(f"Unit {inst.address}: {len(values)} registers in {len(ranges)} ranges "
+          f"({time.monotonic() - t0:.2f} s) -> {path}")
+    return ranges
+
+
+def load(path):
+    with open(path) as f:
+        snapshot = json.load(f)
+    if snapshot.get("format") != FORMAT:
+        raise ValueError(f"{path}: not a {FORMAT} file")
+    if snapshot.get("version", 0) > VERSION:
+        raise ValueError(f"{path}: version {snapshot['version']} is newer than this tool ({VERSION})")
+    snapshot["registers"] = {int(reg, 16): v for reg, v in snapshot["registers"].items()}
+    return snapshot
+
+
+def register_diff(a, b):
+    """List of (register, value in a, value in b) for registers that differ, None where missing."""
+    return [(reg, a.get(reg), b.get(reg)) for reg in sorted(set(a) | set(b)) if a.get(reg) != b.get(reg)]
+
+
+def print_diff(diffs):
+    for reg, old, new in diffs:
+        print(f"  0x{reg:04X} {config.SETTING_NAMES.get(reg, ''):32s} {old!s:>6} -> {new!s:>6}")
+
+
+def diff(path_a, path_b):
+    diffs = register_diff(load(path_a)["registers"], load(path_b)["registers"])
+    print(f"{len(diffs)} registers differ between {path_a} and {path_b}:")
+    print_diff(diffs)
+
+
+def read_settled(inst, ranges, registers):
+    """Read until the registers agree in two reads in a row, or SETTLE_CEILING_S has passed."""
+    deadline = time.monotonic() + config.SETTLE_CEILING_S
+    delay = inst.settle.latency(inst, min(registers)) or inst.settle.initial
+    values, _ = read_registers(inst, ranges)
+    while time.monotonic() < deadline:
+        time.sleep(delay)
+        previous, (values, _) = values, read_registers(inst, ranges)
+        if all(previous.get(reg) == values.get(reg) for reg in registers):
+            break
+        delay *= 2
+    return values
+
+
+def restore(inst, path, dry_run=False):
+    snapshot = load(path)
+    wanted = {reg: v for reg, v in snapshot["registers"].items() if reg not in SKIP_ON_RESTORE}
+    current, ranges = read_registers(inst, snapshot["ranges"])
+    changes = [d for d in register_diff(current, wanted) if d[2] is not None]
+    if any(old is None for _, old, _ in changes):
+        raise ValueError("Unit is missing registers from the snapshot; different model or firmware?")
+    print(f"Unit {inst.address}: {len(changes)} registers to restore from {path}")
+    print_diff(changes)
+    plain = {reg: new for reg, _, new in changes if reg not in CONSTRAINED_REGS}
+    if dry_run or not changes:
+        return
+
+    # 1) Unconstrained registers, adjacent ones merged into FC16 blocks
+    if plain:
+        wb = inst.write_buffer()
+        for reg, value in plain.items():
+            wb.write_registers(reg, [value])
+        blocks = wb.plan()
+        wb.flush()
+        for start, values in blocks:
+            print(f"  0x{start:04X} x{len(values)}")
+            inst.settle.wait(inst, start, values, previous=[current[start + i] for i in range(len(values))])
+        if not wb.block_writes:
+            print("  Unit refused block writes, wrote single registers with FC06")
+        # The unit may load other setpoints with a new battery type
+        current = read_settled(inst, ranges, wanted)
+
+    # 2) Constrained setpoints, in a constraint-safe order, FC06 only if the unit refuses blocks
+    setpoints = {reg: current[reg] for reg in CONSTRAINED_REGS}
+    config.write_setpoints(
+        inst, setpoints,
+        lambda: {reg: v for reg, v in read_registers(inst, ranges)[0].items() if reg in CONSTRAINED_REGS},
+        lambda current: {reg: wanted[reg] for reg in CONSTRAINED_REGS if wanted[reg] != current[reg]},
+        writable=CONSTRAINED_REGS, constraints=CONSTRAINTS)
+
+    final, _ = read_registers(inst, ranges)
+    left = [d for d in register_diff(final, wanted) if d[2] is not None]
+    if left:
+        print(f"Unit {inst.address}: {len(left)} registers still differ:")
+        print_diff(left)
+    else:
+        print(f"Unit {inst.address}: restored and verified.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Snapshot, diff and restore EPEver holding registers")
+    parser.add_argument("command", choices=("dump", "diff", "restore"))
+    parser.add_argument("files", nargs="+", help="snapshot file, '{unit}' is replaced by the unit id; diff takes two")
+    parser.add_argument("--port", default=PORT, help="serial port, default %(default)s")
+    parser.add_argument("--baudrate", type=int, default=BAUDRATE, help="default %(default)s")
+    parser.add_argument("--units", type=int, nargs="+", default=[1], help="unit ids, default %(default)s")
+    parser.add_argument("--like", metavar="FILE", help="dump: reuse the register ranges found for an earlier snapshot")
+    parser.add_argument("--dry-run", action="store_true", help="restore: only show what would be written")
+    args = parser.parse_args()
+
+    if args.command == "diff":
+        if len(args.files) != 2:
+            parser.error("diff takes two snapshot files")
+        diff(*args.files)
+        return
+    if len(args.files) != 1:
+        parser.error(f"{args.command} takes one snapshot file")
+
+    failed = False
+    ranges = None
+    for unit in args.units:
+        path = args.files[0].format(unit=unit)
+        inst = init_instrument(args.port, unit, args.baudrate)
+        try:
+            # Hold the bus for the whole unit, pollers wait
+            with inst.bus_lock:
+                if args.command == "dump":
+                    if args.like:
+                        ranges = load(args.like.format(unit=unit))["ranges"]
+                    ranges = dump(inst, path, ranges)
+                else:
+                    restore(inst, path, args.dry_run)
+        except (IOError, ValueError) as e:
+            print(f"Unit {unit}: {args.command} failed: {e}")
+            failed = True
+        finally:
+            inst.close()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
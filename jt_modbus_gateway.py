@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+#
+# Local Modbus TCP gateway owning the EPEver RS485 bus
+#
+# One daemon opens the serial port and serves the controllers on it over
+# Modbus TCP on localhost, so jtracer.py, the jt_* tools and SCADA clients
+# can all share one physical bus:
+#  - Client requests are queued and sent on the bus one at a time, in arrival order.
+#  - Reads covered by a read already in flight go out once; all waiting clients get
+#    their part of the answer (minimalmodbus single-flight).
+#  - Registers read are cached for CACHE_TTL_S (minimalmodbus.RegisterCache); a write
+#    drops the registers written.
+#  - Slave exception responses are passed through; a unit that does not answer, or
+#    answers with a broken or mismatched frame, gets exception 0x0B (gateway target
+#    device failed to respond).
+#  - The MBAP unit id is the RS485 slave address. Requests are answered as soon as
+#    they complete, so clients may pipeline several by transaction id.
+#
+import argparse
+import asyncio
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+import minimalmodbus
+import serial
+
+# ---------------- CONFIG ----------------
+PORT = "/dev/ttyUSB0"
+BAUDRATE = 115200
+TIMEOUT_S = 0.5
+LISTEN_HOST = "127.0.0.1"
+LISTEN_PORT = 5020      # 502 needs root
+CACHE_TTL_S = 0.5
+CACHE_MAX = 4096        # registers kept, least recently used ones are evicted
+STATS_PERIOD_S = 60
+DEBUG = False
+# ----------------------------------------
+
+READ_FUNCTIONS = (1, 2, 3, 4)
+WRITE_FUNCTIONS = (5, 6, 15, 16, 23)   # 23 also reads, but after writing
+EXC_ILLEGAL_FUNCTION = 0x01
+EXC_ILLEGAL_DATA_VALUE = 0x03
+EXC_PATH_UNAVAILABLE = 0x0A
+EXC_TARGET_NO_RESPONSE = 0x0B
+MBAP = struct.Struct(">HHHB")   # transaction id, protocol id, length, unit id
+
+
+def init_instrument(port=PORT, baudrate=BAUDRATE):
+    inst = minimalmodbus.Instrument(port, 1, mode=minimalmodbus.MODE_RTU)
+    inst.serial.baudrate = baudrate
+    inst.serial.bytesize = 8
+    inst.serial.parity   = serial.PARITY_NONE
+    inst.serial.stopbits = 1
+    inst.serial.timeout  = TIMEOUT_S
+    inst.clear_buffers_before_each_transaction = True
+    inst.debug = DEBUG
+    # Still coexist with tools that open the port directly
+    inst.bus_lock = minimalmodbus.BusLock(port)
+    return inst
+
+
+def exception_pdu(fc, code):
+    return bytes([fc | 0x80, code])
+
+
+def bus_transaction(inst, unit, pdu):
+    """Send one request PDU to a unit on the RS485 bus and return the response PDU."""
+    fc = pdu[0]
+    try:
+        return inst.transact_pdu(unit, pdu)
+    except (TypeError, ValueError):
+        return exception_pdu(fc, EXC_ILLEGAL_DATA_VALUE)
+    except minimalmodbus.InvalidResponseError as e:
+        print(f"Invalid response from unit {unit} to function {fc}: {e}")
+        return exception_pdu(fc, EXC_TARGET_NO_RESPONSE)
+    except minimalmodbus.NoResponseError:
+        return exception_pdu(fc, EXC_TARGET_NO_RESPONSE)
+    except IOError as e:
+        print("Bus error:", e)
+        return exception_pdu(fc, EXC_PATH_UNAVAILABLE)
+
+
+class ExceptionResponse(Exception):
+    """A request answered with a Modbus exception PDU, raised to all clients merged into it."""
+
+    def __init__(self, pdu):
+        super().__init__(f"exception 0x{pdu[1]:02X}")
+        self.pdu = pdu
+
+
+class Gateway:
+    def __init__(self, inst, ttl=CACHE_TTL_S):
+        self.inst = inst
+        self.bus = ThreadPoolExecutor(max_workers=1)    # the only thread on the bus, FIFO
+        self.inflight = minimalmodbus.SingleFlight()    # identical and overlapping reads share one
+        self.cache = minimalmodbus.RegisterCache(default_ttl=ttl, maxsize=CACHE_MAX)
+        self.stats = dict.fromkeys(("requests", "cached", "merged", "bus"), 0)
+
+    def transaction(self, unit, pdu):
+        """On the bus thread: perform the request, and return the response PDU without function code."""
+        self.stats["bus"] += 1
+        fc, payload = pdu[0], pdu[1:]
+        response = bus_transaction(self.inst, unit, pdu)
+        failed = not response or response[0] & 0x80
+        # Still on the bus thread, so a read overtaken by a write is never cached;
+        # a write drops the registers written, also when it failed
+        self.cache.update(unit, fc, payload, b"" if failed else response[1:])
+        if response and failed:
+            raise ExceptionResponse(response)
+        return response[1:]
+
+    async def request(self, unit, pdu):
+        self.stats["requests"] += 1
+        fc, payload = pdu[0], pdu[1:]
+        if fc not in READ_FUNCTIONS + WRITE_FUNCTIONS:
+            return exception_pdu(fc, EXC_ILLEGAL_FUNCTION)
+        if len(payload) < (8 if fc == 23 else 4):
+            return exception_pdu(fc, EXC_ILLEGAL_DATA_VALUE)
+        loop = asyncio.get_running_loop()
+        led = []
+
+        def on_bus():
+            led.append(True)
+            return loop.run_in_executor(self.bus, self.transaction, unit, pdu)
+
+        try:
+            if fc in READ_FUNCTIONS and unit:
+                response = self.cache.lookup(unit, fc, payload)
+                if response is not None:
+                    self.stats["cached"] += 1
+                    return bytes([fc]) + response
+                key = (self.inst.serial.port, unit, fc)
+                response = await self.inflight.perform_async(key, fc, payload, on_bus)
+                if not led:
+                    self.stats["merged"] += 1
+            else:
+                # One client disconnecting must not cancel the write
+                response = await asyncio.shield(on_bus())
+        except ExceptionResponse as e:
+            return e.pdu
+        return bytes([fc]) + response if response or unit else b""
+
+    async def answer(self, writer, tid, unit, pdu):
+        response = await self.request(unit, pdu)
+        if response and not writer.is_closing():
+            writer.write(MBAP.pack(tid, 0, len(response) + 1, unit) + response)
+
+    async def serve_client(self, reader, writer):
+        tasks = set()
+        try:
+            while True:
+                tid, protocol, length, unit = MBAP.unpack(await reader.readexactly(MBAP.size))
+                if protocol != 0 or length < 2:
+                    break
+                pdu = await reader.readexactly(length - 1)
+                task = asyncio.ensure_future(self.answer(writer, tid, unit, pdu))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if tasks:
+                await asyncio.wait(tasks)
+            writer.close()
+
+    async def print_stats(self, period=STATS_PERIOD_S):
+        while True:
+            await asyncio.sleep(period)
+            print("Requests: {requests}, from cache: {cached}, merged: {merged}, on the bus: {bus}".format(**self.stats))
+
+
+async def serve(gateway, host=LISTEN_HOST, port=LISTEN_PORT):
+    server = await asyncio.start_server(gateway.serve_client, host, port)
+    print(f"Serving {gateway.inst.serial.port} as Modbus TCP on {host}:{port}")
+    stats = asyncio.ensure_future(gateway.print_stats())
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        stats.cancel()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Modbus TCP gateway owning the EPEver RS485 bus")
+    parser.add_argument("--port", default=PORT, help="serial port, default %(default)s")
+    parser.add_argument("--baudrate", type=int, default=BAUDRATE, help="default %(default)s")
+    parser.add_argument("--listen", default=f"{LISTEN_HOST}:{LISTEN_PORT}", metavar="HOST:PORT", help="default %(default)s")
+    parser.add_argument("--ttl", type=float, default=CACHE_TTL_S, help="read cache lifetime in seconds, 0 disables, default %(default)s")
+    args = parser.parse_args()
+    host, _, port = args.listen.rpartition(":")
+    gateway = Gateway(init_instrument(args.port, args.baudrate), args.ttl)
+    try:
+        asyncio.run(serve(gateway, host or LISTEN_HOST, int(port)))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
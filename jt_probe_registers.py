@@ -21,6 +21,7 @@ def init_instrument():
   inst.serial.timeout  = 1
   inst.clear_buffers_before_each_transaction = True
   inst.debug = False  # set True if you want raw Modbus frames
+  inst.bus_lock = minimalmodbus.BusLock(PORT, priority=True)  # locked per read
   return inst
 
 def main():
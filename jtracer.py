@@ -11,16 +11,47 @@ https://minimalmodbus.readthedocs.io/en/stable/apiminimalmodbus.html -- API for
 Jeremy Tammik, 2021-06-12
 '''
 
-from time import gmtime, sleep, strftime
+import argparse
+import os
+import queue
+import struct
+from collections import deque
+from multiprocessing import Process, resource_tracker, shared_memory
+from threading import Lock, Thread
+from math import inf
+from time import gmtime, monotonic, sleep, strftime, time
 import minimalmodbus
 
 # Define the registers from the PDF documentation
 
 PORT='/dev/tty.SLAB_USBtoUART' # MacOS
 PORT='/dev/ttyUSB0' # Linux Mint
+PV_RATED_VOLTAGE = 0x3000 # PV array rated voltage
+PV_RATED_CURRENT = 0x3001 # PV array rated current
+PV_RATED_POWER_L = 0x3002 # PV array rated power L
+PV_RATED_POWER_H = 0x3003 # PV array rated power H
+BATT_RATED_VOLTAGE = 0x3004 # Rated voltage to battery
+BATT_RATED_CURRENT = 0x3005 # Rated charging current to battery
+BATT_RATED_POWER_L = 0x3006 # Rated charging power to battery L
+BATT_RATED_POWER_H = 0x3007 # Rated charging power to battery H
+CHARGING_MODE = 0x3008 # 0 connect/disconnect, 1 PWM, 2 MPPT
 PV_VOLTAGE = 0x3100
 PV_CURRENT = 0x3101
+PV_POWER_L = 0x3102 # PV array input power L
+PV_POWER_H = 0x3103 # PV array input power H
+CHARGING_VOLTAGE = 0x3104 # Charging equipment output voltage
+CHARGING_CURRENT = 0x3105 # Charging equipment output current
+CHARGING_POWER_L = 0x3106 # Charging equipment output power L
+CHARGING_POWER_H = 0x3107 # Charging equipment output power H
+BATT_TEMP = 0x3110 # Battery temperature
+DEVICE_TEMP = 0x3111 # Temperature inside equipment
+POWER_COMPONENTS_TEMP = 0x3112 # Power components temperature
 BATT_SOC = 0x311A # state of charge, the percentage of battery remaining capacity
+BATT_STATUS = 0x3200 # Battery status bits
+CHARGING_STATUS = 0x3201 # Charging equipment status bits
+DISCHARGING_STATUS = 0x3202 # Discharging equipment status bits
+PV_VOLTAGE_MAX_DAY = 0x3300 # Maximum input voltage today
+PV_VOLTAGE_MIN_DAY = 0x3301 # Minimum input voltage today
 BATT_VOLTAGE_MAX_DAY = 0x3302 # Maximum battery voltage today
 BATT_VOLTAGE_MIN_DAY = 0x3303 # Minimum battery voltage today
 KWH_CONSUMED_DAY_L = 0x3304 # Consumed energy today L
@@ -42,97 +73,745 @@ KWH_TOTAL_H = 0x3313 # Total generated energy H
 BATT_VOLTAGE = 0x331A # Battery voltage
 BATT_CURRENT_L = 0x331B # Battery current L
 BATT_CURRENT_H = 0x331C # Battery current H
+DAY_NIGHT = 0x200C # Discrete input, 1 = night, 0 = day
 
-def setParameters( port, baudrate ):
-  'set parameters for communication'
+# Decoded fields: name -> (register, decimals, number of registers, signed).
+# Two-register values are stored low word first.
+
+FIELDS = {
+  'pv_rated_voltage': ( PV_RATED_VOLTAGE, 2, 1, False ),
+  'pv_rated_current': ( PV_RATED_CURRENT, 2, 1, False ),
+  'pv_rated_power': ( PV_RATED_POWER_L, 2, 2, False ),
+  'batt_rated_voltage': ( BATT_RATED_VOLTAGE, 2, 1, False ),
+  'batt_rated_current': ( BATT_RATED_CURRENT, 2, 1, False ),
+  'batt_rated_power': ( BATT_RATED_POWER_L, 2, 2, False ),
+  'charging_mode': ( CHARGING_MODE, 0, 1, False ),
+  'pv_voltage': ( PV_VOLTAGE, 2, 1, False ),
+  'pv_current': ( PV_CURRENT, 2, 1, False ),
+  'pv_power': ( PV_POWER_L, 2, 2, False ),
+  'charging_voltage': ( CHARGING_VOLTAGE, 2, 1, False ),
+  'charging_current': ( CHARGING_CURRENT, 2, 1, False ),
+  'charging_power': ( CHARGING_POWER_L, 2, 2, False ),
+  'batt_temp': ( BATT_TEMP, 2, 1, True ),
+  'device_temp': ( DEVICE_TEMP, 2, 1, True ),
+  'power_components_temp': ( POWER_COMPONENTS_TEMP, 2, 1, True ),
+  'batt_soc': ( BATT_SOC, 0, 1, False ),
+  'batt_status': ( BATT_STATUS, 0, 1, False ),
+  'charging_status': ( CHARGING_STATUS, 0, 1, False ),
+  'discharging_status': ( DISCHARGING_STATUS, 0, 1, False ),
+  'pv_voltage_max_day': ( PV_VOLTAGE_MAX_DAY, 2, 1, False ),
+  'pv_voltage_min_day': ( PV_VOLTAGE_MIN_DAY, 2, 1, False ),
+  'batt_voltage_max_day': ( BATT_VOLTAGE_MAX_DAY, 2, 1, False ),
+  'batt_voltage_min_day': ( BATT_VOLTAGE_MIN_DAY, 2, 1, False ),
+  'kwh_consumed_day': ( KWH_CONSUMED_DAY_L, 2, 2, False ),
+  'kwh_consumed_month': ( KWH_CONSUMED_MONTH_L, 2, 2, False ),
+  'kwh_consumed_year': ( KWH_CONSUMED_YEAR_L, 2, 2, False ),
+  'kwh_consumed_total': ( KWH_CONSUMED_TOTAL_L, 2, 2, False ),
+  'kwh_day': ( KWH_DAY_L, 2, 2, False ),
+  'kwh_month': ( KWH_MONTH_L, 2, 2, False ),
+  'kwh_year': ( KWH_YEAR_L, 2, 2, False ),
+  'kwh_total': ( KWH_TOTAL_L, 2, 2, False ),
+  'batt_voltage': ( BATT_VOLTAGE, 2, 1, False ),
+  'batt_current': ( BATT_CURRENT_L, 2, 2, True ),
+}
+
+# Decoded discrete inputs: name -> input address
+
+BITS = {
+  'night': DAY_NIGHT,
+}
+
+# Register groups, each read as a few contiguous input register blocks
+# (start, count) and discrete input blocks, polled at its own period in
+# seconds. A period of None means read once per session. Adaptive groups
+# also give an 'idle' period used at night and a 'burst' period used for
+# BURST_WINDOW seconds after a battery current transient; 0 polls as fast
+# as the bus allows.
+
+GROUPS = {
+  'realtime': { 'period': 1, 'idle': 120, 'burst': 0, 'blocks': [
+    ( PV_VOLTAGE, 8 ), ( BATT_VOLTAGE, 3 ) ] },
+  'battery': { 'period': 10, 'idle': 300, 'blocks': [
+    ( BATT_TEMP, 3 ), ( BATT_SOC, 1 ), ( BATT_STATUS, 3 ) ] },
+  'daynight': { 'period': 60, 'blocks': [], 'inputs': [ ( DAY_NIGHT, 1 ) ] },
+  'daily': { 'period': 300, 'blocks': [ ( PV_VOLTAGE_MAX_DAY, 20 ) ] },
+  'rated': { 'period': None, 'blocks': [ ( PV_RATED_VOLTAGE, 9 ) ] },
+}
+
+NIGHT_PV_VOLTAGE = 5.0 # V, PV below this counts as night as well
+TRANSIENT_CURRENT = 1.0 # A, battery current step that triggers a burst
+BURST_WINDOW = 30 # seconds to keep bursting after a transient
+RETRY_PERIOD = 10 # seconds before retrying a group whose read failed
+
+# Dead-bands for change-only emission: field -> (absolute, relative).
+# A field is emitted when it moved by more than the larger of both bands
+# since it was last emitted, or when HEARTBEAT seconds have passed.
+# Fields not listed here are emitted on any change.
+
+DEADBANDS = {
+  'pv_voltage': ( 0.5, 0.01 ),
+  'pv_current': ( 0.05, 0.02 ),
+  'pv_power': ( 2.0, 0.02 ),
+  'charging_voltage': ( 0.05, 0.0 ),
+  'charging_current': ( 0.05, 0.02 ),
+  'charging_power': ( 2.0, 0.02 ),
+  'batt_voltage': ( 0.05, 0.0 ),
+  'batt_current': ( 0.05, 0.02 ),
+  'batt_temp': ( 0.5, 0.0 ),
+  'device_temp': ( 0.5, 0.0 ),
+  'power_components_temp': ( 0.5, 0.0 ),
+}
+HEARTBEAT = 300 # seconds
+
+# Burst capture reads only the compact PV voltage, current, power and
+# battery charging voltage and current block
+
+BURST_START = PV_VOLTAGE
+BURST_COUNT = 6
+BURST_SAMPLES = 100000 # ring buffer size
+
+# Array totals over several controllers on one bus: total name -> summed field
+
+TOTALS = {
+  'total_pv_power': 'pv_power',
+  'total_charging_power': 'charging_power',
+  'total_charging_current': 'charging_current',
+  'total_kwh_day': 'kwh_day',
+  'total_kwh_total': 'kwh_total',
+}
+BUS_TIMEOUT = 0.5 # seconds to wait for one unit on a shared bus
+MAX_BACKOFF = 300 # seconds, longest wait before retrying a dead unit
+ALIGN_PERIOD = 1 # seconds between merged samples across several ports
+RING_SLOTS = 4096 # samples buffered per farm worker process
+SNAPSHOT_VERSION = 1 # layout of the shared memory snapshot segment
+
+def setParameters( port, baudrate, slave=1, timeout=1 ):
+  'set parameters for communication; raise IOError if no device found'
+  ins = minimalmodbus.Instrument(port, slave, debug=False)
+
+  ins.serial.baudrate = baudrate
+  #ins.serial.bytesize = 8
+  #ins.serial.stopbits = 1
+  #ins.serial.parity = serial.PARITY_NONE
+  ins.serial.timeout = timeout
+  #
+  #ins.mode = minimalmodbus.MODE_RTU
+  #ins.clear_buffers_before_each_transaction = True
+
+  return ins
+
+def decode( raw, fields=FIELDS, bits=None, bitfields=BITS ):
+  'decode all fields fully contained in the raw register and input dictionaries'
+  if bits is None:
+    bits = {}
+  values = {}
+  for name, ( r, decimals, count, signed ) in fields.items():
+    if r not in raw or ( count == 2 and r + 1 not in raw ):
+      continue
+    x = raw[r] if count == 1 else raw[r] | ( raw[r + 1] << 16 )
+    nbits = 16 * count
+    if signed and x >= 1 << ( nbits - 1 ):
+      x -= 1 << nbits
+    values[name] = x / 10 ** decimals if decimals else x
+  for name, a in bitfields.items():
+    if a in bits:
+      values[name] = bits[a]
+  return values
+
+def cacheRanges( groups ):
+  'register cache time-to-live per group block: half the shortest poll period, forever for groups read once'
+  ranges = []
+  for group in groups.values():
+    periods = [p for p in ( group['period'], group.get( 'idle' ), group.get( 'burst' ) ) if p is not None]
+    ttl = min( periods ) / 2 if periods else inf
+    ranges += [( 4, start, count, ttl ) for start, count in group['blocks']]
+  return ranges
+
+class Sample:
+  '''Decoded field values of one refresh, None for fields not read.
+  Scaled fields are float, raw status fields and inputs int;
+  t is the monotonic time the refresh completed.'''
+
+  __slots__ = ( 't', ) + tuple( FIELDS ) + tuple( BITS )
+
+  def __init__( self, t, values ):
+    self.t = t
+    for name in self.__slots__[1:]:
+      setattr( self, name, values.get( name ) )
+
+  def asdict( self ):
+    'return the fields that were read'
+    return { name: getattr( self, name ) for name in self.__slots__[1:] if getattr( self, name ) is not None }
+
+  def __repr__( self ):
+    return 'Sample(%.3f, %r)' % ( self.t, self.asdict() )
+
+class EpeverTracer:
+  '''EPEver Tracer charge controller on a Modbus RS485 port.
+  The port is opened on first use, so constructing one has no side effects.'''
+
+  def __init__( self, port=PORT, slave=1, baudrate=115200, groups=GROUPS, timeout=1 ):
+    self.port = port
+    self.slave = slave
+    self.baudrate = baudrate
+    self.groups = groups
+    self.timeout = timeout
+    self._instrument = None
+
+  @property
+  def instrument( self ):
+    'the minimalmodbus instrument, connected on first access'
+    if self._instrument is None:
+      self._instrument = setParameters( self.port, self.baudrate, self.slave, self.timeout )
+      self._instrument.bus_lock = minimalmodbus.BusLock( self.port )
+      # Consumers sharing this tracer get slow changing values like rated
+      # data and daily energy without going to the bus again
+      self._instrument.cache = minimalmodbus.RegisterCache( cacheRanges( self.groups ) )
+    return self._instrument
+
+  def refresh( self, groups=None ):
+    'read the given groups, all by default, in as few transactions as Instrument.batch() merges them into'
+    groups = groups or list( self.groups )
+    # One batch under the bus lock: a consistent snapshot, no interleaved config writes
+    with self.instrument.batch() as batch:
+      blocks = [( start, batch.read_registers( start, count, 4 ) )
+        for g in groups for start, count in self.groups[g]['blocks']]
+      inputs = [( start, batch.read_bits( start, count, 2 ) )
+        for g in groups for start, count in self.groups[g].get( 'inputs', [] )]
+    raw = { start + i: x for start, read in blocks for i, x in enumerate( read.result() ) }
+    bits = { start + i: x for start, read in inputs for i, x in enumerate( read.result() ) }
+    return Sample( monotonic(), decode( raw, bits=bits ) )
+
+def pollMode( values, state, now ):
+  'classify the live state as burst, idle or normal polling'
+  current = values.get( 'batt_current' )
+  last = state.get( 'batt_current' )
+  state['batt_current'] = current
+  if current is not None and last is not None and abs( current - last ) >= TRANSIENT_CURRENT:
+    state['burst_until'] = now + BURST_WINDOW
+  if now < state.get( 'burst_until', 0.0 ):
+    return 'burst'
+  if values.get( 'night' ) or values.get( 'pv_voltage', NIGHT_PV_VOLTAGE ) < NIGHT_PV_VOLTAGE:
+    return 'idle'
+  return 'period'
+
+def field( v, name, spec='%s' ):
+  'format one value of the sample, or - if this or an earlier cycle failed to read it'
+  x = v.get( name )
+  return '-' if x is None else spec % x
+
+def report( t, polled, v ):
+  'print the values of the groups polled in this cycle'
+  f = lambda name, spec='%s': field( v, name, spec )
+  if 'rated' in polled:
+    print('Rated PV: %s V %s A %s W -- Battery: %s V %s A %s W' % (f('pv_rated_voltage', '%.2f'), f('pv_rated_current', '%.2f'), f('pv_rated_power', '%.2f'), f('batt_rated_voltage', '%.2f'), f('batt_rated_current', '%.2f'), f('batt_rated_power', '%.2f')))
+  if 'daily' in polled:
+    print(t)
+    print('Day Min', f('batt_voltage_min_day'), 'V, Max', f('batt_voltage_max_day'), 'V')
+    print('kWh day/month/year/total', f('kwh_day'), f('kwh_month'), f('kwh_year'), f('kwh_total'))
+    print('Consumed kWh day/month/year/total', f('kwh_consumed_day'), f('kwh_consumed_month'), f('kwh_consumed_year'), f('kwh_consumed_total'))
+  if 'realtime' in polled and 'batt_voltage' in v:
+    power = { 'batt_power': v['batt_voltage'] * v['batt_current'] } if 'batt_current' in v else {}
+    print('%s -- PV: %5s V %4s A %6s W -- Battery: %5s V %5s A %6s W %s %s' % (t, f('pv_voltage', '%.2f'), f('pv_current', '%.2f'), f('pv_power', '%.2f'), f('batt_voltage', '%.2f'), f('batt_current', '%.2f'), field( power, 'batt_power', '%.2f' ), f('batt_soc', '%.0f'), '%'))
+
+def changes( values, emitted, now, deadbands=DEADBANDS, heartbeat=HEARTBEAT ):
+  'return the fields that left their dead-band or whose heartbeat expired, and remember them as emitted'
+  changed = {}
+  for name, x in values.items():
+    if name in emitted:
+      y, t = emitted[name]
+      absolute, relative = deadbands.get( name, ( 0.0, 0.0 ) )
+      if abs( x - y ) <= max( absolute, relative * abs( y ) ) and now - t < heartbeat:
+        continue
+    changed[name] = x
+    emitted[name] = ( x, now )
+  return changed
+
+def printChanges( t, changed ):
+  'print one line with the fields that changed'
+  print( t, ' '.join( '%s=%s' % item for item in changed.items() ) )
+
+def pollForever( tracer, groups=None, sink=None, snapshot=None ):
+  '''poll each register group at its own, state dependent period; run until no group is left.
+  Without a sink, print the full report for each cycle; otherwise call
+  sink( t, changed ) with only the fields that moved beyond their dead-band.
+  Publish each fresh read to the shared memory snapshot, if given'''
+  groups = groups or tracer.groups
+  values = {}
+  state = {}
+  emitted = {}
+  mode = 'period'
+  due = dict.fromkeys( groups, 0.0 )
+  while due:
+    now = monotonic()
+    t = strftime('%Y-%m-%d %H:%M:%S', gmtime())
+    polled = [n for n in due if due[n] <= now]
+    try:
+      fresh = tracer.refresh( polled ).asdict()
+    except IOError as e:
+      fresh = {}
+      print( 'Failed to read register groups %s: %s' % ( ', '.join( polled ), e ) )
+      for name in polled:
+        due[name] = now + ( groups[name].get( mode, groups[name]['period'] ) or RETRY_PERIOD )
+      polled = []
+    values.update( fresh )
+    if snapshot and fresh:
+      snapshot.publish( fresh )
+    for name in polled:
+      period = groups[name].get( mode, groups[name]['period'] )
+      if period is None:
+        del due[name]
+      else:
+        # Keep a fixed cadence, but do not try to catch up on missed cycles
+        due[name] += period
+        if due[name] <= now:
+          due[name] = now + period
+    if sink is None:
+      report( t, polled, values )
+    else:
+      changed = changes( values, emitted, now )
+      if changed:
+        sink( t, changed )
+    newmode = pollMode( values, state, now )
+    if newmode != mode:
+      # Pull in groups that are now due earlier than planned in the old mode
+      mode = newmode
+      for name in due:
+        if mode in groups[name]:
+          due[name] = min( due[name], now + groups[name][mode] )
+    if due:
+      sleep( max( 0.0, min( due.values() ) - monotonic() ) )
+  return values
+
+class Totals:
+  'streaming array totals over several units, updated per sample instead of summed over all units each time'
+
+  def __init__( self, totals=TOTALS ):
+    self.totals = totals
+    self.sums = dict.fromkeys( totals, 0.0 )
+    self._contributions = {}
+
+  def update( self, unit, values ):
+    'replace the contribution of this unit by its new values'
+    for name, field in self.totals.items():
+      if field in values:
+        x = values[field]
+        self.sums[name] += x - self._contributions.get( ( unit, name ), 0.0 )
+        self._contributions[( unit, name )] = x
+
+  def drop( self, unit ):
+    'remove the contribution of a unit that stopped answering'
+    for name in self.totals:
+      self.sums[name] -= self._contributions.pop( ( unit, name ), 0.0 )
+
+class BusPoller:
+  '''Several controllers chained on one RS485 bus with different slave ids.
+  units is a list of slave ids sharing the default GROUPS, or a dict
+  mapping each slave id to its own register groups and rates.'''
+
+  def __init__( self, units, port=PORT, baudrate=115200, timeout=BUS_TIMEOUT ):
+    if not isinstance( units, dict ):
+      units = dict.fromkeys( units, GROUPS )
+    self.port = port
+    self.tracers = { slave: EpeverTracer( port, slave, baudrate, groups, timeout ) for slave, groups in units.items() }
+
+def printUnit( t, slave, values, totals ):
+  'print the realtime values of one unit and the array totals'
+  if 'pv_power' in values:
+    print( '%s -- unit %d PV: %6.2f W -- Charging: %5.2f A -- Array PV: %7.2f W %6.2f A' % ( t, slave, values['pv_power'], values['charging_current'], totals['total_pv_power'], totals['total_charging_current'] ) )
+
+def pollBus( poller, sink=printUnit, drop=None ):
+  '''poll all units on a shared bus round-robin, one unit's due groups per turn,
+  so that the bus stays busy without one unit hogging it. The silent period
+  between frames is kept by minimalmodbus per port. A unit that fails to
+  answer is retried with exponential back-off and left out of the totals
+  until it recovers, so dead units do not stall the others. Call
+  sink( t, slave, values, totals ) after each successful read and
+  drop( slave ) when a unit fails.'''
+  tracers = poller.tracers
+  totals = Totals()
+  due = { ( slave, g ): 0.0 for slave, tracer in tracers.items() for g in tracer.groups }
+  fails = dict.fromkeys( tracers, 0 )
+  state = { slave: {} for slave in tracers }
+  mode = dict.fromkeys( tracers, 'period' )
+  order = deque( tracers )
+  while due:
+    now = monotonic()
+    for _ in range( len( order ) ):
+      slave = order[0]
+      order.rotate( -1 )
+      polled = [g for ( s, g ), d in due.items() if s == slave and d <= now]
+      if polled:
+        break
+    else:
+      sleep( max( 0.0, min( due.values() ) - monotonic() ) )
+      continue
+    groups = tracers[slave].groups
+    t = strftime('%Y-%m-%d %H:%M:%S', gmtime())
+    try:
+      values = tracers[slave].refresh( polled ).asdict()
+    except IOError as e:
+      fails[slave] += 1
+      if fails[slave] == 1:
+        print( 'Unit %d on %s failed to answer, backing off: %s' % ( slave, poller.port, e ) )
+      totals.drop( slave )
+      if drop:
+        drop( slave )
+      backoff = min( RETRY_PERIOD * 2 ** ( fails[slave] - 1 ), MAX_BACKOFF )
+      for g in polled:
+        due[( slave, g )] = now + backoff
+      continue
+    if fails[slave]:
+      print( 'Unit %d on %s answers again after %d failures' % ( slave, poller.port, fails[slave] ) )
+      fails[slave] = 0
+    for g in polled:
+      period = groups[g].get( mode[slave], groups[g]['period'] )
+      if period is None:
+        del due[( slave, g )]
+      else:
+        due[( slave, g )] += period
+        if due[( slave, g )] <= now:
+          due[( slave, g )] = now + period
+    totals.update( slave, values )
+    sink( t, slave, values, totals.sums )
+    newmode = pollMode( values, state[slave], now )
+    if newmode != mode[slave]:
+      mode[slave] = newmode
+      for ( s, g ) in due:
+        if s == slave and newmode in groups[g]:
+          due[( s, g )] = min( due[( s, g )], now + groups[g][newmode] )
+  return totals.sums
+
+def printArray( t, latest, totals ):
+  'print the array totals over all ports'
+  print( '%s -- %d units -- Array PV: %7.2f W -- Charging: %6.2f A -- Today: %.2f kWh' % ( t, len( latest ), totals['total_pv_power'], totals['total_charging_current'], totals['total_kwh_day'] ) )
+
+def pollPorts( ports, sink=printArray, period=ALIGN_PERIOD, baudrate=115200 ):
+  '''poll several serial ports in parallel, one worker thread per port owning
+  its own instruments, so throughput grows with the number of adapters.
+  ports maps each port to its units as accepted by BusPoller. The samples
+  are merged into one stream aligned on period ticks: call
+  sink( t, latest, totals ) once per tick with the latest values of every
+  live ( port, slave ) unit and the array totals over all of them.'''
+  samples = queue.Queue()
+  for port, units in ports.items():
+    put = lambda t, slave, values, totals, port=port: samples.put( ( port, slave, values ) )
+    drop = lambda slave, port=port: samples.put( ( port, slave, None ) )
+    Thread( target=pollBus, args=( BusPoller( units, port, baudrate ), put, drop ), daemon=True ).start()
+  latest = {}
+  totals = Totals()
+  tick = monotonic()
+  while True:
+    tick += period
+    while True:
+      try:
+        port, slave, values = samples.get( timeout=max( 0.0, tick - monotonic() ) )
+      except queue.Empty:
+        break
+      if values is None:
+        latest.pop( ( port, slave ), None )
+        totals.drop( ( port, slave ) )
+      else:
+        latest.setdefault( ( port, slave ), {} ).update( values )
+        totals.update( ( port, slave ), values )
+    sink( strftime('%Y-%m-%d %H:%M:%S', gmtime()), latest, totals.sums )
+    # Do not try to catch up on missed ticks
+    tick = max( tick, monotonic() )
+
+class SampleRing:
+  '''Single producer, single consumer ring of decoded samples in shared memory.
+  Each slot holds t, port index, slave, a drop flag and one double per
+  Sample field, NaN if not read, so the reader unpacks without pickling.
+  The header holds the head and tail counters written by producer and
+  consumer respectively; a full ring drops new samples and counts them.'''
+
+  NAMES = Sample.__slots__[1:]
+  HEADER = struct.Struct( '<QQQ' ) # head, tail, overruns
+  SLOT = struct.Struct( '<dHHH2x%dd' % len( NAMES ) )
+
+  def __init__( self, shm, slots ):
+    self.shm = shm
+    self.slots = slots
+    self.lock = Lock() # between the producer's port threads
+
+  @classmethod
+  def create( cls, slots=RING_SLOTS ):
+    shm = shared_memory.SharedMemory( create=True, size=cls.HEADER.size + slots * cls.SLOT.size )
+    cls.HEADER.pack_into( shm.buf, 0, 0, 0, 0 )
+    return cls( shm, slots )
+
+  @classmethod
+  def attach( cls, name, slots ):
+    'open a ring created in another process; only the name and slot count cross the process boundary'
+    # Workers share the creator's resource tracker, which unlinks the segment if the creator dies
+    return cls( shared_memory.SharedMemory( name ), slots )
+
+  def put( self, t, port, slave, values ):
+    'append one sample; values None marks the unit as dropped'
+    nan = float( 'nan' )
+    fields = [nan] * len( self.NAMES ) if values is None else [values.get( n, nan ) for n in self.NAMES]
+    with self.lock:
+      head, tail, overruns = self.HEADER.unpack_from( self.shm.buf, 0 )
+      if head - tail >= self.slots:
+        struct.pack_into( '<Q', self.shm.buf, 16, overruns + 1 )
+        return
+      self.SLOT.pack_into( self.shm.buf, self.HEADER.size + ( head % self.slots ) * self.SLOT.size, t, port, slave, values is None, *fields )
+      # Publish the slot only once it is complete
+      struct.pack_into( '<Q', self.shm.buf, 0, head + 1 )
+
+  def drain( self ):
+    'return the samples written since the last drain as ( t, port, slave, values ) tuples'
+    head, tail, overruns = self.HEADER.unpack_from( self.shm.buf, 0 )
+    samples = []
+    for k in range( tail, head ):
+      t, port, slave, dropped, *fields = self.SLOT.unpack_from( self.shm.buf, self.HEADER.size + ( k % self.slots ) * self.SLOT.size )
+      values = None if dropped else { n: x for n, x in zip( self.NAMES, fields ) if x == x }
+      samples.append( ( t, port, slave, values ) )
+    struct.pack_into( '<Q', self.shm.buf, 8, head )
+    return samples
+
+  def overruns( self ):
+    'number of samples dropped because the ring was full'
+    return self.HEADER.unpack_from( self.shm.buf, 0 )[2]
+
+def snapshotName( port=PORT ):
+  'name of the shared memory snapshot segment published for a port'
+  return 'jtracer' + port.replace( '/', '-' )
+
+class Snapshot:
+  '''Latest decoded values in a named shared memory segment, so that local
+  readers such as a dashboard or alarm script get them without touching
+  the bus. The segment holds version, field count and a sequence number,
+  then a value and a wall clock time stamp for each Sample field; a time
+  stamp of 0 means never read. The writer keeps the sequence number odd
+  while updating (seqlock), so readers retry instead of seeing a torn
+  snapshot.'''
+
+  NAMES = Sample.__slots__[1:]
+  INDEX = { name: i for i, name in enumerate( NAMES ) }
+  HEADER = struct.Struct( '<IIQ' ) # version, field count, sequence
+  DATA = struct.Struct( '<%dd' % ( 2 * len( NAMES ) ) ) # value, time stamp per field
+  SEQUENCE = 8 # offset of the sequence number
+
+  def __init__( self, name=None, create=False ):
+    self.name = name or snapshotName()
+    self.owner = create
+    size = self.HEADER.size + self.DATA.size
+    if create:
+      try:
+        self.shm = shared_memory.SharedMemory( self.name, create=True, size=size )
+      except FileExistsError:
+        # Left behind by a poller that did not exit cleanly; an older layout has another size
+        self.shm = shared_memory.SharedMemory( self.name )
+        if self.shm.size != size:
+          self.shm.close()
+          self.shm.unlink()
+          self.shm = shared_memory.SharedMemory( self.name, create=True, size=size )
+      self._data = [0.0] * ( 2 * len( self.NAMES ) )
+      self._sequence = 0
+      self.HEADER.pack_into( self.shm.buf, 0, SNAPSHOT_VERSION, len( self.NAMES ), 0 )
+      self.DATA.pack_into( self.shm.buf, self.HEADER.size, *self._data )
+    else:
+      self.shm = shared_memory.SharedMemory( self.name )
+      # Readers must not unlink the segment when they exit
+      resource_tracker.unregister( self.shm._name, 'shared_memory' )
+      version, count, sequence = self.HEADER.unpack_from( self.shm.buf, 0 )
+      if ( version, count ) != ( SNAPSHOT_VERSION, len( self.NAMES ) ):
+        raise ValueError( 'Snapshot %s has layout %d with %d fields, expected %d with %d' % ( self.name, version, count, SNAPSHOT_VERSION, len( self.NAMES ) ) )
+
+  def publish( self, values, t=None ):
+    'store the given freshly read values, time stamped now'
+    t = t or time()
+    for name, x in values.items():
+      i = 2 * self.INDEX[name]
+      self._data[i:i + 2] = ( x, t )
+    self._sequence += 1
+    struct.pack_into( '<Q', self.shm.buf, self.SEQUENCE, self._sequence )
+    self.DATA.pack_into( self.shm.buf, self.HEADER.size, *self._data )
+    self._sequence += 1
+    struct.pack_into( '<Q', self.shm.buf, self.SEQUENCE, self._sequence )
+
+  def read( self ):
+    'return a consistent dict name -> ( value, time stamp ) of the fields read so far'
+    while True:
+      before, = struct.unpack_from( '<Q', self.shm.buf, self.SEQUENCE )
+      if before % 2 == 0:
+        data = self.DATA.unpack_from( self.shm.buf, self.HEADER.size )
+        after, = struct.unpack_from( '<Q', self.shm.buf, self.SEQUENCE )
+        if before == after:
+          break
+      sleep( 0 )
+    return { name: ( data[2 * i], data[2 * i + 1] ) for i, name in enumerate( self.NAMES ) if data[2 * i + 1] }
+
+  def close( self ):
+    'detach, and remove the segment if we created it'
+    self.shm.close()
+    if self.owner:
+      self.shm.unlink()
+
+def farmWorker( shard, name, slots ):
+  'poll a shard of ( index, config ) ports, one thread each, publishing into the named ring'
+  ring = SampleRing.attach( name, slots )
+  threads = []
+  for index, config in shard:
+    put = lambda t, slave, values, totals, index=index: ring.put( monotonic(), index, slave, values )
+    drop = lambda slave, index=index: ring.put( monotonic(), index, slave, None )
+    poller = BusPoller( config['slaves'], config['port'], config.get( 'baudrate', 115200 ), config.get( 'timeout', BUS_TIMEOUT ) )
+    threads.append( Thread( target=pollBus, args=( poller, put, drop ), daemon=True ) )
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+
+def farm( configs, workers=None, sink=printArray, period=ALIGN_PERIOD ):
+  '''poll dozens of ports sharded across worker processes.
+  configs is a list of picklable port configurations, dicts with 'port',
+  'slaves' and optionally 'baudrate' and 'timeout'. Each worker decodes
+  its samples into its own shared memory SampleRing, drained here every
+  period and merged like pollPorts into sink( t, latest, totals ).'''
+  workers = min( workers or os.cpu_count() or 1, len( configs ) )
+  shards = [list( enumerate( configs ) )[i::workers] for i in range( workers )]
+  rings = [SampleRing.create() for shard in shards]
+  processes = [Process( target=farmWorker, args=( shard, ring.shm.name, ring.slots ), daemon=True ) for shard, ring in zip( shards, rings )]
+  for process in processes:
+    process.start()
+  latest = {}
+  totals = Totals()
+  tick = monotonic()
   try:
-    ins = minimalmodbus.Instrument(port, 1, debug=False)
-
-    ins.serial.baudrate = baudrate
-    #ins.serial.bytesize = 8
-    #ins.serial.stopbits = 1
-    #ins.serial.parity = serial.PARITY_NONE
-    ins.serial.timeout = 1
-    #
-    #ins.mode = minimalmodbus.MODE_RTU
-    #ins.clear_buffers_before_each_transaction = True
-
-    print(( 'setParameters:', ins ))
-    return ins
-  except:
-    # if no device found
-    print( 'setParameters: Device NOT connected' )
+    while True:
+      tick += period
+      sleep( max( 0.0, tick - monotonic() ) )
+      for ring in rings:
+        for t, index, slave, values in ring.drain():
+          unit = ( configs[index]['port'], slave )
+          if values is None:
+            latest.pop( unit, None )
+            totals.drop( unit )
+          else:
+            latest.setdefault( unit, {} ).update( values )
+            totals.update( unit, values )
+      sink( strftime('%Y-%m-%d %H:%M:%S', gmtime()), latest, totals.sums )
+      tick = max( tick, monotonic() )
+  finally:
+    for process in processes:
+      process.terminate()
+    for ring in rings:
+      ring.shm.close()
+      ring.shm.unlink()
+
+def compileRead( ins, start, count, functioncode=4 ):
+  'build the raw request for a block read once; return it with the expected response size'
+  payload = minimalmodbus._num_to_two_bytes( start ) + minimalmodbus._num_to_two_bytes( count )
+  request = minimalmodbus._embed_payload( ins.address, ins.mode, functioncode, payload )
+  return request, minimalmodbus._predict_response_size( ins.mode, functioncode, payload )
 
-def readint(r):
-  'read data from RS485 connnection at a specific register'
+def burst( ins, duration, size=BURST_SAMPLES, start=BURST_START, count=BURST_COUNT ):
+  'read one input register block back to back into a preallocated ring buffer'
+  request, nbytes = compileRead( ins, start, count )
+  nraw = 2 * count
+  stamps = [0.0] * size
+  ring = bytearray( nraw * size )
+  n = failed = 0
+  t0 = monotonic()
+  end = t0 + duration
   try:
-    #data = instrument.read_register(a,10,3)
-    #data = instrument.read_register(a)
-    x = instrument.read_register(r, 2, 4, False) 
-    return x
-  except IOError:
-    return 'Failed to read register from instrument: ' + hex(r)
+    while monotonic() < end:
+      try:
+        answer = ins._communicate( request, nbytes )
+        payload = minimalmodbus._extract_payload( answer, ins.address, ins.mode, 4 )
+      except IOError:
+        failed += 1
+        continue
+      # Time stamp the sample half way through the round trip
+      i = n % size
+      stamps[i] = monotonic() - 0.5 * ins.roundtrip_time
+      ring[i * nraw:( i + 1 ) * nraw] = payload[1:]
+      n += 1
+  except KeyboardInterrupt:
+    pass
+  elapsed = monotonic() - t0
+  print( 'Burst: %d samples in %.2f s = %.1f samples/s, %d failed' % ( n, elapsed, n / elapsed, failed ) )
+  return stamps, ring, n
+
+def writeBurst( filename, stamps, ring, n, start=BURST_START, count=BURST_COUNT ):
+  'write the burst samples still held in the ring buffer to a CSV file, oldest first'
+  size = len( stamps )
+  nraw = 2 * count
+  fields = [name for name, f in FIELDS.items() if start <= f[0] and f[0] + f[2] <= start + count]
+  first = max( 0, n - size )
+  with open( filename, 'w' ) as f:
+    f.write( ','.join( ['t'] + fields ) + '\n' )
+    for k in range( first, n ):
+      i = k % size
+      raw = { start + j: int.from_bytes( ring[i * nraw + 2 * j:i * nraw + 2 * j + 2], 'big' ) for j in range( count ) }
+      v = decode( raw )
+      f.write( ','.join( ['%.6f' % ( stamps[i] - stamps[first % size] )] + [str( v[name] ) for name in fields] ) + '\n' )
+  print( 'Wrote %d samples to %s' % ( n - first, filename ) )
+
+parser = argparse.ArgumentParser( description='Read data from EPEver Tracer charge controller via Modbus RS485' )
+parser.add_argument( '--burst', type=float, metavar='SECONDS', help='capture the PV/battery voltage and current block as fast as the bus allows for SECONDS' )
+parser.add_argument( '--samples', type=int, default=BURST_SAMPLES, help='burst ring buffer size, default %(default)s' )
+parser.add_argument( '--changes', action='store_true', help='only print fields that moved beyond their dead-band or heartbeat' )
+parser.add_argument( '--output', metavar='CSV', help='write the burst samples to this file' )
+parser.add_argument( '--snapshot', action='store_true', help='publish the latest values to shared memory for local readers' )
+parser.add_argument( '--ports', nargs='+', default=[PORT], metavar='PORT', help='serial ports, one RS485 adapter per controller bank, polled in parallel, default %(default)s' )
+parser.add_argument( '--workers', type=int, metavar='N', help='shard the ports across N worker processes' )
+parser.add_argument( '--slaves', type=int, nargs='+', default=[1], metavar='ID', help='slave ids of the controllers chained on the bus, default %(default)s' )
 
 # Set RS485 communication parameters
 
 baudrate = 115200
 
-#instrument = setParameters('COM port name', Baud rate, Slave Address)
-#instrument = setParameters('COM21', 19200, 111)
-instrument = setParameters( PORT, baudrate )
-
-if instrument:
-
-  t = strftime('%Y-%m-%d %H:%M:%S', gmtime())
-  
-  pv_voltage = readint( PV_VOLTAGE )
-  pv_current = readint( PV_CURRENT )
-  batt_voltage = readint( BATT_VOLTAGE )
-  batt_current_l = readint( BATT_CURRENT_L )
-  batt_current_h = readint( BATT_CURRENT_H )
-  batt_soc = readint( BATT_SOC )
-  batt_voltage_max_day = readint( BATT_VOLTAGE_MAX_DAY )
-  batt_voltage_min_day = readint( BATT_VOLTAGE_MIN_DAY )
-  kwh_day_l = readint( KWH_DAY_L )
-  kwh_day_h = readint( KWH_DAY_H )
-  kwh_month_l = readint( KWH_MONTH_L )
-  kwh_month_h = readint( KWH_MONTH_H )
-  kwh_year_l = readint( KWH_YEAR_L )
-  kwh_year_h = readint( KWH_YEAR_H )
-  kwh_total_l = readint( KWH_TOTAL_L )
-  kwh_total_h = readint( KWH_TOTAL_H )
-  kwh_consumed_day_l = readint( KWH_CONSUMED_DAY_L )
-  kwh_consumed_day_h = readint( KWH_CONSUMED_DAY_H )
-  kwh_consumed_month_l = readint( KWH_CONSUMED_MONTH_L )
-  kwh_consumed_month_h = readint( KWH_CONSUMED_MONTH_H )
-  kwh_consumed_year_l = readint( KWH_CONSUMED_YEAR_L )
-  kwh_consumed_year_h = readint( KWH_CONSUMED_YEAR_H )
-  kwh_consumed_total_l = readint( KWH_CONSUMED_TOTAL_L )
-  kwh_consumed_total_h = readint( KWH_CONSUMED_TOTAL_H )  
-
-  print(t)
-  print('PV:', pv_voltage, 'V', pv_current, 'A', pv_voltage * pv_current, 'W') 
-  print('Battery:', batt_voltage, 'V', batt_current_l, 'A', batt_voltage * batt_current_l, 'W', batt_soc, '%')
-  print('Day Min', batt_voltage_min_day, 'V, Max', batt_voltage_max_day, 'V')
-  print('kWh day/month/year/total', kwh_day_l, kwh_month_l, kwh_year_l, kwh_total_l)
-  print('Consumed kWh day/month/year/total', kwh_consumed_day_l, kwh_consumed_month_l, kwh_consumed_year_l, kwh_consumed_total_l)
-
-  # Loop forever
-  
-  while (1):
-    t = strftime('%Y-%m-%d %H:%M:%S', gmtime())
-    
-    pv_voltage = readint( PV_VOLTAGE )
-    pv_current = readint( PV_CURRENT )
-    batt_voltage = readint( BATT_VOLTAGE )
-    batt_current_l = readint( BATT_CURRENT_L )
-    #batt_current_h = readint( BATT_CURRENT_H )
-    batt_soc = readint( BATT_SOC )
-  
-    print('%s -- PV: %5.2f V %4.2f A %6.2f W -- Battery: %5.2f V %5.2f A %6.2f W %.0f %s' % (t, pv_voltage, pv_current, pv_voltage * pv_current, batt_voltage, batt_current_l, batt_voltage * batt_current_l, 100 * batt_soc, '%'))
-  
-    # break
-  
-    # Time delay of 10 seconds after each run
-    
-    sleep(10)
+def main():
+  args = parser.parse_args()
+
+  #tracer = EpeverTracer('COM port name', Slave Address, Baud rate)
+  #tracer = EpeverTracer('COM21', 111, 19200)
+  if args.workers:
+
+    # Farm mode: ports sharded across worker processes
+
+    farm( [{ 'port': port, 'slaves': args.slaves, 'baudrate': baudrate } for port in args.ports], args.workers )
+    return
+
+  if len( args.ports ) > 1:
+
+    # One worker per adapter, merged into one stream of array totals
+
+    pollPorts( dict.fromkeys( args.ports, args.slaves ), baudrate=baudrate )
+    return
+
+  if len( args.slaves ) > 1:
+
+    # Several controllers on one bus, polled round-robin
+
+    pollBus( BusPoller( args.slaves, args.ports[0], baudrate ) )
+    return
+
+  tracer = EpeverTracer( args.ports[0], args.slaves[0], baudrate )
+  try:
+    print(( 'setParameters:', tracer.instrument ))
+  except IOError as e:
+    # if no device found
+    print( 'setParameters: Device NOT connected:', e )
+    return
+
+  if args.burst:
+    stamps, ring, n = burst( tracer.instrument, args.burst, args.samples )
+    if args.output:
+      writeBurst( args.output, stamps, ring, n )
+
+  else:
+
+    # Loop forever, polling each register group at its own rate
+
+    snapshot = Snapshot( snapshotName( tracer.port ), create=True ) if args.snapshot else None
+    try:
+      pollForever( tracer, sink=printChanges if args.changes else None, snapshot=snapshot )
+    finally:
+      if snapshot:
+        snapshot.close()
+
+if __name__ == '__main__':
+  main()
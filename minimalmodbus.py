@@ -28,19 +28,36 @@ if sys.version_info < (3, 8, 0):
         "Your Python version is too old for this version of MinimalModbus"
     )
 
+import asyncio
 import binascii
+import collections
+import contextlib
+import copy
 import enum
+import json
 import os
+import select
+import socket
 import struct
+import tempfile
+import threading
 import time
-from typing import Any, Dict, List, Optional, Type, Union
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple, Type, Union
 
 import serial
 
+try:
+    import fcntl
+    import termios
+except ImportError:  # Not on Windows
+    fcntl = None  # type: ignore
+    termios = None  # type: ignore
+
 _NUMBER_OF_BYTES_BEFORE_REGISTERDATA = 1  # Within the payload
 _NUMBER_OF_BYTES_PER_REGISTER = 2
 _MAX_NUMBER_OF_REGISTERS_TO_WRITE = 123
 _MAX_NUMBER_OF_REGISTERS_TO_READ = 125
+_MAX_NUMBER_OF_REGISTERS_TO_READWRITE = 121  # Written by function code 23
 _MAX_NUMBER_OF_BITS_TO_WRITE = 1968  # 0x7B0
 _MAX_NUMBER_OF_BITS_TO_READ = 2000  # 0x7D0
 _MAX_NUMBER_OF_DECIMALS = 10  # Some instrument might store 0.00000154 Ampere as 154 etc
@@ -106,6 +123,11 @@ class Instrument:
           ``/dev/tty.usbserial`` (OS X) or ``COM4`` (Windows).
           It is also possible to pass in an already opened ``serial.Serial``
           object (new in version 2.1).
+          Devices behind an Ethernet gateway are reached with
+          ``tcp://host:port`` (Modbus TCP, the slave address is the unit id)
+          or ``rtu+tcp://host:port`` (Modbus RTU frames over TCP).
+          Other I/O paths are used by passing in a :class:`Transport`, or a
+          :class:`FramedTransport` for protocols with their own framing.
         * slaveaddress: Slave address in the range 0 to 247.
           Address 0 is for broadcast, and 248-255 are reserved.
         * mode: Mode selection. Can be :data:`minimalmodbus.MODE_RTU` or
@@ -117,7 +139,7 @@ class Instrument:
 
     def __init__(
         self,
-        port: Union[str, serial.Serial],
+        port: Union[str, serial.Serial, "Transport", "FramedTransport"],
         slaveaddress: int,
         mode: str = MODE_RTU,
         close_port_after_each_call: bool = False,
@@ -194,6 +216,35 @@ class Instrument:
         New in version 0.7.
         """
 
+        self.bus_lock: Optional[BusLock] = None
+        """A :class:`BusLock` to hold during each transaction, so that other
+        processes using the same bus wait their turn. Defaults to :const:`None`,
+        meaning no cross-process locking.
+
+        Use the lock as a context manager to hold it for a batch of transactions.
+        """
+
+        self.cache: Optional[RegisterCache] = None
+        """A :class:`RegisterCache` answering repeated register reads without
+        bus traffic. Defaults to :const:`None`, meaning no caching.
+
+        Only the ``read_*`` and ``write_*`` methods use the cache.
+        """
+
+        self.settle: Optional[SettleTracker] = None
+        """A :class:`SettleTracker` for waiting until writes read back as written,
+        with the latency learned for the registers. Defaults to :const:`None`.
+
+        Not used by the instrument itself, but by code writing setpoints, so
+        that all such code on the instrument learns from the same writes.
+        """
+
+        self.read_write_supported: Optional[bool] = None
+        """Whether the slave supports function code 23, used by
+        :meth:`read_write_registers`. Defaults to :const:`None`, meaning not yet
+        known. Set when it has been tried.
+        """
+
         self.serial: Optional[serial.Serial] = None
         """The serial port object as defined by the pySerial module. Created by the
         constructor.
@@ -216,27 +267,12 @@ class Instrument:
                 - Defaults to 2.0 s.
         """
 
+        self._shared_port_name: Optional[str] = None
         if _is_serial_object(port):
             self.serial = port  # type: ignore
-        elif isinstance(port, str) and (
-            port not in _serialports or not _serialports[port]
-        ):
-            self._print_debug("Create serial port {}".format(port))
-            self.serial = _serialports[port] = serial.Serial(
-                port=port,
-                baudrate=19200,
-                parity=serial.PARITY_NONE,
-                bytesize=8,
-                stopbits=1,
-                timeout=0.05,
-                write_timeout=2.0,
-            )
         elif isinstance(port, str):
-            self._print_debug("Serial port {} already exists".format(port))
-            self.serial = _serialports[port]
-            if (self.serial.port is None) or (not self.serial.is_open):
-                self._print_debug("Serial port {} is closed. Opening.".format(port))
-                self.serial.open()
+            self.serial = _port_manager.open(port, self._print_debug)
+            self._shared_port_name = port
 
         if self.serial is None or not _is_serial_object(self.serial):
             raise MasterReportedException("Failed to initialise serial port")
@@ -293,6 +329,49 @@ class Instrument:
         if self.debug:
             print("MinimalModbus debug mode. " + text)
 
+    def close(self) -> None:
+        """Release the serial port of this instrument.
+
+        A port given by name is shared by all instruments created with that name,
+        and is closed when the last of them releases it. A ``serial.Serial``
+        object given to the constructor is left open.
+        """
+        if self._shared_port_name is not None:
+            _port_manager.close(self._shared_port_name, self._print_debug)
+            self._shared_port_name = None
+
+    def batch(self, max_gap: int = 0) -> "Batch":
+        """Collect reads, and perform them as few block reads.
+
+        Use it as a context manager::
+
+            with instrument.batch() as batch:
+                voltage = batch.read_register(0x3100, 2, functioncode=4)
+                current = batch.read_register(0x3101, 2, functioncode=4)
+            print(voltage.result(), current.result())
+
+        Args:
+            * max_gap: Merge reads also across this many unread registers or bits.
+
+        Returns:
+            A :class:`Batch`.
+        """
+        return Batch(self, max_gap)
+
+    def write_buffer(self) -> "WriteBuffer":
+        """Collect register writes, and send adjacent ones as block writes.
+
+        Use it as a context manager::
+
+            with instrument.write_buffer() as buffer:
+                buffer.write_register(0x9004, 28.5, 2)
+                buffer.write_register(0x9005, 28.8, 2)
+
+        Returns:
+            A :class:`WriteBuffer`.
+        """
+        return WriteBuffer(self)
+
     # ################################# #
     #  Methods for talking to the slave #
     # ################################# #
@@ -981,6 +1060,87 @@ class Instrument:
             payloadformat=_Payloadformat.REGISTERS,
         )
 
+    def read_write_registers(
+        self,
+        write_registeraddress: int,
+        values: List[int],
+        read_registeraddress: int,
+        number_of_registers: int,
+    ) -> List[int]:
+        """Write integers to 16-bit registers, and read registers, in one transaction.
+
+        Uses function code 23 (0x17), where the slave performs the write before
+        the read. Reading back the registers written verifies a write in one
+        round trip.
+
+        Args:
+            * write_registeraddress: The slave register start address to write to.
+            * values: The values to store in the slave registers, max 121 values.
+            * read_registeraddress: The slave register start address to read from.
+            * number_of_registers: The number of registers to read, max 125
+              registers.
+
+        Returns:
+            The register data read. The first value in the list is for
+            the register at the read address.
+
+        If the slave rejects function code 23 as an illegal function, the
+        registers are written with function code 16 (6 for a single value) and
+        read with function code 3 instead. Whether function code 23 works is
+        found out on the first call that gets an answer, and stored in
+        :attr:`read_write_supported`. Other errors, like no response, are
+        raised and leave it undecided.
+
+        Raises:
+            TypeError, ValueError, ModbusException,
+            serial.SerialException (inherited from IOError)
+        """
+        if not isinstance(values, list):
+            raise TypeError(
+                'The "values parameter" must be a list. Given: {0!r}'.format(values)
+            )
+        _check_int(
+            len(values),
+            minvalue=1,
+            maxvalue=_MAX_NUMBER_OF_REGISTERS_TO_READWRITE,
+            description="length of input list",
+        )
+        _check_int(
+            number_of_registers,
+            minvalue=1,
+            maxvalue=_MAX_NUMBER_OF_REGISTERS_TO_READ,
+            description="number of registers",
+        )
+
+        if self.read_write_supported is not False:
+            try:
+                returnvalue = self._generic_command(
+                    23,
+                    read_registeraddress,
+                    values,
+                    number_of_registers=number_of_registers,
+                    payloadformat=_Payloadformat.REGISTERS,
+                    write_registeraddress=write_registeraddress,
+                )
+            except IllegalFunctionError:
+                # Slaves without function code 23 reject it with exception 01
+                if self.read_write_supported:
+                    raise
+            else:
+                self.read_write_supported = True
+                assert isinstance(returnvalue, list)
+                return [int(x) for x in returnvalue]
+
+        if len(values) == 1:
+            self.write_register(write_registeraddress, values[0], functioncode=6)
+        else:
+            self.write_registers(write_registeraddress, values)
+        returnvalue = self.read_registers(read_registeraddress, number_of_registers)
+        if self.read_write_supported is None:
+            self._print_debug("Function code 23 not supported, using 16 and 3")
+            self.read_write_supported = False
+        return returnvalue
+
     # ############### #
     # Generic command #
     # ############### #
@@ -996,6 +1156,7 @@ class Instrument:
         signed: bool = False,
         byteorder: int = BYTEORDER_BIG,
         payloadformat: _Payloadformat = _Payloadformat.REGISTER,
+        write_registeraddress: int = 0,
     ) -> Any:
         """Perform generic command for reading and writing registers and bits.
 
@@ -1013,6 +1174,9 @@ class Instrument:
               Only for a single register or for payloadformat='long'.
             * byteorder: How multi-register data should be interpreted.
             * payloadformat: An _Payloadformat enum
+            * write_registeraddress: The register address to write to, for
+              function code 23. Then *registeraddress* and *number_of_registers*
+              are for the read, and *value* is the list of values to write.
 
         If a value of 77.0 is stored internally in the slave register as 770,
         then use ``number_of_decimals=1`` which will divide the received data
@@ -1030,235 +1194,20 @@ class Instrument:
             TypeError, ValueError, ModbusException,
             serial.SerialException (inherited from IOError)
         """
-        ALL_ALLOWED_FUNCTIONCODES = [1, 2, 3, 4, 5, 6, 15, 16]
-        ALLOWED_FUNCTIONCODES_BROADCAST = [5, 6, 15, 16]
-        ALLOWED_FUNCTIONCODES = {}
-        ALLOWED_FUNCTIONCODES[_Payloadformat.BIT] = [1, 2, 5, 15]
-        ALLOWED_FUNCTIONCODES[_Payloadformat.BITS] = [1, 2, 15]
-        ALLOWED_FUNCTIONCODES[_Payloadformat.REGISTER] = [3, 4, 6, 16]
-        ALLOWED_FUNCTIONCODES[_Payloadformat.FLOAT] = [3, 4, 16]
-        ALLOWED_FUNCTIONCODES[_Payloadformat.STRING] = [3, 4, 16]
-        ALLOWED_FUNCTIONCODES[_Payloadformat.LONG] = [3, 4, 16]
-        ALLOWED_FUNCTIONCODES[_Payloadformat.REGISTERS] = [3, 4, 16]
-
-        # Check input values
-        _check_functioncode(functioncode, ALL_ALLOWED_FUNCTIONCODES)
-        _check_registeraddress(registeraddress)
-        _check_int(
+        _check_generic_command(
+            self.address,
+            functioncode,
+            registeraddress,
+            value,
             number_of_decimals,
-            minvalue=0,
-            maxvalue=_MAX_NUMBER_OF_DECIMALS,
-            description="number of decimals",
-        )
-        _check_int(
             number_of_registers,
-            minvalue=0,
-            maxvalue=max(
-                _MAX_NUMBER_OF_REGISTERS_TO_READ, _MAX_NUMBER_OF_REGISTERS_TO_WRITE
-            ),
-            description="number of registers",
-        )
-        _check_int(
             number_of_bits,
-            minvalue=0,
-            maxvalue=max(_MAX_NUMBER_OF_BITS_TO_READ, _MAX_NUMBER_OF_BITS_TO_WRITE),
-            description="number of bits",
-        )
-        _check_bool(signed, description="signed")
-        _check_int(
+            signed,
             byteorder,
-            minvalue=0,
-            maxvalue=_MAX_BYTEORDER_VALUE,
-            description="byteorder",
+            payloadformat,
+            write_registeraddress,
         )
 
-        if not isinstance(payloadformat, _Payloadformat):
-            raise TypeError(
-                "The payload format should be an enum of type _Payloadformat. "
-                + "Given: {!r}".format(payloadformat)
-            )
-
-        number_of_register_bytes = number_of_registers * _NUMBER_OF_BYTES_PER_REGISTER
-
-        # Check combinations: Payload format and functioncode
-        if functioncode not in ALLOWED_FUNCTIONCODES[payloadformat]:
-            raise ValueError(
-                "Wrong functioncode for payloadformat "
-                + "{!r}. Given: {!r}.".format(payloadformat, functioncode)
-            )
-
-        # Check combinations: Broadcast and functioncode
-        if (
-            self.address == _SLAVEADDRESS_BROADCAST
-            and functioncode not in ALLOWED_FUNCTIONCODES_BROADCAST
-        ):
-            raise ValueError(
-                f"Wrong functioncode for broadcast. Given: {functioncode!r}"
-            )
-
-        # Check combinations: signed
-        if signed:
-            if payloadformat not in [_Payloadformat.REGISTER, _Payloadformat.LONG]:
-                raise ValueError(
-                    'The "signed" parameter can not be used for this payload format. '
-                    + "Given format: {!r}.".format(payloadformat)
-                )
-
-        # Check combinations: number_of_decimals
-        if number_of_decimals > 0:
-            if payloadformat != _Payloadformat.REGISTER:
-                raise ValueError(
-                    'The "number_of_decimals" parameter can not be used for this '
-                    + "payload format. Given format: {0!r}.".format(payloadformat)
-                )
-
-        # Check combinations: byteorder
-        if byteorder:
-            if payloadformat not in [_Payloadformat.FLOAT, _Payloadformat.LONG]:
-                raise ValueError(
-                    'The "byteorder" parameter can not be used for this payload'
-                    + " format. Given format: {0!r}.".format(payloadformat)
-                )
-
-        # Check combinations: number of bits
-        if payloadformat == _Payloadformat.BIT:
-            if number_of_bits != 1:
-                raise ValueError(
-                    "For BIT payload format the number of bits should be 1. "
-                    + "Given: {0!r}.".format(number_of_bits)
-                )
-        elif payloadformat == _Payloadformat.BITS:
-            if number_of_bits < 1:
-                raise ValueError(
-                    "For BITS payload format the number of bits should be at least 1. "
-                    + "Given: {0!r}.".format(number_of_bits)
-                )
-        elif number_of_bits:
-            raise ValueError(
-                "The number_of_bits parameter is wrong for payload format "
-                + "{0!r}. Given: {1!r}.".format(payloadformat, number_of_bits)
-            )
-
-        # Check combinations: Number of registers
-        if functioncode in [1, 2, 5, 15] and number_of_registers:
-            raise ValueError(
-                "The number_of_registers is not valid for this function code. "
-                + "number_of_registers: {0!r}, functioncode {1}.".format(
-                    number_of_registers, functioncode
-                )
-            )
-        if functioncode in [3, 4, 16] and not number_of_registers:
-            raise ValueError(
-                "The number_of_registers must be > 0 for functioncode "
-                + "{}.".format(functioncode)
-            )
-        if functioncode == 6 and number_of_registers != 1:
-            raise ValueError(
-                "The number_of_registers must be 1 for functioncode 6. "
-                + "Given: {}.".format(number_of_registers)
-            )
-        if (
-            functioncode == 16
-            and payloadformat == _Payloadformat.REGISTER
-            and number_of_registers != 1
-        ):
-            raise ValueError(
-                "Wrong number_of_registers when writing to a "
-                + "single register. Given {0!r}.".format(number_of_registers)
-            )
-            # Note: For function code 16 there is checking also in the content
-            # conversion functions.
-
-        # Number of registers for float and long
-        if payloadformat == _Payloadformat.FLOAT and number_of_registers not in [2, 4]:
-            raise ValueError(
-                "The number of registers for float must be 2 or 4. "
-                + "Given {0!r}".format(number_of_registers)
-            )
-        if payloadformat == _Payloadformat.LONG and number_of_registers not in [2, 4]:
-            raise ValueError(
-                "The number of registers for long must be 2 or 4. "
-                + "Given {0!r}".format(number_of_registers)
-            )
-
-        # Check combinations: Value
-        if functioncode in [5, 6, 15, 16] and value is None:
-            raise ValueError(
-                "The input value must be given for this function code. "
-                + "Given {0!r} and {1}.".format(value, functioncode)
-            )
-        if functioncode in [1, 2, 3, 4] and value is not None:
-            raise ValueError(
-                "The input value should not be given for this function code. "
-                + "Given {0!r} and {1}.".format(value, functioncode)
-            )
-
-        # Check combinations: Value for numerical
-        if (
-            functioncode == 16
-            and payloadformat
-            in [
-                _Payloadformat.REGISTER,
-                _Payloadformat.FLOAT,
-                _Payloadformat.LONG,
-            ]
-        ) or (functioncode == 6 and payloadformat == _Payloadformat.REGISTER):
-            if not isinstance(value, (int, float)):
-                raise TypeError(f"The input value must be numerical. Given: {value!r}")
-
-        # Check combinations: Value for string
-        if functioncode == 16 and payloadformat == _Payloadformat.STRING:
-            if not isinstance(value, str):
-                raise TypeError(f"The input should be a string. Given: {value!r}")
-            _check_string(
-                value, "input string", minlength=1, maxlength=number_of_register_bytes
-            )
-            # Note: The string might be padded later, so the length might be shorter
-            # than number_of_register_bytes.
-
-        # Check combinations: Value for registers
-        if functioncode == 16 and payloadformat == _Payloadformat.REGISTERS:
-            if not isinstance(value, list):
-                raise TypeError(
-                    "The value parameter for payloadformat REGISTERS must be a list. "
-                    + "Given {0!r}.".format(value)
-                )
-
-            if len(value) != number_of_registers:
-                raise ValueError(
-                    "The list length does not match number of registers. "
-                    + "List: {0!r},  Number of registers: {1!r}.".format(
-                        value, number_of_registers
-                    )
-                )
-
-        # Check combinations: Value for bit
-        if functioncode in [5, 15] and payloadformat == _Payloadformat.BIT:
-            if not isinstance(value, int):
-                raise TypeError(f"The input should be an integer. Given: {value!r}")
-            _check_int(
-                value,
-                minvalue=0,
-                maxvalue=1,
-                description="input value for payload format BIT",
-            )
-
-        # Check combinations: Value for bits
-        if functioncode == 15 and payloadformat == _Payloadformat.BITS:
-            if not isinstance(value, list):
-                raise TypeError(
-                    "The value parameter for payloadformat BITS must be a list. "
-                    + "Given {0!r}.".format(value)
-                )
-
-            if len(value) != number_of_bits:
-                raise ValueError(
-                    "The list length does not match number of bits. "
-                    + "List: {0!r},  Number of registers: {1!r}.".format(
-                        value, number_of_registers
-                    )
-                )
-
         # Create payload
         payload_to_slave = _create_payload(
             functioncode,
@@ -1270,10 +1219,11 @@ class Instrument:
             signed,
             byteorder,
             payloadformat,
+            write_registeraddress,
         )
 
         # Communicate with instrument
-        payload_from_slave = self._perform_command(functioncode, payload_to_slave)
+        payload_from_slave = self._cached_command(functioncode, payload_to_slave)
 
         # There is no response for broadcasts
         if self.address == _SLAVEADDRESS_BROADCAST:
@@ -1293,10 +1243,115 @@ class Instrument:
             payloadformat,
         )
 
+    def transact_pdu(self, unit: int, pdu: bytes) -> bytes:
+        """Send a request PDU to slave *unit*, and return the response PDU.
+
+        For relaying requests built elsewhere, for example in a gateway. A PDU
+        is the function code followed by its data; the slave address and
+        checksum, or the Modbus TCP header, are added and checked here. Uses
+        the port, :attr:`bus_lock` and :attr:`mode` of the instrument, but not
+        its :attr:`address`, :attr:`cache` or the sharing of reads in flight.
+
+        Args:
+            * unit: Slave address, 0 for a broadcast.
+            * pdu: Function code and data of the request.
+
+        Returns:
+            The response PDU. An exception response from the slave is returned
+            as it is (function code with bit 7 set, and the exception code), so
+            that it can be passed on. No bytes for broadcasts.
+
+        Raises:
+            TypeError, ValueError, NoResponseError, InvalidResponseError,
+            serial.SerialException (inherited from IOError)
+
+        On serial ports, a function code unknown to this library raises
+        ValueError, as the size of the response can not be predicted.
+        """
+        _check_slaveaddress(unit)
+        _check_bytes(pdu, description="pdu", minlength=1)
+        functioncode, payload_to_slave = pdu[0], pdu[1:]
+        _check_functioncode(functioncode, None)
+
+        if isinstance(self.serial, FramedTransport):
+            response = self.serial.transact(unit, pdu)
+            if unit == _SLAVEADDRESS_BROADCAST:
+                return b""
+            if not response or response[0] & 0x7F != functioncode:
+                raise InvalidResponseError(
+                    "Invalid response to function code {}: {!r}".format(
+                        functioncode, response
+                    )
+                )
+            return response
+
+        request = _embed_payload(unit, self.mode, functioncode, payload_to_slave)
+        size = 0
+        if unit != _SLAVEADDRESS_BROADCAST:
+            size = _predict_response_size(self.mode, functioncode, payload_to_slave)
+        response = self._communicate(request, size)
+        if unit == _SLAVEADDRESS_BROADCAST:
+            return b""
+        try:
+            payload_from_slave = _extract_payload(
+                response, unit, self.mode, functioncode
+            )
+        except SlaveReportedException:
+            # The checksum and address are fine, pass the exception response on
+            if self.mode == MODE_ASCII:
+                response = _hexdecode(response[1:-2])
+            return response[1:3]
+        if len(response) != size:
+            raise InvalidResponseError(
+                "Wrong response size: {} bytes instead of {}. "
+                "The response is: {!r}".format(len(response), size, response)
+            )
+        return bytes([functioncode]) + payload_from_slave
+
     # #################################### #
     # Communication implementation details #
     # #################################### #
 
+    def _cached_command(self, functioncode: int, payload_to_slave: bytes) -> bytes:
+        """Perform the command, unless the cache can answer it."""
+        payload_from_slave = None
+        if self.cache is not None:
+            payload_from_slave = self.cache.lookup(
+                self.address, functioncode, payload_to_slave
+            )
+        if payload_from_slave is None:
+            payload_from_slave = self._perform_read_once(functioncode, payload_to_slave)
+            if self.cache is not None:
+                self.cache.update(
+                    self.address, functioncode, payload_to_slave, payload_from_slave
+                )
+        return payload_from_slave
+
+    def _perform_read_once(self, functioncode: int, payload_to_slave: bytes) -> bytes:
+        """Perform the command, sharing the transaction with concurrent reads.
+
+        Bit and register reads asking for the same addresses as a read already
+        in flight on this port and slave, or a part of them, wait for its
+        response instead of sending their own request. Other commands are
+        performed right away, and so are reads by a thread already holding the
+        port, for example through :attr:`bus_lock`: the read in flight can not
+        get the bus before that thread releases it.
+        """
+        if (
+            _read_range(functioncode, payload_to_slave) is None
+            or self.address == _SLAVEADDRESS_BROADCAST
+            or self.serial is None
+            or _port_manager.lock(self.serial.port or "").owned()
+        ):
+            return self._perform_command(functioncode, payload_to_slave)
+        return _single_flight.perform(
+            (str(self.serial.port), self.address, functioncode),
+            functioncode,
+            payload_to_slave,
+            lambda: self._perform_command(functioncode, payload_to_slave),
+            self.bus_lock or _port_manager.lock(self.serial.port or ""),
+        )
+
     def _perform_command(self, functioncode: int, payload_to_slave: bytes) -> bytes:
         """Perform the command having the *functioncode*.
 
@@ -1310,25 +1365,2808 @@ class Instrument:
             The extracted data payload from the slave. It has been
             stripped of CRC etc.
 
-        Raises:
-            TypeError, ValueError, ModbusException,
-            serial.SerialException (inherited from IOError)
+        Raises:
+            TypeError, ValueError, ModbusException,
+            serial.SerialException (inherited from IOError)
+
+        Makes use of the :meth:`_communicate` method. The request is generated
+        with the :func:`_embed_payload` function, and the parsing of the
+        response is done with the :func:`_extract_payload` function.
+        """
+        DEFAULT_NUMBER_OF_BYTES_TO_READ = 1000
+
+        _check_functioncode(functioncode, None)
+        _check_bytes(payload_to_slave, description="payload")
+
+        if isinstance(self.serial, FramedTransport):
+            return self._perform_framed_command(functioncode, payload_to_slave)
+
+        # Build request
+        request_bytes = _embed_payload(
+            self.address, self.mode, functioncode, payload_to_slave
+        )
+
+        # Calculate number of bytes to read
+        number_of_bytes_to_read = DEFAULT_NUMBER_OF_BYTES_TO_READ
+        until_silence = isinstance(self.serial, Transport)
+        if self.address == _SLAVEADDRESS_BROADCAST:
+            number_of_bytes_to_read = 0
+        elif self.precalculate_read_size:
+            try:
+                number_of_bytes_to_read = _predict_response_size(
+                    self.mode, functioncode, payload_to_slave
+                )
+                until_silence = False
+            except Exception:
+                if self.debug:
+                    template = (
+                        "Could not precalculate response size for Modbus {} mode. "
+                        + "Will read {} bytes. Request: {!r}"
+                    )
+                    self._print_debug(
+                        template.format(
+                            self.mode, number_of_bytes_to_read, request_bytes
+                        )
+                    )
+
+        # Communicate
+        response_bytes = self._communicate(
+            request_bytes, number_of_bytes_to_read, until_silence
+        )
+
+        if number_of_bytes_to_read == 0:
+            return b""
+
+        # Extract payload
+        payload_from_slave = _extract_payload(
+            response_bytes, self.address, self.mode, functioncode
+        )
+        return payload_from_slave
+
+    def _perform_framed_command(
+        self, functioncode: int, payload_to_slave: bytes
+    ) -> bytes:
+        """Perform the command over a :class:`FramedTransport`, like Modbus TCP.
+
+        Args:
+            * functioncode: The function code for the command to be performed.
+            * payload_to_slave: Data to be transmitted to the slave.
+
+        Returns:
+            The extracted data payload from the slave.
+
+        Raises:
+            ModbusException, ConnectionError (both inherited from IOError)
+
+        Transactions are not serialized per port, so that several threads can
+        have requests outstanding on the same connection.
+        """
+        assert isinstance(self.serial, FramedTransport)
+        request = bytes([functioncode]) + payload_to_slave
+        if self.debug:
+            self._print_debug(
+                "Sending request to unit {} at {}: {}".format(
+                    self.address, self.serial.port, _describe_bytes(request)
+                )
+            )
+        write_time = time.monotonic()
+        response = self.serial.transact(self.address, request)
+        self._latest_roundtrip_time = time.monotonic() - write_time
+        if self.debug:
+            self._print_debug(
+                "Response from unit: {}, roundtrip time: {:.1f} ms.".format(
+                    _describe_bytes(response),
+                    self._latest_roundtrip_time * _SECONDS_TO_MILLISECONDS,
+                )
+            )
+
+        if self.address == _SLAVEADDRESS_BROADCAST:
+            return b""
+        if not response:
+            raise InvalidResponseError("Empty Modbus TCP response")
+
+        # The error code checks expect a slave address first
+        _check_response_slaveerrorcode(bytes([self.address]) + response)
+        if response[0] != functioncode:
+            raise InvalidResponseError(
+                "Wrong functioncode: {} instead of {}. The response is: {!r}".format(
+                    response[0], functioncode, response
+                )
+            )
+        return response[1:]
+
+    def _communicate(
+        self, request: bytes, number_of_bytes_to_read: int, until_silence: bool = False
+    ) -> bytes:
+        """Talk to the slave via a serial port.
+
+        Args:
+            * request: The raw request that is to be sent to the slave.
+            * number_of_bytes_to_read: Number of bytes to read
+            * until_silence: The response size is unknown, so stop reading when
+              the line goes silent instead of at the timeout. Only used for
+              :class:`Transport` ports, as pySerial lacks this.
+
+        Returns:
+            The raw data returned from the slave.
+
+        Raises:
+            TypeError, ValueError, ModbusException,
+            serial.SerialException (inherited from IOError)
+
+        Sleeps if the previous message arrived less than the "silent period" ago.
+
+        Will block until reaching *number_of_bytes_to_read* or timeout.
+
+        Additional delay will be used after broadcast transmissions (slave address 0).
+
+        If the attribute :attr:`Instrument.debug` is :const:`True`, the communication
+        details are printed.
+
+        If the attribute :attr:`Instrument.close_port_after_each_call` is :const:`True`
+        the serial port is closed after each call.
+
+        Timing::
+
+                            Request from master (Master is writing)
+                            |
+                            |                             Response from slave
+                            |                             (Master is reading)
+                            |                             |
+            --------R-------W-----------------------------R-------W--------------------
+                     |     |                               |
+                     |     |<------- Roundtrip time ------>|
+                     |     |
+                  -->|-----|<----- Silent period
+
+        The resolution for Python's :py:func:`time.time()` is lower on Windows than
+        on Linux.
+        It is about 16 ms on Windows according to
+        stackoverflow.com/questions/157359/accurate-timestamping-in-python-logging
+        """
+        _check_bytes(request, minlength=1, description="request")
+        _check_int(number_of_bytes_to_read)
+
+        self._print_debug(
+            "Will write to instrument (expecting {} bytes back): {}".format(
+                number_of_bytes_to_read, _describe_bytes(request)
+            )
+        )
+
+        if self.serial is None:
+            raise ModbusException("The serial port instance is None")
+
+        portname: str = ""
+        if self.serial.port is not None:
+            portname = self.serial.port
+
+        # Only one transaction at a time on the bus, also across threads and
+        # processes
+        with _port_manager.lock(portname), self.bus_lock or contextlib.nullcontext():
+            if not self.serial.is_open:
+                self._print_debug("Opening port {}".format(self.serial.port))
+                self.serial.open()
+
+            if self.clear_buffers_before_each_transaction:
+                self._print_debug(
+                    "Clearing serial buffers for port {}".format(portname)
+                )
+                self.serial.reset_input_buffer()
+                self.serial.reset_output_buffer()
+
+            # Sleep to make sure 3.5 character times have passed
+            if isinstance(self.serial, Transport):
+                minimum_silent_period = self.serial.silent_period()
+            else:
+                minimum_silent_period = _calculate_minimum_silent_period(
+                    self.serial.baudrate
+                )
+            time_since_read = time.monotonic() - _latest_read_times.get(portname, 0)
+
+            if time_since_read < minimum_silent_period:
+                sleep_time = minimum_silent_period - time_since_read
+
+                if self.debug:
+                    template = (
+                        "Sleeping {:.2f} ms before sending. "
+                        + "Minimum silent period: {:.2f} ms, time since read: {:.2f} ms."
+                    )
+                    text = template.format(
+                        sleep_time * _SECONDS_TO_MILLISECONDS,
+                        minimum_silent_period * _SECONDS_TO_MILLISECONDS,
+                        time_since_read * _SECONDS_TO_MILLISECONDS,
+                    )
+                    self._print_debug(text)
+
+                time.sleep(sleep_time)
+
+            elif self.debug:
+                template = (
+                    "No sleep required before write. Time since "
+                    + "previous read: {:.2f} ms, minimum silent period: {:.2f} ms."
+                )
+                text = template.format(
+                    time_since_read * _SECONDS_TO_MILLISECONDS,
+                    minimum_silent_period * _SECONDS_TO_MILLISECONDS,
+                )
+                self._print_debug(text)
+
+            # Write request
+            write_time = time.monotonic()
+            self.serial.write(request)
+
+            # Read and discard local echo
+            if self.handle_local_echo:
+                local_echo_to_discard = self.serial.read(len(request))
+                if self.debug:
+                    text = "Discarding this local echo: {}".format(
+                        _describe_bytes(local_echo_to_discard),
+                    )
+                    self._print_debug(text)
+                if local_echo_to_discard != request:
+                    template = (
+                        "Local echo handling is enabled, but the local echo does "
+                        + "not match the sent request. "
+                        + "Request: {}, local echo: {}."
+                    )
+                    text = template.format(
+                        _describe_bytes(request),
+                        _describe_bytes(local_echo_to_discard),
+                    )
+                    raise LocalEchoError(text)
+
+            # Read response
+            if number_of_bytes_to_read > 0 and until_silence:
+                answer = self.serial.read_until_silence(number_of_bytes_to_read)
+            elif number_of_bytes_to_read > 0:
+                answer = self.serial.read(number_of_bytes_to_read)
+            else:
+                answer = b""
+                self.serial.flush()
+
+            read_time = time.monotonic()
+            _latest_read_times[portname] = read_time
+            roundtrip_time = read_time - write_time
+            self._latest_roundtrip_time = roundtrip_time
+
+            if self.close_port_after_each_call:
+                self._print_debug("Closing port {}".format(portname))
+                self.serial.close()
+
+            if self.debug:
+                if isinstance(self.serial.timeout, float):
+                    timeout_time = self.serial.timeout * _SECONDS_TO_MILLISECONDS
+                else:
+                    timeout_time = 0
+                text = (
+                    "Response from instrument: {}, roundtrip time: {:.1f} ms."
+                    " Timeout for reading: {:.1f} ms.\n"
+                ).format(
+                    _describe_bytes(answer),
+                    roundtrip_time,
+                    timeout_time,
+                )
+                self._print_debug(text)
+
+            if not answer and number_of_bytes_to_read > 0:
+                raise NoResponseError(
+                    "No communication with the instrument (no answer)"
+                )
+
+            if number_of_bytes_to_read == 0:
+                self._print_debug(
+                    "Broadcast delay: Sleeping for {} s".format(_BROADCAST_DELAY)
+                )
+                time.sleep(_BROADCAST_DELAY)
+
+            return answer
+
+
+# ############## #
+# Register cache #
+# ############## #
+
+
+class RegisterCache:
+    """Read-through cache of register values, for :attr:`Instrument.cache`.
+
+    Register reads (function codes 3 and 4) are answered from the cache when
+    every register in the range was read less than its time-to-live ago, and
+    the registers read from the instrument are stored. Writes (function codes
+    6, 16 and 23) drop the holding registers written. Beyond *maxsize* registers,
+    the least recently used ones are evicted.
+
+    The cache is keyed by (slave address, function code, register address) and
+    thread safe, so instruments on the same bus can share one.
+
+    Args:
+        * ttls: List of (functioncode, start address, number of registers,
+          time-to-live in seconds) ranges, the first match applies. Use
+          ``math.inf`` for registers that never change, like rated data.
+        * default_ttl: Time-to-live in seconds for registers not in any range.
+          Defaults to 0, meaning they are not cached.
+        * maxsize: Maximum number of registers kept.
+    """
+
+    def __init__(
+        self,
+        ttls: Optional[List[Tuple[int, int, int, float]]] = None,
+        default_ttl: float = 0.0,
+        maxsize: int = 4096,
+    ) -> None:
+        self.ttls = list(ttls or [])
+        self.default_ttl = default_ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        """Number of reads answered from the cache."""
+        self.misses = 0
+        """Number of reads that had to go to the instrument."""
+        self._entries: (
+            "collections.OrderedDict[Tuple[int, int, int], Tuple[float, bytes]]"
+        ) = collections.OrderedDict()
+        self._ttl_by_register: Dict[Tuple[int, int], float] = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        """Give string representation of the :class:`.RegisterCache` object."""
+        return "{}.{}<id=0x{:x}, size={}, maxsize={}, hits={}, misses={}>".format(
+            self.__module__,
+            self.__class__.__name__,
+            id(self),
+            len(self._entries),
+            self.maxsize,
+            self.hits,
+            self.misses,
+        )
+
+    def ttl(self, functioncode: int, registeraddress: int) -> float:
+        """Return the time-to-live in seconds of a register."""
+        key = (functioncode, registeraddress)
+        if key not in self._ttl_by_register:
+            ttl = self.default_ttl
+            for range_functioncode, start, count, range_ttl in self.ttls:
+                if range_functioncode == functioncode and (
+                    start <= registeraddress < start + count
+                ):
+                    ttl = range_ttl
+                    break
+            self._ttl_by_register[key] = ttl
+        return self._ttl_by_register[key]
+
+    def lookup(
+        self, slaveaddress: int, functioncode: int, payload_to_slave: bytes
+    ) -> Optional[bytes]:
+        """Return the response payload for a request, if it can be answered here.
+
+        Returns :const:`None` for requests that must go to the instrument.
+        """
+        if functioncode not in (3, 4):
+            return None
+        start = _two_bytes_to_num(payload_to_slave[0:2])
+        count = _two_bytes_to_num(payload_to_slave[2:4])
+        now = time.monotonic()
+        with self._lock:
+            keys = [(slaveaddress, functioncode, start + i) for i in range(count)]
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None or now - entry[0] >= self.ttl(functioncode, key[2]):
+                    self.misses += 1
+                    return None
+            for key in keys:
+                self._entries.move_to_end(key)
+            self.hits += 1
+            data = b"".join(self._entries[key][1] for key in keys)
+        return bytes([len(data)]) + data
+
+    def update(
+        self,
+        slaveaddress: int,
+        functioncode: int,
+        payload_to_slave: bytes,
+        payload_from_slave: bytes,
+    ) -> None:
+        """Store the registers read by a request, or drop the registers written."""
+        start = _two_bytes_to_num(payload_to_slave[0:2])
+        if functioncode in (3, 4):
+            data = payload_from_slave[1:]
+            now = time.monotonic()
+            with self._lock:
+                for i in range(len(data) // _NUMBER_OF_BYTES_PER_REGISTER):
+                    if self.ttl(functioncode, start + i) <= 0:
+                        continue
+                    key = (slaveaddress, functioncode, start + i)
+                    self._entries[key] = (now, data[2 * i : 2 * i + 2])
+                    self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        elif functioncode == 6:
+            self.invalidate(slaveaddress, 3, start, 1)
+        elif functioncode == 16:
+            count = _two_bytes_to_num(payload_to_slave[2:4])
+            self.invalidate(slaveaddress, 3, start, count)
+        elif functioncode == 23:
+            self.invalidate(
+                slaveaddress,
+                3,
+                _two_bytes_to_num(payload_to_slave[4:6]),
+                _two_bytes_to_num(payload_to_slave[6:8]),
+            )
+            # The slave writes before reading, so the registers read are current
+            self.update(slaveaddress, 3, payload_to_slave[0:4], payload_from_slave)
+
+    def invalidate(
+        self,
+        slaveaddress: int = _SLAVEADDRESS_BROADCAST,
+        functioncode: int = 3,
+        start: int = 0,
+        count: int = 0x10000,
+    ) -> None:
+        """Drop cached registers.
+
+        Slave address 0 (broadcast) drops the registers of all slaves.
+        """
+        with self._lock:
+            if slaveaddress == _SLAVEADDRESS_BROADCAST:
+                keys = [
+                    key
+                    for key in self._entries
+                    if key[1] == functioncode and start <= key[2] < start + count
+                ]
+            else:
+                keys = [(slaveaddress, functioncode, start + i) for i in range(count)]
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        """Drop all cached registers."""
+        with self._lock:
+            self._entries.clear()
+
+
+# ################### #
+# Single-flight reads #
+# ################### #
+
+
+def _read_range(
+    functioncode: int, payload_to_slave: bytes
+) -> Optional[Tuple[int, int]]:
+    """Return the (start address, count) of a bit or register read request.
+
+    Returns :const:`None` for other requests.
+    """
+    if functioncode not in (1, 2, 3, 4):
+        return None
+    return (
+        _two_bytes_to_num(payload_to_slave[0:2]),
+        _two_bytes_to_num(payload_to_slave[2:4]),
+    )
+
+
+def _slice_read_payload(
+    functioncode: int, payload_from_slave: bytes, offset: int, count: int
+) -> bytes:
+    """Cut the response payload for a part of a bit or register read.
+
+    Args:
+        * functioncode: The function code of the read.
+        * payload_from_slave: The response payload of the whole read.
+        * offset: Number of bits or registers to skip.
+        * count: Number of bits or registers to keep.
+
+    Returns:
+        The response payload the slave would have sent for the part.
+    """
+    data = payload_from_slave[1:]
+    if functioncode in (1, 2):
+        bits = _bytes_to_bits(data, offset + count)[offset:]
+        data = _bits_to_bytes(bits)
+    else:
+        data = data[
+            offset
+            * _NUMBER_OF_BYTES_PER_REGISTER : (offset + count)
+            * _NUMBER_OF_BYTES_PER_REGISTER
+        ]
+    return bytes([len(data)]) + data
+
+
+class _InflightRead:
+    """A read on the bus, that callers asking for the same or a part may wait for."""
+
+    __slots__ = ("start", "count", "done", "payload", "error")
+
+    def __init__(self, start: int, count: int, done: Any) -> None:
+        self.start = start
+        self.count = count
+        self.done = done  # threading.Event or asyncio.Future
+        self.payload = b""
+        self.error: Optional[BaseException] = None
+
+    def covers(self, start: int, count: int) -> bool:
+        return self.start <= start and start + count <= self.start + self.count
+
+
+def _copy_exception(exc: BaseException) -> BaseException:
+    """Return a fresh instance of *exc*, for raising in another waiting reader.
+
+    Raising one object in several threads would pile all their tracebacks up
+    on it.
+    """
+    try:
+        return copy.copy(exc)
+    except Exception:
+        return ModbusException(str(exc))
+
+
+class SingleFlight:
+    """Table of reads in flight, keyed by (port name, slave address, function code).
+
+    A read that asks for the same bits or registers as a read already on the
+    bus, or a part of them, waits for that transaction instead of sending its
+    own, so the bus load stays flat as concurrent readers are added. A copy of
+    the first reader's exception is raised in the waiting readers too.
+
+    The instruments share one table per process. Create another one for reads
+    that do not go through an :class:`Instrument`, for example in a gateway
+    relaying requests with :meth:`Instrument.transact_pdu`.
+    """
+
+    def __init__(self) -> None:
+        self._mutex = threading.Lock()
+        self._reads: Dict[Tuple[str, int, int], List[_InflightRead]] = {}
+
+    def _find(
+        self, key: Tuple[str, int, int], start: int, count: int
+    ) -> Optional[_InflightRead]:
+        for read in self._reads.get(key, []):
+            if read.covers(start, count):
+                return read
+        return None
+
+    def _remove(self, key: Tuple[str, int, int], read: _InflightRead) -> None:
+        self._reads[key].remove(read)
+        if not self._reads[key]:
+            del self._reads[key]
+
+    def perform(
+        self,
+        key: Tuple[str, int, int],
+        functioncode: int,
+        payload_to_slave: bytes,
+        perform: Callable[[], bytes],
+        lock: Optional[Any] = None,
+    ) -> bytes:
+        """Call *perform* for the read, unless a read in flight covers it.
+
+        The read leaves the table while *lock*, the port or bus lock, is still
+        held after *perform*, so that a read issued after a later write can not
+        join it and get the values from before the write.
+        """
+        start, count = _read_range(functioncode, payload_to_slave)  # type: ignore
+        with self._mutex:
+            read = self._find(key, start, count)
+            if read is None:
+                leader = _InflightRead(start, count, threading.Event())
+                self._reads.setdefault(key, []).append(leader)
+        if read is not None:
+            read.done.wait()
+            if read.error is not None:
+                raise _copy_exception(read.error) from read.error
+            return _slice_read_payload(
+                functioncode, read.payload, start - read.start, count
+            )
+        try:
+            with lock or contextlib.nullcontext():
+                try:
+                    leader.payload = perform()
+                finally:
+                    with self._mutex:
+                        self._remove(key, leader)
+        except BaseException as exc:
+            leader.error = exc
+            raise
+        finally:
+            leader.done.set()
+        return leader.payload
+
+    async def perform_async(
+        self,
+        key: Tuple[str, int, int],
+        functioncode: int,
+        payload_to_slave: bytes,
+        perform: Callable[[], Any],
+    ) -> bytes:
+        """Like :meth:`perform`, for coroutines. Only used from the event loop.
+
+        When the task performing the read is cancelled, the waiting tasks
+        retry, and one of them puts its own read on the bus.
+        """
+        start, count = _read_range(functioncode, payload_to_slave)  # type: ignore
+        read = self._find(key, start, count)
+        while read is not None:
+            try:
+                payload = await asyncio.shield(read.done)
+            except asyncio.CancelledError:
+                if not read.done.cancelled():
+                    raise
+                read = self._find(key, start, count)
+                continue
+            except Exception as exc:
+                raise _copy_exception(exc) from exc
+            return _slice_read_payload(functioncode, payload, start - read.start, count)
+        future = asyncio.get_running_loop().create_future()
+        # Nobody may be waiting, so do not warn about an unretrieved exception
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        leader = _InflightRead(start, count, future)
+        self._reads.setdefault(key, []).append(leader)
+        try:
+            payload = await perform()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(payload)
+        finally:
+            self._remove(key, leader)
+        return payload
+
+
+_single_flight = SingleFlight()
+_async_single_flight = SingleFlight()
+
+
+# ############# #
+# Batched reads #
+# ############# #
+
+
+class BatchRead:
+    """The result of a read queued in a :class:`Batch`.
+
+    Available when the ``with`` block of the batch has been left.
+    """
+
+    def __init__(self, convert: Callable[[Any], Any]) -> None:
+        self._convert = convert
+        self._done = False
+        self._value: Any = None
+        self._error: Optional[BaseException] = None
+
+    def __repr__(self) -> str:
+        """Give string representation of the :class:`.BatchRead` object."""
+        if not self._done:
+            state = "pending"
+        elif self._error is not None:
+            state = "error={!r}".format(self._error)
+        else:
+            state = "value={!r}".format(self._value)
+        return "{}.{}<{}>".format(self.__module__, self.__class__.__name__, state)
+
+    def done(self) -> bool:
+        """Return :const:`True` when the read has been performed or has failed."""
+        return self._done
+
+    def result(self) -> Any:
+        """Return the value read, like the corresponding :class:`Instrument` method.
+
+        Raises:
+            RuntimeError if the batch has not been performed yet, or the
+            exception of the failed read.
+        """
+        if not self._done:
+            raise RuntimeError("The batch has not been performed yet")
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+    def _set_payload(self, payload: bytes, parse: Callable[[bytes], Any]) -> None:
+        try:
+            self._value = self._convert(parse(payload))
+        except Exception as exc:
+            self._error = exc
+        self._done = True
+
+    def _set_error(self, error: BaseException) -> None:
+        self._error = error
+        self._done = True
+
+
+class Batch:
+    """Collect reads from one instrument, and perform them as few block reads.
+
+    Created by :meth:`Instrument.batch`. The ``read_*`` methods take the same
+    arguments as those of :class:`Instrument`, but return a :class:`BatchRead`
+    at once. When the ``with`` block is left, reads with the same function
+    code that touch or overlap are merged into one request, within the
+    Modbus limit of 125 registers or 2000 bits per request, and the requests
+    are performed back-to-back while holding the bus lock of the instrument.
+
+    Args:
+        * instrument: The :class:`Instrument` to read from.
+        * max_gap: Merge reads also across this many unread registers or bits
+          in between. Only use it when the slave allows reading the whole
+          address range.
+
+    If a request fails, its reads get the exception and the first exception
+    is raised when leaving the ``with`` block. After a slave reported
+    exception the other requests are still performed, otherwise the remaining
+    reads get the same exception.
+    """
+
+    def __init__(self, instrument: "Instrument", max_gap: int = 0) -> None:
+        _check_int(max_gap, minvalue=0, description="max gap")
+        self.instrument = instrument
+        self.max_gap = max_gap
+        self._queue: List[Tuple[int, int, int, Callable[[bytes], Any], BatchRead]] = []
+
+    def __repr__(self) -> str:
+        """Give string representation of the :class:`.Batch` object."""
+        return "{}.{}<id=0x{:x}, queued={}, max_gap={}>".format(
+            self.__module__,
+            self.__class__.__name__,
+            id(self),
+            len(self._queue),
+            self.max_gap,
+        )
+
+    def __enter__(self) -> "Batch":
+        return self
+
+    def __exit__(self, exc_type: Any, *args: Any) -> None:
+        if exc_type is None:
+            self.perform()
+
+    def _add(
+        self,
+        convert: Callable[[Any], Any],
+        functioncode: int,
+        registeraddress: int,
+        number_of_decimals: int = 0,
+        number_of_registers: int = 0,
+        number_of_bits: int = 0,
+        signed: bool = False,
+        byteorder: int = BYTEORDER_BIG,
+        payloadformat: _Payloadformat = _Payloadformat.REGISTER,
+    ) -> BatchRead:
+        _check_generic_command(
+            self.instrument.address,
+            functioncode,
+            registeraddress,
+            None,
+            number_of_decimals,
+            number_of_registers,
+            number_of_bits,
+            signed,
+            byteorder,
+            payloadformat,
+        )
+        count = number_of_bits if functioncode in (1, 2) else number_of_registers
+
+        def parse(payload: bytes) -> Any:
+            return _parse_payload(
+                payload,
+                functioncode,
+                registeraddress,
+                None,
+                number_of_decimals,
+                number_of_registers,
+                number_of_bits,
+                signed,
+                byteorder,
+                payloadformat,
+            )
+
+        read = BatchRead(convert)
+        self._queue.append((functioncode, registeraddress, count, parse, read))
+        return read
+
+    def read_bit(self, registeraddress: int, functioncode: int = 2) -> BatchRead:
+        """Queue reading one bit, see :meth:`Instrument.read_bit`."""
+        _check_functioncode(functioncode, [1, 2])
+        return self._add(
+            int,
+            functioncode,
+            registeraddress,
+            number_of_bits=1,
+            payloadformat=_Payloadformat.BIT,
+        )
+
+    def read_bits(
+        self, registeraddress: int, number_of_bits: int, functioncode: int = 2
+    ) -> BatchRead:
+        """Queue reading multiple bits, see :meth:`Instrument.read_bits`."""
+        _check_functioncode(functioncode, [1, 2])
+        _check_int(
+            number_of_bits,
+            minvalue=1,
+            maxvalue=_MAX_NUMBER_OF_BITS_TO_READ,
+            description="number of bits",
+        )
+        return self._add(
+            lambda values: [int(x) for x in values],
+            functioncode,
+            registeraddress,
+            number_of_bits=number_of_bits,
+            payloadformat=_Payloadformat.BITS,
+        )
+
+    def read_register(
+        self,
+        registeraddress: int,
+        number_of_decimals: int = 0,
+        functioncode: int = 3,
+        signed: bool = False,
+    ) -> BatchRead:
+        """Queue reading one register, see :meth:`Instrument.read_register`."""
+        _check_functioncode(functioncode, [3, 4])
+        _check_int(
+            number_of_decimals,
+            minvalue=0,
+            maxvalue=_MAX_NUMBER_OF_DECIMALS,
+            description="number of decimals",
+        )
+        _check_bool(signed, description="signed")
+        return self._add(
+            lambda value: int(value) if int(value) == value else float(value),
+            functioncode,
+            registeraddress,
+            number_of_decimals=number_of_decimals,
+            number_of_registers=1,
+            signed=signed,
+            payloadformat=_Payloadformat.REGISTER,
+        )
+
+    def read_registers(
+        self, registeraddress: int, number_of_registers: int, functioncode: int = 3
+    ) -> BatchRead:
+        """Queue reading multiple registers, see :meth:`Instrument.read_registers`."""
+        _check_functioncode(functioncode, [3, 4])
+        _check_int(
+            number_of_registers,
+            minvalue=1,
+            maxvalue=_MAX_NUMBER_OF_REGISTERS_TO_READ,
+            description="number of registers",
+        )
+        return self._add(
+            lambda values: [int(x) for x in values],
+            functioncode,
+            registeraddress,
+            number_of_registers=number_of_registers,
+            payloadformat=_Payloadformat.REGISTERS,
+        )
+
+    def read_long(
+        self,
+        registeraddress: int,
+        functioncode: int = 3,
+        signed: bool = False,
+        byteorder: int = BYTEORDER_BIG,
+        number_of_registers: int = 2,
+    ) -> BatchRead:
+        """Queue reading a long integer, see :meth:`Instrument.read_long`."""
+        _check_functioncode(functioncode, [3, 4])
+        _check_bool(signed, description="signed")
+        _check_int(
+            number_of_registers,
+            minvalue=2,
+            maxvalue=4,
+            description="number of registers",
+        )
+        return self._add(
+            int,
+            functioncode,
+            registeraddress,
+            number_of_registers=number_of_registers,
+            signed=signed,
+            byteorder=byteorder,
+            payloadformat=_Payloadformat.LONG,
+        )
+
+    def read_float(
+        self,
+        registeraddress: int,
+        functioncode: int = 3,
+        number_of_registers: int = 2,
+        byteorder: int = BYTEORDER_BIG,
+    ) -> BatchRead:
+        """Queue reading a floating point number, see :meth:`Instrument.read_float`."""
+        _check_functioncode(functioncode, [3, 4])
+        _check_int(
+            number_of_registers,
+            minvalue=2,
+            maxvalue=4,
+            description="number of registers",
+        )
+        return self._add(
+            float,
+            functioncode,
+            registeraddress,
+            number_of_registers=number_of_registers,
+            byteorder=byteorder,
+            payloadformat=_Payloadformat.FLOAT,
+        )
+
+    def plan(self) -> List[Tuple[int, int, int]]:
+        """Return the requests the queued reads are merged into.
+
+        Returns:
+            A list of (function code, start address, count) tuples, in the
+            order they are performed.
+        """
+        return [(fc, start, count) for fc, start, count, _ in self._compile()]
+
+    def _compile(self) -> List[Tuple[int, int, int, List[Any]]]:
+        blocks: List[Tuple[int, int, int, List[Any]]] = []
+        for entry in sorted(self._queue, key=lambda entry: entry[:3]):
+            functioncode, start, count = entry[:3]
+            maxcount = (
+                _MAX_NUMBER_OF_BITS_TO_READ
+                if functioncode in (1, 2)
+                else _MAX_NUMBER_OF_REGISTERS_TO_READ
+            )
+            if blocks:
+                fc, blockstart, blockcount, entries = blocks[-1]
+                end = max(blockstart + blockcount, start + count)
+                if (
+                    fc == functioncode
+                    and start <= blockstart + blockcount + self.max_gap
+                    and end - blockstart <= maxcount
+                ):
+                    blocks[-1] = (fc, blockstart, end - blockstart, entries + [entry])
+                    continue
+            blocks.append((functioncode, start, count, [entry]))
+        return blocks
+
+    def perform(self) -> None:
+        """Perform the queued reads, and empty the queue.
+
+        Called when leaving the ``with`` block.
+
+        Raises:
+            The first exception of a failed request.
+        """
+        blocks = self._compile()
+        self._queue = []
+        instrument = self.instrument
+        first_error: Optional[BaseException] = None
+        with instrument.bus_lock or contextlib.nullcontext():
+            for functioncode, start, count, entries in blocks:
+                if first_error is not None and not isinstance(
+                    first_error, SlaveReportedException
+                ):
+                    for entry in entries:
+                        entry[4]._set_error(first_error)
+                    continue
+                payload_to_slave = _num_to_two_bytes(start) + _num_to_two_bytes(count)
+                try:
+                    payload_from_slave = instrument._cached_command(
+                        functioncode, payload_to_slave
+                    )
+                except Exception as exc:
+                    first_error = first_error or exc
+                    for entry in entries:
+                        entry[4]._set_error(exc)
+                    continue
+                for _, entrystart, entrycount, parse, read in entries:
+                    read._set_payload(
+                        _slice_read_payload(
+                            functioncode,
+                            payload_from_slave,
+                            entrystart - start,
+                            entrycount,
+                        ),
+                        parse,
+                    )
+        if first_error is not None:
+            raise first_error
+
+
+# ############## #
+# Batched writes #
+# ############## #
+
+
+class WriteBuffer:
+    """Collect register writes to one instrument, and send them as block writes.
+
+    Created by :meth:`Instrument.write_buffer`. The ``write_*`` methods take
+    the same arguments as those of :class:`Instrument`, but only store the
+    register values. A later write to the same register replaces the earlier
+    one. :meth:`flush`, called when leaving the ``with`` block, sorts the
+    pending registers by address and writes each run of adjacent registers
+    with one function code 16 request, of at most 123 registers. A single
+    register is written with function code 6.
+
+    If the slave rejects a block write with an exception response, the
+    registers of that block and of later blocks are written one by one with
+    function code 6, in address order.
+
+    Flush the buffer between writes that the slave must see in a given order.
+
+    Args:
+        * instrument: The :class:`Instrument` to write to.
+    """
+
+    def __init__(self, instrument: "Instrument") -> None:
+        self.instrument = instrument
+        self.block_writes = True
+        """Set to :const:`False` when the slave has rejected a block write."""
+        self._pending: Dict[int, int] = {}
+
+    def __repr__(self) -> str:
+        """Give string representation of the :class:`.WriteBuffer` object."""
+        return "{}.{}<id=0x{:x}, pending={}, block_writes={}>".format(
+            self.__module__,
+            self.__class__.__name__,
+            id(self),
+            len(self._pending),
+            self.block_writes,
+        )
+
+    def __enter__(self) -> "WriteBuffer":
+        return self
+
+    def __exit__(self, exc_type: Any, *args: Any) -> None:
+        if exc_type is None:
+            self.flush()
+
+    def write_register(
+        self,
+        registeraddress: int,
+        value: Union[int, float],
+        number_of_decimals: int = 0,
+        signed: bool = False,
+    ) -> None:
+        """Buffer writing one register, see :meth:`Instrument.write_register`."""
+        _check_registeraddress(registeraddress)
+        _check_int(
+            number_of_decimals,
+            minvalue=0,
+            maxvalue=_MAX_NUMBER_OF_DECIMALS,
+            description="number of decimals",
+        )
+        _check_bool(signed, description="signed")
+        _check_numerical(value, description="input value")
+        self._pending[registeraddress] = _two_bytes_to_num(
+            _num_to_two_bytes(value, number_of_decimals, signed=signed)
+        )
+
+    def write_registers(self, registeraddress: int, values: List[int]) -> None:
+        """Buffer writing registers, see :meth:`Instrument.write_registers`."""
+        if not isinstance(values, list):
+            raise TypeError(
+                'The "values parameter" must be a list. Given: {0!r}'.format(values)
+            )
+        _check_registeraddress(registeraddress)
+        _check_registeraddress(registeraddress + len(values) - 1)
+        for offset, value in enumerate(values):
+            _check_int(value, minvalue=0, maxvalue=0xFFFF, description="register value")
+            self._pending[registeraddress + offset] = value
+
+    def plan(self) -> List[Tuple[int, List[int]]]:
+        """Return the block writes the pending registers are merged into.
+
+        Returns:
+            A list of (start address, register values) tuples, in the order
+            they are written.
+        """
+        blocks: List[Tuple[int, List[int]]] = []
+        for address in sorted(self._pending):
+            if blocks:
+                start, values = blocks[-1]
+                if (
+                    start + len(values) == address
+                    and len(values) < _MAX_NUMBER_OF_REGISTERS_TO_WRITE
+                ):
+                    values.append(self._pending[address])
+                    continue
+            blocks.append((address, [self._pending[address]]))
+        return blocks
+
+    def flush(self) -> None:
+        """Write the pending registers, and empty the buffer.
+
+        Raises:
+            TypeError, ValueError, ModbusException,
+            serial.SerialException (inherited from IOError)
+        """
+        blocks = self.plan()
+        self._pending = {}
+        instrument = self.instrument
+        with instrument.bus_lock or contextlib.nullcontext():
+            for start, values in blocks:
+                if len(values) > 1 and self.block_writes:
+                    try:
+                        instrument.write_registers(start, values)
+                        continue
+                    except SlaveReportedException as exc:
+                        instrument._print_debug(
+                            "Block write rejected ({}), ".format(exc)
+                            + "writing single registers"
+                        )
+                        self.block_writes = False
+                for offset, value in enumerate(values):
+                    instrument.write_register(start + offset, value, functioncode=6)
+
+
+# ############## #
+# Write settling #
+# ############## #
+
+
+class SettleTracker:
+    """Wait until registers read back as written, learning how long it takes.
+
+    Some slaves store setpoints in EEPROM, and answer reads with the old
+    values, or not at all, until the write is committed. Instead of sleeping a
+    fixed time after each write, :meth:`wait` polls the registers with
+    exponential backoff until they read back as written *stable* times in a
+    row, or *ceiling* seconds have passed. The latency is learned per range of
+    16 registers, as a moving average, and the first poll after a write is made
+    when it is due. With a *path*, the learned latencies are kept in that JSON
+    file between runs.
+
+    Args:
+        * path: File to load the learned latencies from and save them to, or
+          :const:`None` to keep them in memory only.
+        * initial: Delay in seconds before the first poll in an unknown range,
+          and the shortest interval between polls.
+        * ceiling: Longest time in seconds to wait for a write to settle.
+        * factor: Growth of the interval between polls.
+        * stable: Number of reads in a row that must return the values written,
+          as a slave may answer with them before it has committed them.
+    """
+
+    RANGE_SIZE = 16  # registers sharing a learned latency
+    SMOOTHING = 0.3  # weight of the latest latency in the moving average
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        initial: float = 0.02,
+        ceiling: float = 3.0,
+        factor: float = 2.0,
+        stable: int = 2,
+    ) -> None:
+        _check_numerical(initial, minvalue=0.001, description="initial")
+        _check_numerical(ceiling, minvalue=initial, description="ceiling")
+        _check_numerical(factor, minvalue=1.0, description="factor")
+        _check_int(stable, minvalue=1, description="stable")
+        self.path = path
+        self.initial = initial
+        self.ceiling = ceiling
+        self.factor = factor
+        self.stable = stable
+        self.latencies: Dict[str, float] = {}
+        """Learned latency in seconds by range, keyed like ``"1:3:0x9000"``
+        (slave address, function code of the read, first register of the range)."""
+        self.last_latency: Optional[float] = None
+        """Time the latest write took to settle, or :const:`None` if it did not."""
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                self.latencies = {k: float(v) for k, v in json.load(f).items()}
+
+    def __repr__(self) -> str:
+        """Give string representation of the :class:`.SettleTracker` object."""
+        return "{}.{}<id=0x{:x}, path={!r}, ranges={}, ceiling={}>".format(
+            self.__module__,
+            self.__class__.__name__,
+            id(self),
+            self.path,
+            len(self.latencies),
+            self.ceiling,
+        )
+
+    def _key(
+        self, instrument: "Instrument", functioncode: int, registeraddress: int
+    ) -> str:
+        first = registeraddress - registeraddress % self.RANGE_SIZE
+        return "{}:{}:0x{:04x}".format(instrument.address, functioncode, first)
+
+    def latency(
+        self, instrument: "Instrument", registeraddress: int, functioncode: int = 3
+    ) -> Optional[float]:
+        """Return the learned latency in seconds, or :const:`None` if not known."""
+        return self.latencies.get(self._key(instrument, functioncode, registeraddress))
+
+    def wait(
+        self,
+        instrument: "Instrument",
+        registeraddress: int,
+        values: List[int],
+        functioncode: int = 3,
+        written_at: Optional[float] = None,
+        readback: Optional[List[int]] = None,
+        previous: Optional[List[int]] = None,
+    ) -> List[int]:
+        """Poll until the registers read back as *values*, or the ceiling is reached.
+
+        Args:
+            * instrument: The instrument written to.
+            * registeraddress: The first register written.
+            * values: The register values written.
+            * functioncode: Function code to read them back with, 3 or 4.
+            * written_at: :func:`time.monotonic` when the write was answered.
+              Defaults to now.
+            * readback: Values read back in the same transaction as the write,
+              for example by :meth:`Instrument.read_write_registers`.
+            * previous: The register values before the write, if known.
+
+        Returns:
+            The values last read back. They differ from *values* if the write
+            did not settle within the ceiling.
+
+        The write has settled when :attr:`stable` reads in a row return
+        *values*; the ceiling limits the wait for the first of them. Read
+        errors, like no response while the slave is busy committing, count as
+        not settled yet. The last one is raised if no read succeeded.
+
+        A *readback* counts as the first read, but nothing is learned from a
+        write settled by it, as the slave answers it before committing. Nor
+        from a write that did not change the *previous* values.
+        """
+        _check_functioncode(functioncode, [3, 4])
+        start = time.monotonic() if written_at is None else written_at
+        key = self._key(instrument, functioncode, registeraddress)
+        learned = self.latencies.get(key)
+        error: Optional[Exception] = None
+        learn = previous != values and readback != values
+        matches = 1 if readback == values else 0
+        first_match = 0.0
+
+        due = start + (self.initial if learned is None else max(learned, self.initial))
+        interval = self.initial if learned is None else max(learned / 4, self.initial)
+        while matches < self.stable:
+            if matches:
+                due = time.monotonic() + self.initial
+            time.sleep(max(0.0, min(due, start + self.ceiling) - time.monotonic()))
+            if instrument.cache is not None:
+                instrument.cache.invalidate(
+                    instrument.address, functioncode, registeraddress, len(values)
+                )
+            try:
+                readback = instrument.read_registers(
+                    registeraddress, len(values), functioncode
+                )
+                error = None
+            except (IOError, ValueError) as exc:
+                error = exc
+            elapsed = time.monotonic() - start
+            if error is None and readback == values:
+                if not matches:
+                    first_match = elapsed
+                matches += 1
+                continue
+            if matches:
+                learn = previous != values  # The values changed back, start over
+            matches = 0
+            if elapsed >= self.ceiling:
+                self.last_latency = None
+                if readback is None and error is not None:
+                    raise error
+                assert readback is not None
+                return readback
+            due += interval
+            interval *= self.factor
+
+        self.last_latency = first_match
+        if learn:
+            self._learn(key, first_match)
+        assert readback is not None
+        return readback
+
+    def _learn(self, key: str, latency: float) -> None:
+        previous = self.latencies.get(key)
+        if previous is not None:
+            latency = previous + self.SMOOTHING * (latency - previous)
+        self.latencies[key] = latency
+        self.save()
+
+    def save(self) -> None:
+        """Write the learned latencies to the file, if there is one."""
+        if self.path is None:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        # Replace the file atomically, other processes may be reading it
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.latencies, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+
+
+# ################### #
+# Shared serial ports #
+# ################### #
+
+
+class _FifoLock:
+    """Reentrant lock that is handed over to waiting threads in arrival order.
+
+    A plain :class:`threading.Lock` gives no ordering guarantee, so one busy
+    poller thread could starve the others on the same bus.
+    """
+
+    def __init__(self) -> None:
+        self._mutex = threading.Lock()
+        self._waiters: Deque[Tuple[int, threading.Event]] = collections.deque()
+        self._owner: Optional[int] = None
+        self._count = 0
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """Acquire the lock, waiting at most *timeout* seconds (forever if None).
+
+        Returns:
+            :const:`True` if the lock was acquired.
+        """
+        me = threading.get_ident()
+        with self._mutex:
+            if self._owner == me:
+                self._count += 1
+                return True
+            if self._owner is None:
+                self._owner = me
+                self._count = 1
+                return True
+            waiter = (me, threading.Event())
+            self._waiters.append(waiter)
+
+        if waiter[1].wait(timeout):
+            return True
+        with self._mutex:
+            if waiter[1].is_set():
+                return True  # Handed over just after the timeout
+            self._waiters.remove(waiter)
+            return False
+
+    def owned(self) -> bool:
+        """Return :const:`True` if the calling thread holds the lock."""
+        return self._owner == threading.get_ident()
+
+    def release(self) -> None:
+        """Release the lock, handing it over to the longest waiting thread."""
+        with self._mutex:
+            if self._owner != threading.get_ident():
+                raise RuntimeError("Can not release a lock owned by another thread")
+            self._count -= 1
+            if self._count:
+                return
+            if self._waiters:
+                self._owner, event = self._waiters.popleft()
+                self._count = 1
+                event.set()
+            else:
+                self._owner = None
+
+    def __enter__(self) -> "_FifoLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.release()
+
+
+class _SerialPortManager:
+    """Keep track of serial ports shared by several :class:`Instrument` objects.
+
+    Ports given by name are opened once and reference counted, and every port
+    has a lock so that only one transaction at a time is on the bus. The time
+    of the latest read per port, used for the silent period, is shared by all
+    instruments on that port.
+    """
+
+    def __init__(self) -> None:
+        self._mutex = threading.Lock()
+        self._locks: Dict[str, _FifoLock] = {}
+        self._refcounts: Dict[str, int] = {}
+
+    def open(self, port: str, print_debug: Callable[[str], None]) -> serial.Serial:
+        """Return the shared serial port instance for *port*, opening it if needed.
+
+        Ports given as ``tcp://host:port`` (Modbus TCP) or ``rtu+tcp://host:port``
+        (Modbus RTU frames over TCP) are persistent TCP connections instead.
+        """
+        with self._mutex:
+            if port not in _serialports or not _serialports[port]:
+                print_debug("Create serial port {}".format(port))
+                if _is_tcp_url(port):
+                    port_class = (
+                        ModbusTcpTransport
+                        if port.startswith("tcp://")
+                        else TcpTransport
+                    )
+                    _serialports[port] = port_class(port)  # type: ignore
+                else:
+                    _serialports[port] = serial.Serial(
+                        port=port,
+                        baudrate=19200,
+                        parity=serial.PARITY_NONE,
+                        bytesize=8,
+                        stopbits=1,
+                        timeout=0.05,
+                        write_timeout=2.0,
+                    )
+                self._refcounts[port] = 0
+            else:
+                print_debug("Serial port {} already exists".format(port))
+                if (_serialports[port].port is None) or (
+                    not _serialports[port].is_open
+                ):
+                    print_debug("Serial port {} is closed. Opening.".format(port))
+                    _serialports[port].open()
+            self._refcounts[port] = self._refcounts.get(port, 0) + 1
+            return _serialports[port]
+
+    def close(self, port: str, print_debug: Callable[[str], None]) -> None:
+        """Release one reference to *port*, closing it when it is the last one."""
+        with self.lock(port), self._mutex:
+            self._refcounts[port] -= 1
+            if self._refcounts[port] > 0:
+                return
+            print_debug("Closing serial port {}, no users left".format(port))
+            del self._refcounts[port]
+            _serialports.pop(port).close()
+
+    def lock(self, port: str) -> _FifoLock:
+        """Return the lock for transactions on *port*."""
+        with self._mutex:
+            if port not in self._locks:
+                self._locks[port] = _FifoLock()
+            return self._locks[port]
+
+
+_port_manager = _SerialPortManager()
+
+
+class BusLock:
+    """Advisory lock for a bus shared by several processes.
+
+    Uses ``flock`` on a lock file named after the port, so that for example a
+    poller running in the background and an interactive configuration tool can
+    share one RS-485 adaptor without corrupting each others frames.
+
+    Assign it to :attr:`Instrument.bus_lock` to hold it for each transaction.
+    To hold it for a batch of transactions, use it as a context manager::
+
+        instrument.bus_lock = minimalmodbus.BusLock("/dev/ttyUSB0")
+        with instrument.bus_lock:
+            instrument.write_register(0x9008, 2760, functioncode=6)
+            instrument.read_register(0x9008)
+
+    The lock is reentrant, and also serializes threads within the process.
+
+    Args:
+        * port: The serial port name.
+        * priority: Set this to :const:`True` for interactive tools. Processes
+          without priority give way while a priority process is waiting for
+          or holding the bus.
+        * timeout: Maximum time in seconds to wait for the bus.
+        * lockdir: Directory for the lock files. Defaults to the temp directory.
+
+    Raises:
+        BusBusyError if the bus could not be acquired within the timeout.
+
+    On platforms without ``fcntl``, like Windows, there are no lock files, and
+    it only serializes threads within the process.
+    """
+
+    POLL_INTERVAL = 0.005  # seconds
+
+    def __init__(
+        self,
+        port: str,
+        priority: bool = False,
+        timeout: float = 10.0,
+        lockdir: Optional[str] = None,
+    ) -> None:
+        _check_bool(priority, description="priority")
+        _check_numerical(timeout, minvalue=0, description="timeout")
+        self.port = port
+        self.priority = priority
+        self.timeout = timeout
+        name = "minimalmodbus-" + port.strip("/").replace("/", "-") + ".lock"
+        self.path = os.path.join(lockdir or tempfile.gettempdir(), name)
+        self._thread_lock = _port_manager.lock(port)
+        self._count = 0
+        self._fd: Optional[int] = None
+        self._priority_fd: Optional[int] = None
+
+    def __repr__(self) -> str:
+        """Give string representation of the :class:`.BusLock` object."""
+        return "{}.{}<id=0x{:x}, path={!r}, priority={}, timeout={}>".format(
+            self.__module__,
+            self.__class__.__name__,
+            id(self),
+            self.path,
+            self.priority,
+            self.timeout,
+        )
+
+    def _open(self) -> None:
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+            self._priority_fd = os.open(
+                self.path + ".priority", os.O_RDWR | os.O_CREAT, 0o666
+            )
+
+    def _try_lock(self) -> bool:
+        assert self._fd is not None and self._priority_fd is not None
+        if not self.priority:
+            # Give way while an interactive tool is waiting for or holding the bus
+            try:
+                fcntl.flock(self._priority_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            fcntl.flock(self._priority_fd, fcntl.LOCK_UN)
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        return True
+
+    def acquire(self) -> None:
+        """Acquire the bus, waiting at most :attr:`timeout` seconds."""
+        deadline = time.monotonic() + self.timeout
+        if not self._thread_lock.acquire(self.timeout):
+            raise BusBusyError(
+                "Another thread held {} for more than {} s".format(
+                    self.port, self.timeout
+                )
+            )
+        if self._count or fcntl is None:
+            self._count += 1
+            return
+        try:
+            self._open()
+            if self.priority:
+                fcntl.flock(self._priority_fd, fcntl.LOCK_SH)
+            while not self._try_lock():
+                if time.monotonic() > deadline:
+                    raise BusBusyError(
+                        "Another process held {} for more than {} s (lock file {})".format(
+                            self.port, self.timeout, self.path
+                        )
+                    )
+                time.sleep(self.POLL_INTERVAL)
+        except BaseException:
+            if self.priority and self._priority_fd is not None:
+                fcntl.flock(self._priority_fd, fcntl.LOCK_UN)
+            self._thread_lock.release()
+            raise
+        self._count = 1
+
+    def release(self) -> None:
+        """Release the bus, when released as many times as acquired."""
+        self._count -= 1
+        if not self._count and fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            if self.priority:
+                fcntl.flock(self._priority_fd, fcntl.LOCK_UN)
+        self._thread_lock.release()
+
+    def __enter__(self) -> "BusLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.release()
+
+
+# ########## #
+# Transports #
+# ########## #
+
+
+class _TransportBase:
+    """Settings and life cycle shared by :class:`Transport` and :class:`FramedTransport`.
+
+    Args:
+        * port: Name of the port, also used to share locks and timing between
+          instruments on the same bus.
+        * baudrate: Baudrate in bit/s.
+        * timeout: Read timeout in seconds, :const:`None` to wait forever.
+    """
+
+    def __init__(
+        self, port: str, baudrate: int = 19200, timeout: Optional[float] = 0.05
+    ) -> None:
+        self.port = port
+        self.baudrate = baudrate
+        self.bytesize = 8
+        self.parity = serial.PARITY_NONE
+        self.stopbits = serial.STOPBITS_ONE
+        self.timeout = timeout
+        self.write_timeout: Optional[float] = 2.0
+
+    def __repr__(self) -> str:
+        """Give string representation of the transport."""
+        return "{}.{}<id=0x{:x}, port={!r}, is_open={}, timeout={}>".format(
+            self.__module__,
+            self.__class__.__name__,
+            id(self),
+            self.port,
+            self.is_open,
+            self.timeout,
+        )
+
+    @property
+    def is_open(self) -> bool:
+        """Whether the transport is open."""
+        raise NotImplementedError
+
+    def open(self) -> None:
+        """Open the transport, if not already open."""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """Close the transport."""
+        raise NotImplementedError
+
+
+class Transport(_TransportBase):
+    """Byte transport carrying Modbus frames for an :class:`Instrument`.
+
+    Pass an instance as the *port* of an :class:`Instrument` to use another I/O
+    path than pySerial, for example to optimize or benchmark it separately from
+    the protocol code. The interface is the subset of pySerial used by the
+    instrument (``port``, ``baudrate``, ``timeout``, ``is_open``, ``open()``,
+    ``close()``, ``write()``, ``read()`` etc.), plus:
+
+    * :meth:`read_exact`: Read a frame of known size.
+    * :meth:`read_until_silence`: Read a frame of unknown size.
+    * :meth:`reset_buffers`: Discard stale bytes before a transaction.
+    * :meth:`silent_period`: The minimum time between frames.
+
+    Subclasses implement :meth:`open`, :meth:`close`, :attr:`is_open`,
+    :meth:`write` and :meth:`_read_some`.
+
+    Args:
+        * port: Name of the port, also used to share locks and timing between
+          instruments on the same bus.
+        * baudrate: Baudrate in bit/s.
+        * timeout: Read timeout in seconds, :const:`None` to wait forever.
+    """
+
+    def write(self, data: bytes) -> int:
+        """Send *data*, and return the number of bytes written."""
+        raise NotImplementedError
+
+    def _read_some(self, size: int, timeout: Optional[float]) -> bytes:
+        """Return 1 to *size* bytes as soon as available.
+
+        Returns no bytes when nothing arrived within *timeout* seconds, or when
+        nothing more can arrive. A *timeout* of :const:`None` waits forever.
+        """
+        raise NotImplementedError
+
+    def read_exact(self, size: int) -> bytes:
+        """Read *size* bytes, or fewer if :attr:`timeout` runs out first."""
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        data = bytearray()
+        while len(data) < size:
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+            chunk = self._read_some(size - len(data), remaining)
+            if not chunk:
+                break
+            data += chunk
+        return bytes(data)
+
+    def read(self, size: int = 1) -> bytes:
+        """Same as :meth:`read_exact`, for compatibility with pySerial."""
+        return self.read_exact(size)
+
+    def read_until_silence(self, maxsize: int = 256) -> bytes:
+        """Read a frame of unknown size.
+
+        Waits up to :attr:`timeout` for the first byte, then reads until the
+        line has been silent for :meth:`silent_period`, or *maxsize* bytes.
+        """
+        data = bytearray(self.read_exact(1))
+        silence = self.silent_period()
+        while data and len(data) < maxsize:
+            chunk = self._read_some(maxsize - len(data), silence)
+            if not chunk:
+                break
+            data += chunk
+        return bytes(data)
+
+    def reset_input_buffer(self) -> None:
+        """Discard bytes received but not read, for example late responses."""
+        while self.is_open and self._read_some(4096, 0):
+            pass
+
+    def reset_output_buffer(self) -> None:
+        """Discard bytes not sent yet. Nothing to do by default."""
+
+    def reset_buffers(self) -> None:
+        """Discard stale bytes in both directions."""
+        self.reset_input_buffer()
+        self.reset_output_buffer()
+
+    def flush(self) -> None:
+        """Wait until all data is sent. Nothing to do by default."""
+
+    def silent_period(self) -> float:
+        """Minimum time in seconds between frames, 3.5 characters for serial lines."""
+        return _calculate_minimum_silent_period(self.baudrate)
+
+
+class SerialTransport(Transport):
+    """Transport through pySerial.
+
+    Port names given to :class:`Instrument` are still opened as a plain
+    :class:`serial.Serial`; pass a :class:`SerialTransport` as the port to use
+    this one instead. Unlike a plain pySerial port, frames of unknown size are
+    then read until the line goes silent rather than until the timeout. The
+    serial settings are forwarded to the underlying :attr:`serial` object.
+    """
+
+    _FORWARDED = {"baudrate", "bytesize", "parity", "stopbits", "timeout"}
+
+    def __init__(
+        self, port: str, baudrate: int = 19200, timeout: Optional[float] = 0.05
+    ) -> None:
+        self.serial = serial.Serial(port=port, write_timeout=2.0)
+        super().__init__(port, baudrate, timeout)
+
+    def __getattr__(self, name: str) -> Any:
+        if name in SerialTransport._FORWARDED | {"write_timeout"}:
+            return getattr(self.serial, name)
+        raise AttributeError(name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        if name in SerialTransport._FORWARDED | {"write_timeout"}:
+            setattr(self.serial, name, value)
+        else:
+            super().__setattr__(name, value)
+
+    @property
+    def is_open(self) -> bool:
+        """Whether the serial port is open."""
+        return bool(self.serial.is_open)
+
+    def open(self) -> None:
+        """Open the serial port, if not already open."""
+        if not self.serial.is_open:
+            self.serial.open()
+
+    def close(self) -> None:
+        """Close the serial port."""
+        self.serial.close()
+
+    def write(self, data: bytes) -> int:
+        """Send *data*, and return the number of bytes written."""
+        return int(self.serial.write(data) or 0)
+
+    def _read_some(self, size: int, timeout: Optional[float]) -> bytes:
+        saved_timeout = self.serial.timeout
+        self.serial.timeout = timeout
+        try:
+            return bytes(self.serial.read(min(size, self.serial.in_waiting) or 1))
+        finally:
+            self.serial.timeout = saved_timeout
+
+    def read_exact(self, size: int) -> bytes:
+        """Read *size* bytes, or fewer if :attr:`timeout` runs out first."""
+        return bytes(self.serial.read(size))
+
+    def reset_input_buffer(self) -> None:
+        """Discard bytes received but not read."""
+        self.serial.reset_input_buffer()
+
+    def reset_output_buffer(self) -> None:
+        """Discard bytes not sent yet."""
+        self.serial.reset_output_buffer()
+
+    def flush(self) -> None:
+        """Wait until all data is sent."""
+        self.serial.flush()
+
+
+class TermiosTransport(Transport):
+    """Transport on a raw tty file descriptor, configured with :mod:`termios`.
+
+    Bypasses pySerial. Changing the serial settings reconfigures the open tty.
+    Only available on POSIX systems.
+
+    Frames of known size are read with a single system call where possible:
+    after waiting for the first byte, ``VMIN`` is set to the number of bytes
+    still missing, so that the kernel returns the rest of the frame at once,
+    and ``VTIME`` ends the read early on a gap between bytes. The bytes are
+    read with :func:`os.readv` into a preallocated buffer.
+
+    Args:
+        * port: Device name, for example ``/dev/ttyUSB0``.
+        * baudrate: Baudrate in bit/s, one of the ``termios.B*`` speeds.
+        * timeout: Read timeout in seconds, :const:`None` to wait forever.
+        * fd: An already open file descriptor for the device, instead of
+          opening *port*.
+    """
+
+    _SETTINGS = {"baudrate", "bytesize", "parity", "stopbits"}
+    MAX_VMIN = 255  # The c_cc entries are single bytes
+    INTER_BYTE_TIMEOUT = 1  # VTIME, in tenths of seconds
+
+    def __init__(
+        self,
+        port: str,
+        baudrate: int = 19200,
+        timeout: Optional[float] = 0.05,
+        fd: Optional[int] = None,
+    ) -> None:
+        if termios is None:
+            raise OSError("The termios transport is not available on this platform")
+        self.fd: Optional[int] = None
+        self._read_mode = (0, 0)  # VMIN, VTIME
+        self._buffer = bytearray(256)
+        super().__init__(port, baudrate, timeout)
+        self.fd = fd
+        self.open()
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        super().__setattr__(name, value)
+        if name in TermiosTransport._SETTINGS and getattr(self, "fd", None) is not None:
+            self._configure()
+
+    def _configure(self) -> None:
+        """Set raw mode and the serial settings on the tty."""
+        assert self.fd is not None
+        speed = getattr(termios, "B{}".format(self.baudrate), None)
+        if speed is None:
+            raise ValueError("Unsupported baudrate: {}".format(self.baudrate))
+        cflag = termios.CREAD | termios.CLOCAL
+        cflag |= {5: termios.CS5, 6: termios.CS6, 7: termios.CS7}.get(
+            self.bytesize, termios.CS8
+        )
+        if self.parity != serial.PARITY_NONE:
+            cflag |= termios.PARENB
+            if self.parity == serial.PARITY_ODD:
+                cflag |= termios.PARODD
+        if self.stopbits == serial.STOPBITS_TWO:
+            cflag |= termios.CSTOPB
+        cc = termios.tcgetattr(self.fd)[6]
+        cc[termios.VMIN] = 0
+        cc[termios.VTIME] = 0
+        termios.tcsetattr(self.fd, termios.TCSANOW, [0, 0, cflag, 0, speed, speed, cc])
+        self._read_mode = (0, 0)
+
+    def _set_read_mode(self, vmin: int, vtime: int) -> None:
+        """Make reads return after *vmin* bytes, or a gap of *vtime* tenths of seconds."""
+        if (vmin, vtime) == self._read_mode:
+            return
+        assert self.fd is not None
+        attributes = termios.tcgetattr(self.fd)
+        attributes[6][termios.VMIN] = vmin
+        attributes[6][termios.VTIME] = vtime
+        termios.tcsetattr(self.fd, termios.TCSANOW, attributes)
+        self._read_mode = (vmin, vtime)
+
+    @property
+    def is_open(self) -> bool:
+        """Whether the tty is open."""
+        return self.fd is not None
+
+    def open(self) -> None:
+        """Open and configure the tty, if not already open."""
+        if self.fd is None:
+            self.fd = os.open(self.port, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        # VMIN and VTIME only apply to blocking reads
+        os.set_blocking(self.fd, True)
+        self._configure()
+
+    def close(self) -> None:
+        """Close the tty."""
+        fd, self.fd = self.fd, None
+        if fd is not None:
+            os.close(fd)
+
+    def write(self, data: bytes) -> int:
+        """Send *data*, waiting at most :attr:`write_timeout` for the tty."""
+        assert self.fd is not None
+        view = memoryview(data)
+        while view:
+            if not select.select([], [self.fd], [], self.write_timeout)[1]:
+                raise serial.SerialTimeoutException("Write timeout")
+            view = view[os.write(self.fd, view) :]
+        return len(data)
+
+    def _read_some(self, size: int, timeout: Optional[float]) -> bytes:
+        assert self.fd is not None
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return b""
+        self._set_read_mode(0, 0)
+        return os.read(self.fd, size)
+
+    def read_exact(self, size: int) -> bytes:
+        """Read *size* bytes, or fewer if :attr:`timeout` runs out first."""
+        assert self.fd is not None
+        if size > len(self._buffer):
+            self._buffer = bytearray(size)
+        view = memoryview(self._buffer)
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        received = 0
+        while received < size:
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+            if not select.select([self.fd], [], [], remaining)[0]:
+                break
+            self._set_read_mode(
+                min(size - received, self.MAX_VMIN), self.INTER_BYTE_TIMEOUT
+            )
+            count = os.readv(self.fd, [view[received:size]])
+            if not count:
+                break
+            received += count
+        return bytes(view[:received])
+
+    def reset_input_buffer(self) -> None:
+        """Discard bytes received but not read."""
+        assert self.fd is not None
+        termios.tcflush(self.fd, termios.TCIFLUSH)
+
+    def reset_output_buffer(self) -> None:
+        """Discard bytes not sent yet."""
+        assert self.fd is not None
+        termios.tcflush(self.fd, termios.TCOFLUSH)
+
+    def flush(self) -> None:
+        """Wait until all data is sent."""
+        assert self.fd is not None
+        termios.tcdrain(self.fd)
+
+
+class PtyTransport(TermiosTransport):
+    """Transport on the master side of a new pseudo terminal.
+
+    For device simulators and benchmarks: the simulator opens
+    :attr:`device_name` as its serial port.
+    """
+
+    def __init__(self, baudrate: int = 19200, timeout: Optional[float] = 0.05) -> None:
+        master_fd, self._device_fd = os.openpty()
+        self.device_name = os.ttyname(self._device_fd)
+        super().__init__("pty:" + self.device_name, baudrate, timeout, fd=master_fd)
+
+    def open(self) -> None:
+        """Configure the pseudo terminal. It can not be reopened once closed."""
+        if self.fd is None:
+            raise OSError("The pseudo terminal {} is closed".format(self.device_name))
+        self._configure()
+
+    def _set_read_mode(self, vmin: int, vtime: int) -> None:
+        # Settings on the master side apply to the device side, and reads from
+        # the master return whatever is available anyway
+        pass
+
+    def close(self) -> None:
+        """Close both sides of the pseudo terminal."""
+        super().close()
+        if self._device_fd is not None:
+            os.close(self._device_fd)
+            self._device_fd = None
+
+    def flush(self) -> None:
+        """Nothing to do, the pseudo terminal passes data on right away."""
+
+
+class LoopbackTransport(Transport):
+    """In-memory transport without any I/O, for tests and benchmarks.
+
+    Each written request is answered by *responder*, a function from the
+    request bytes to the response bytes, which are then available for reading.
+    """
+
+    def __init__(
+        self,
+        responder: Callable[[bytes], bytes],
+        port: str = "loopback",
+        baudrate: int = 19200,
+        timeout: Optional[float] = 0.05,
+    ) -> None:
+        super().__init__(port, baudrate, timeout)
+        self.responder = responder
+        self._buffer = bytearray()
+        self._is_open = True
+
+    @property
+    def is_open(self) -> bool:
+        """Whether the transport is open."""
+        return self._is_open
+
+    def open(self) -> None:
+        """Open the transport."""
+        self._is_open = True
+
+    def close(self) -> None:
+        """Close the transport, discarding unread bytes."""
+        self._is_open = False
+        self._buffer.clear()
+
+    def write(self, data: bytes) -> int:
+        """Pass the request to the responder, and keep the response for reading."""
+        self._buffer += self.responder(bytes(data)) or b""
+        return len(data)
+
+    def _read_some(self, size: int, timeout: Optional[float]) -> bytes:
+        # Nothing more arrives than what the responder gave, so do not wait
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def silent_period(self) -> float:
+        """No silent period is needed without a bus."""
+        return 0.0
+
+
+_TCP_SCHEMES = ("tcp://", "rtu+tcp://")
+_MBAP_HEADER = struct.Struct(">HHHB")  # Transaction id, protocol id, length, unit id
+
+
+def _is_tcp_url(port: Any) -> bool:
+    """Check if *port* is a ``tcp://`` or ``rtu+tcp://`` URL."""
+    return isinstance(port, str) and port.startswith(_TCP_SCHEMES)
+
+
+class FramedTransport(_TransportBase):
+    """Transport carrying whole Modbus PDUs for an :class:`Instrument`.
+
+    For protocols that frame the requests themselves, like Modbus TCP with its
+    MBAP header, instead of a byte stream with addresses and checksums. The
+    only I/O method is :meth:`transact`; the instrument builds no RTU or ASCII
+    frames for it, and uses no port lock, so that transports may have several
+    requests outstanding.
+
+    Subclasses implement :meth:`open`, :meth:`close`, :attr:`is_open` and
+    :meth:`transact`. Serial settings are accepted for compatibility, but not
+    used.
+    """
+
+    def transact(self, unit: int, pdu: bytes) -> bytes:
+        """Send the request *pdu* to *unit* and return the response PDU.
+
+        Returns an empty byte string for broadcasts (unit 0), as there is no
+        response.
+
+        Raises:
+            NoResponseError, ConnectionError (both inherited from IOError)
+        """
+        raise NotImplementedError
+
+
+class _TcpConnection:
+    """Persistent TCP connection, mixed into the TCP transports.
+
+    The connection is kept open between transactions, and reopened on the next
+    transaction when lost. After a failed connection attempt, new attempts are
+    refused until a back-off time has passed, which doubles for each failure up
+    to :attr:`MAX_BACKOFF` seconds.
+    """
+
+    MIN_BACKOFF = 0.5  # seconds
+    MAX_BACKOFF = 30.0  # seconds
+    CONNECT_TIMEOUT = 3.0  # seconds
+
+    port: str
+
+    def __init__(self, port: str, timeout: Optional[float] = 0.05) -> None:
+        super().__init__(port, 115200, timeout)  # type: ignore
+        scheme, _, address = port.partition("://")
+        host, _, tcp_port = address.rpartition(":")
+        if not host or not tcp_port.isdigit():
+            raise ValueError(
+                "The port should look like {}://host:port, not {!r}".format(
+                    scheme, port
+                )
+            )
+        self.address = (host.strip("[]"), int(tcp_port))
+        self._socket: Optional[socket.socket] = None
+        self._backoff = 0.0
+        self._next_attempt = 0.0
+        self.open()
+
+    @property
+    def is_open(self) -> bool:
+        """Whether the connection is up."""
+        return self._socket is not None
+
+    def open(self) -> None:
+        """Connect, unless already connected or backing off after a failure.
+
+        Raises:
+            ConnectionError (inherited from IOError)
+        """
+        if self._socket is not None:
+            return
+        now = time.monotonic()
+        if now < self._next_attempt:
+            raise ConnectionError(
+                "Not reconnecting to {} for another {:.1f} s".format(
+                    self.port, self._next_attempt - now
+                )
+            )
+        try:
+            sock = socket.create_connection(self.address, self.CONNECT_TIMEOUT)
+        except OSError as exc:
+            self._backoff = min(
+                max(2 * self._backoff, self.MIN_BACKOFF), self.MAX_BACKOFF
+            )
+            self._next_attempt = now + self._backoff
+            raise ConnectionError(
+                "Could not connect to {}: {}".format(self.port, exc)
+            ) from exc
+        self._backoff = 0.0
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._socket = sock
+        self._connected(sock)
+
+    def _connected(self, sock: socket.socket) -> None:
+        """Called after each (re)connection, for subclasses."""
+
+    def close(self) -> None:
+        """Close the connection."""
+        sock, self._socket = self._socket, None
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+
+
+class TcpTransport(_TcpConnection, Transport):
+    """Transport for raw Modbus RTU frames over TCP.
+
+    Used for ``rtu+tcp://host:port``, for example Ethernet to RS-485 converters
+    in transparent mode. See :class:`_TcpConnection` for reconnecting.
+
+    Serial settings like *baudrate* and *parity* are accepted for compatibility,
+    but apply to the serial side of the converter and must be configured there.
+    """
+
+    def write(self, data: bytes) -> int:
+        """Send *data*, reconnecting once if the connection was lost."""
+        for attempt in range(2):
+            self.open()
+            assert self._socket is not None
+            try:
+                self._socket.settimeout(self.write_timeout)
+                self._socket.sendall(data)
+                return len(data)
+            except OSError:
+                self.close()
+                if attempt:
+                    raise
+        return 0
+
+    def _read_some(self, size: int, timeout: Optional[float]) -> bytes:
+        self.open()
+        assert self._socket is not None
+        self._socket.settimeout(timeout)
+        try:
+            chunk = self._socket.recv(size)
+        except (socket.timeout, BlockingIOError):
+            return b""
+        except OSError:
+            chunk = b""
+        if not chunk:
+            self.close()  # Connection closed by the other end
+        return chunk
+
+    def reset_input_buffer(self) -> None:
+        """Discard bytes received but not read, for example late responses."""
+        while self._socket is not None and self._read_some(4096, 0):
+            pass
+
+    def silent_period(self) -> float:
+        """No silent period, the converter keeps the timing on its serial side."""
+        return 0.0
+
+
+class ModbusTcpTransport(_TcpConnection, FramedTransport):
+    """Modbus TCP transport with MBAP framing, for ``tcp://host:port``.
+
+    Transactions do not wait for each other: several threads can have requests
+    outstanding on the connection at the same time (pipelining). A reader
+    thread hands each response to the waiting transaction by its transaction id.
+    """
+
+    def __init__(self, port: str, timeout: Optional[float] = 0.05) -> None:
+        self._mutex = threading.Lock()
+        self._transaction_id = 0
+        self._pending: Dict[int, List[Any]] = {}  # Transaction id: [event, response]
+        super().__init__(port, timeout)
+
+    def _connected(self, sock: socket.socket) -> None:
+        sock.settimeout(None)
+        self._pending = {}
+        threading.Thread(
+            target=self._receive,
+            args=(sock, self._pending),
+            name="minimalmodbus " + self.port,
+            daemon=True,
+        ).start()
+
+    def _receive(self, sock: socket.socket, pending: Dict[int, List[Any]]) -> None:
+        """Hand responses to the waiting transactions, until the connection closes."""
+        try:
+            while True:
+                header = self._receive_exactly(sock, _MBAP_HEADER.size)
+                transaction_id, _, length, _ = _MBAP_HEADER.unpack(header)
+                pdu = self._receive_exactly(sock, length - 1)
+                with self._mutex:
+                    slot = pending.pop(transaction_id, None)
+                if slot is not None:  # Else a late response after a timeout
+                    slot[1] = pdu
+                    slot[0].set()
+        except OSError:
+            pass
+        with self._mutex:
+            if self._socket is sock:
+                self.close()
+            for event, _ in pending.values():
+                event.set()
+            pending.clear()
+
+    @staticmethod
+    def _receive_exactly(sock: socket.socket, size: int) -> bytes:
+        data = bytearray()
+        while len(data) < size:
+            chunk = sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("Connection closed")
+            data += chunk
+        return bytes(data)
+
+    def transact(self, unit: int, pdu: bytes) -> bytes:
+        """Send the request *pdu* to *unit* and return the response PDU.
+
+        Returns an empty byte string for broadcasts (unit 0), as there is no
+        response.
+
+        Raises:
+            NoResponseError, ConnectionError (both inherited from IOError)
+        """
+        with self._mutex:
+            self._transaction_id = (self._transaction_id + 1) % 0x10000
+            transaction_id = self._transaction_id
+            frame = _MBAP_HEADER.pack(transaction_id, 0, len(pdu) + 1, unit) + pdu
+            for attempt in range(2):
+                self.open()
+                assert self._socket is not None
+                slot = [threading.Event(), None]
+                if unit != _SLAVEADDRESS_BROADCAST:
+                    self._pending[transaction_id] = slot
+                try:
+                    self._socket.sendall(frame)
+                    break
+                except OSError:
+                    self._pending.pop(transaction_id, None)
+                    self.close()
+                    if attempt:
+                        raise
+        if unit == _SLAVEADDRESS_BROADCAST:
+            return b""
+        if not slot[0].wait(self.timeout):
+            with self._mutex:
+                self._pending.pop(transaction_id, None)
+            raise NoResponseError(
+                "No answer from unit {} at {} within {} s".format(
+                    unit, self.port, self.timeout
+                )
+            )
+        if slot[1] is None:
+            raise NoResponseError(
+                "Connection to {} closed while waiting for unit {}".format(
+                    self.port, unit
+                )
+            )
+        return slot[1]
+
+
+# ################################ #
+# Asyncio Modbus instrument object #
+# ################################ #
+
+
+class _AsyncPortProtocol(asyncio.Protocol):
+    """Collect the bytes received on a port, for :class:`AsyncPort`."""
+
+    def __init__(self) -> None:
+        self.buffer = bytearray()
+        self.data_received_event = asyncio.Event()
+        self.is_closed = False
+
+    def data_received(self, data: bytes) -> None:
+        self.buffer += data
+        self.data_received_event.set()
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        self.is_closed = True
+        self.data_received_event.set()
+
+
+class AsyncPort:
+    """A serial port, pty or TCP stream driven by the asyncio event loop.
+
+    Several :class:`AsyncInstrument` objects on the same port share one
+    :class:`AsyncPort`, and their transactions are serialized by its lock.
+
+    Args:
+        * port: A serial port or pty name, for example ``/dev/ttyUSB0``,
+          or ``socket://host:port`` for raw Modbus frames over TCP
+          (same URL format as in pySerial).
+        * baudrate: Baudrate in Baud. Used also for the silent period on TCP.
+        * timeout: Read timeout value in seconds.
+    """
+
+    def __init__(self, port: str, baudrate: int = 19200, timeout: float = 0.05) -> None:
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.lock = asyncio.Lock()
+        self.serial: Optional[serial.Serial] = None
+        self._protocol: Optional[_AsyncPortProtocol] = None
+        self._transports: List[asyncio.BaseTransport] = []
+
+    def __repr__(self) -> str:
+        """Give string representation of the :class:`.AsyncPort` object."""
+        return "{}.{}<id=0x{:x}, port={!r}, baudrate={}, timeout={}, open={}>".format(
+            self.__module__,
+            self.__class__.__name__,
+            id(self),
+            self.port,
+            self.baudrate,
+            self.timeout,
+            self.is_open,
+        )
+
+    @property
+    def is_open(self) -> bool:
+        """Whether the port is connected. Read only."""
+        return self._protocol is not None and not self._protocol.is_closed
+
+    async def open(self) -> None:
+        """Open the port and attach it to the running event loop."""
+        if self.is_open:
+            return
+        loop = asyncio.get_running_loop()
+        protocol = _AsyncPortProtocol()
+        if self.port.startswith("socket://"):
+            host, _, portnumber = self.port[len("socket://") :].rpartition(":")
+            transport, _ = await loop.create_connection(
+                lambda: protocol, host, int(portnumber)
+            )
+            self._transports = [transport]
+        else:
+            self.serial = serial.Serial(
+                port=self.port,
+                baudrate=self.baudrate,
+                parity=serial.PARITY_NONE,
+                bytesize=8,
+                stopbits=1,
+                timeout=0,
+            )
+            read_transport, _ = await loop.connect_read_pipe(
+                lambda: protocol, self.serial
+            )
+            write_transport, _ = await loop.connect_write_pipe(
+                asyncio.Protocol, self.serial
+            )
+            self._transports = [read_transport, write_transport]
+        self._protocol = protocol
+
+    def close(self) -> None:
+        """Close the port."""
+        for transport in self._transports:
+            transport.close()
+        self._transports = []
+        if self._protocol is not None:
+            self._protocol.is_closed = True
+
+    def reset_input_buffer(self) -> None:
+        """Discard any received but not yet read bytes."""
+        if self._protocol is not None:
+            self._protocol.buffer.clear()
+
+    def write(self, data: bytes) -> None:
+        """Queue data for writing."""
+        transport = self._transports[-1]
+        assert isinstance(transport, asyncio.WriteTransport)
+        transport.write(data)
+
+    async def read(self, number_of_bytes: int) -> bytes:
+        """Read *number_of_bytes*, or fewer if the timeout passes first."""
+        protocol = self._protocol
+        assert protocol is not None
+        deadline = time.monotonic() + self.timeout
+        while len(protocol.buffer) < number_of_bytes and not protocol.is_closed:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            protocol.data_received_event.clear()
+            try:
+                await asyncio.wait_for(protocol.data_received_event.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+        data = bytes(protocol.buffer[:number_of_bytes])
+        del protocol.buffer[:number_of_bytes]
+        return data
+
+
+# Several async instrument instances can share the same port
+_async_ports: Dict[str, AsyncPort] = {}  # Key: port name, value: port instance
+
+
+class AsyncInstrument:
+    """Asyncio version of :class:`Instrument`, for talking to instruments (slaves).
+
+    Uses the same payload and frame handling as :class:`Instrument`, but
+    drives the port through the asyncio event loop. One event loop can
+    then talk to instruments on several ports concurrently. The port is
+    opened on the first call.
+
+    Args:
+        * port: The port name, see :class:`AsyncPort`. It is also possible
+          to pass in an :class:`AsyncPort` object.
+        * slaveaddress: Slave address in the range 0 to 247.
+        * mode: Mode selection. Can be :data:`minimalmodbus.MODE_RTU` or
+          :data:`minimalmodbus.MODE_ASCII`.
+        * baudrate: Baudrate in Baud, used when creating the port.
+        * timeout: Read timeout value in seconds, used when creating the port.
+        * debug: Set this to :const:`True` to print the communication details
+
+    Instrument attributes like :attr:`Instrument.precalculate_read_size`,
+    :attr:`Instrument.clear_buffers_before_each_transaction` and
+    :attr:`Instrument.handle_local_echo` have the same meaning here.
+    """
+
+    def __init__(
+        self,
+        port: Union[str, AsyncPort],
+        slaveaddress: int,
+        mode: str = MODE_RTU,
+        baudrate: int = 19200,
+        timeout: float = 0.05,
+        debug: bool = False,
+    ) -> None:
+        """Initialize instrument. The port is opened on first use."""
+        _check_slaveaddress(slaveaddress)
+        _check_mode(mode)
+        self.address = slaveaddress
+        self.mode = mode
+        self.precalculate_read_size = True
+        self.debug = debug
+        self.clear_buffers_before_each_transaction = True
+        self.handle_local_echo = False
+
+        if isinstance(port, AsyncPort):
+            self.port = port
+        else:
+            if port not in _async_ports:
+                _async_ports[port] = AsyncPort(port, baudrate, timeout)
+            self.port = _async_ports[port]
+
+        self._latest_roundtrip_time: Optional[float] = None
+
+    def __repr__(self) -> str:
+        """Give string representation of the :class:`.AsyncInstrument` object."""
+        return "{}.{}<id=0x{:x}, address={}, mode={}, debug={}, port={}>".format(
+            self.__module__,
+            self.__class__.__name__,
+            id(self),
+            self.address,
+            self.mode,
+            self.debug,
+            self.port,
+        )
+
+    @property
+    def roundtrip_time(self) -> Optional[float]:
+        """Latest measured round-trip time, in seconds. Read only.
+
+        See :attr:`Instrument.roundtrip_time`.
+        """
+        return self._latest_roundtrip_time
+
+    def _print_debug(self, text: str) -> None:
+        if self.debug:
+            print("MinimalModbus debug mode. " + text)
+
+    # ################################# #
+    #  Methods for talking to the slave #
+    # ################################# #
+
+    async def read_bit(self, registeraddress: int, functioncode: int = 2) -> int:
+        """Read one bit from the slave. See :meth:`Instrument.read_bit`."""
+        _check_functioncode(functioncode, [1, 2])
+        return int(
+            await self._generic_command(
+                functioncode,
+                registeraddress,
+                number_of_bits=1,
+                payloadformat=_Payloadformat.BIT,
+            )
+        )
+
+    async def write_bit(
+        self, registeraddress: int, value: int, functioncode: int = 5
+    ) -> None:
+        """Write one bit to the slave. See :meth:`Instrument.write_bit`."""
+        _check_functioncode(functioncode, [5, 15])
+        _check_int(value, minvalue=0, maxvalue=1, description="input value")
+        await self._generic_command(
+            functioncode,
+            registeraddress,
+            value,
+            number_of_bits=1,
+            payloadformat=_Payloadformat.BIT,
+        )
+
+    async def read_register(
+        self,
+        registeraddress: int,
+        number_of_decimals: int = 0,
+        functioncode: int = 3,
+        signed: bool = False,
+    ) -> Union[int, float]:
+        """Read one 16-bit register. See :meth:`Instrument.read_register`."""
+        _check_functioncode(functioncode, [3, 4])
+        _check_int(
+            number_of_decimals,
+            minvalue=0,
+            maxvalue=_MAX_NUMBER_OF_DECIMALS,
+            description="number of decimals",
+        )
+        _check_bool(signed, description="signed")
+        returnvalue = await self._generic_command(
+            functioncode,
+            registeraddress,
+            number_of_decimals=number_of_decimals,
+            number_of_registers=1,
+            signed=signed,
+            payloadformat=_Payloadformat.REGISTER,
+        )
+        if int(returnvalue) == returnvalue:
+            return int(returnvalue)
+        return float(returnvalue)
+
+    async def write_register(
+        self,
+        registeraddress: int,
+        value: Union[int, float],
+        number_of_decimals: int = 0,
+        functioncode: int = 16,
+        signed: bool = False,
+    ) -> None:
+        """Write one 16-bit register. See :meth:`Instrument.write_register`."""
+        _check_functioncode(functioncode, [6, 16])
+        _check_int(
+            number_of_decimals,
+            minvalue=0,
+            maxvalue=_MAX_NUMBER_OF_DECIMALS,
+            description="number of decimals",
+        )
+        _check_bool(signed, description="signed")
+        _check_numerical(value, description="input value")
+        await self._generic_command(
+            functioncode,
+            registeraddress,
+            value,
+            number_of_decimals=number_of_decimals,
+            number_of_registers=1,
+            signed=signed,
+            payloadformat=_Payloadformat.REGISTER,
+        )
+
+    async def read_long(
+        self,
+        registeraddress: int,
+        functioncode: int = 3,
+        signed: bool = False,
+        byteorder: int = BYTEORDER_BIG,
+        number_of_registers: int = 2,
+    ) -> int:
+        """Read a long integer. See :meth:`Instrument.read_long`."""
+        _check_functioncode(functioncode, [3, 4])
+        _check_bool(signed, description="signed")
+        _check_int(
+            number_of_registers,
+            minvalue=2,
+            maxvalue=4,
+            description="number of registers",
+        )
+        return int(
+            await self._generic_command(
+                functioncode,
+                registeraddress,
+                number_of_registers=number_of_registers,
+                signed=signed,
+                byteorder=byteorder,
+                payloadformat=_Payloadformat.LONG,
+            )
+        )
+
+    async def write_long(
+        self,
+        registeraddress: int,
+        value: int,
+        signed: bool = False,
+        byteorder: int = BYTEORDER_BIG,
+        number_of_registers: int = 2,
+    ) -> None:
+        """Write a long integer. See :meth:`Instrument.write_long`."""
+        _check_int(
+            number_of_registers,
+            minvalue=2,
+            maxvalue=4,
+            description="number of registers",
+        )
+        _check_bool(signed, description="signed")
+        _check_int(value, description="input value")
+        await self._generic_command(
+            16,
+            registeraddress,
+            value,
+            number_of_registers=number_of_registers,
+            signed=signed,
+            byteorder=byteorder,
+            payloadformat=_Payloadformat.LONG,
+        )
+
+    async def write_float(
+        self,
+        registeraddress: int,
+        value: Union[int, float],
+        number_of_registers: int = 2,
+        byteorder: int = BYTEORDER_BIG,
+    ) -> None:
+        """Write a floating point number. See :meth:`Instrument.write_float`."""
+        _check_numerical(value, description="input value")
+        _check_int(
+            number_of_registers,
+            minvalue=2,
+            maxvalue=4,
+            description="number of registers",
+        )
+        await self._generic_command(
+            16,
+            registeraddress,
+            value,
+            number_of_registers=number_of_registers,
+            byteorder=byteorder,
+            payloadformat=_Payloadformat.FLOAT,
+        )
+
+    async def read_registers(
+        self, registeraddress: int, number_of_registers: int, functioncode: int = 3
+    ) -> List[int]:
+        """Read 16-bit registers. See :meth:`Instrument.read_registers`."""
+        _check_functioncode(functioncode, [3, 4])
+        _check_int(
+            number_of_registers,
+            minvalue=1,
+            maxvalue=_MAX_NUMBER_OF_REGISTERS_TO_READ,
+            description="number of registers",
+        )
+        returnvalue = await self._generic_command(
+            functioncode,
+            registeraddress,
+            number_of_registers=number_of_registers,
+            payloadformat=_Payloadformat.REGISTERS,
+        )
+        assert isinstance(returnvalue, list)
+        return [int(x) for x in returnvalue]
+
+    async def write_registers(self, registeraddress: int, values: List[int]) -> None:
+        """Write 16-bit registers. See :meth:`Instrument.write_registers`."""
+        if not isinstance(values, list):
+            raise TypeError(
+                'The "values parameter" must be a list. Given: {0!r}'.format(values)
+            )
+        _check_int(
+            len(values),
+            minvalue=1,
+            maxvalue=_MAX_NUMBER_OF_REGISTERS_TO_WRITE,
+            description="length of input list",
+        )
+        await self._generic_command(
+            16,
+            registeraddress,
+            values,
+            number_of_registers=len(values),
+            payloadformat=_Payloadformat.REGISTERS,
+        )
+
+    # ############### #
+    # Generic command #
+    # ############### #
+
+    async def _generic_command(
+        self,
+        functioncode: int,
+        registeraddress: int,
+        value: Union[None, str, int, float, List[int]] = None,
+        number_of_decimals: int = 0,
+        number_of_registers: int = 0,
+        number_of_bits: int = 0,
+        signed: bool = False,
+        byteorder: int = BYTEORDER_BIG,
+        payloadformat: _Payloadformat = _Payloadformat.REGISTER,
+    ) -> Any:
+        """Perform generic command. See :meth:`Instrument._generic_command`."""
+        _check_generic_command(
+            self.address,
+            functioncode,
+            registeraddress,
+            value,
+            number_of_decimals,
+            number_of_registers,
+            number_of_bits,
+            signed,
+            byteorder,
+            payloadformat,
+        )
+        payload_to_slave = _create_payload(
+            functioncode,
+            registeraddress,
+            value,
+            number_of_decimals,
+            number_of_registers,
+            number_of_bits,
+            signed,
+            byteorder,
+            payloadformat,
+        )
+        if _read_range(functioncode, payload_to_slave) is None:
+            payload_from_slave = await self._perform_command(
+                functioncode, payload_to_slave
+            )
+        else:
+            # Share the transaction with concurrent reads of the same addresses
+            payload_from_slave = await _async_single_flight.perform_async(
+                (self.port.port, self.address, functioncode),
+                functioncode,
+                payload_to_slave,
+                lambda: self._perform_command(functioncode, payload_to_slave),
+            )
+        if self.address == _SLAVEADDRESS_BROADCAST:
+            return None
+        return _parse_payload(
+            payload_from_slave,
+            functioncode,
+            registeraddress,
+            value,
+            number_of_decimals,
+            number_of_registers,
+            number_of_bits,
+            signed,
+            byteorder,
+            payloadformat,
+        )
+
+    # #################################### #
+    # Communication implementation details #
+    # #################################### #
 
-        Makes use of the :meth:`_communicate` method. The request is generated
-        with the :func:`_embed_payload` function, and the parsing of the
-        response is done with the :func:`_extract_payload` function.
-        """
+    async def _perform_command(
+        self, functioncode: int, payload_to_slave: bytes
+    ) -> bytes:
+        """Perform the command. See :meth:`Instrument._perform_command`."""
         DEFAULT_NUMBER_OF_BYTES_TO_READ = 1000
 
-        _check_functioncode(functioncode, None)
-        _check_bytes(payload_to_slave, description="payload")
-
-        # Build request
         request_bytes = _embed_payload(
             self.address, self.mode, functioncode, payload_to_slave
         )
-
-        # Calculate number of bytes to read
         number_of_bytes_to_read = DEFAULT_NUMBER_OF_BYTES_TO_READ
         if self.address == _SLAVEADDRESS_BROADCAST:
             number_of_bytes_to_read = 0
@@ -1338,72 +4176,22 @@ class Instrument:
                     self.mode, functioncode, payload_to_slave
                 )
             except Exception:
-                if self.debug:
-                    template = (
-                        "Could not precalculate response size for Modbus {} mode. "
-                        + "Will read {} bytes. Request: {!r}"
-                    )
-                    self._print_debug(
-                        template.format(
-                            self.mode, number_of_bytes_to_read, request_bytes
-                        )
+                self._print_debug(
+                    "Could not precalculate response size. Will read {} bytes.".format(
+                        number_of_bytes_to_read
                     )
+                )
 
-        # Communicate
-        response_bytes = self._communicate(request_bytes, number_of_bytes_to_read)
-
+        response_bytes = await self._communicate(request_bytes, number_of_bytes_to_read)
         if number_of_bytes_to_read == 0:
             return b""
+        return _extract_payload(response_bytes, self.address, self.mode, functioncode)
 
-        # Extract payload
-        payload_from_slave = _extract_payload(
-            response_bytes, self.address, self.mode, functioncode
-        )
-        return payload_from_slave
-
-    def _communicate(self, request: bytes, number_of_bytes_to_read: int) -> bytes:
-        """Talk to the slave via a serial port.
-
-        Args:
-            * request: The raw request that is to be sent to the slave.
-            * number_of_bytes_to_read: Number of bytes to read
-
-        Returns:
-            The raw data returned from the slave.
-
-        Raises:
-            TypeError, ValueError, ModbusException,
-            serial.SerialException (inherited from IOError)
-
-        Sleeps if the previous message arrived less than the "silent period" ago.
-
-        Will block until reaching *number_of_bytes_to_read* or timeout.
-
-        Additional delay will be used after broadcast transmissions (slave address 0).
-
-        If the attribute :attr:`Instrument.debug` is :const:`True`, the communication
-        details are printed.
-
-        If the attribute :attr:`Instrument.close_port_after_each_call` is :const:`True`
-        the serial port is closed after each call.
-
-        Timing::
-
-                            Request from master (Master is writing)
-                            |
-                            |                             Response from slave
-                            |                             (Master is reading)
-                            |                             |
-            --------R-------W-----------------------------R-------W--------------------
-                     |     |                               |
-                     |     |<------- Roundtrip time ------>|
-                     |     |
-                  -->|-----|<----- Silent period
+    async def _communicate(self, request: bytes, number_of_bytes_to_read: int) -> bytes:
+        """Talk to the slave via the port. See :meth:`Instrument._communicate`.
 
-        The resolution for Python's :py:func:`time.time()` is lower on Windows than
-        on Linux.
-        It is about 16 ms on Windows according to
-        stackoverflow.com/questions/157359/accurate-timestamping-in-python-logging
+        Waits for the silent period and the broadcast delay with
+        :func:`asyncio.sleep`, so other coroutines can run meanwhile.
         """
         _check_bytes(request, minlength=1, description="request")
         _check_int(number_of_bytes_to_read)
@@ -1413,118 +4201,62 @@ class Instrument:
                 number_of_bytes_to_read, _describe_bytes(request)
             )
         )
+        port = self.port
+        async with port.lock:
+            if not port.is_open:
+                self._print_debug("Opening port {}".format(port.port))
+                await port.open()
+
+            if self.clear_buffers_before_each_transaction:
+                port.reset_input_buffer()
+
+            # Sleep to make sure 3.5 character times have passed
+            minimum_silent_period = _calculate_minimum_silent_period(port.baudrate)
+            time_since_read = time.monotonic() - _latest_read_times.get(port.port, 0)
+            if time_since_read < minimum_silent_period:
+                await asyncio.sleep(minimum_silent_period - time_since_read)
+
+            write_time = time.monotonic()
+            port.write(request)
+
+            if self.handle_local_echo:
+                local_echo_to_discard = await port.read(len(request))
+                if local_echo_to_discard != request:
+                    raise LocalEchoError(
+                        "Local echo handling is enabled, but the local echo does "
+                        + "not match the sent request. "
+                        + "Request: {}, local echo: {}.".format(
+                            _describe_bytes(request),
+                            _describe_bytes(local_echo_to_discard),
+                        )
+                    )
 
-        if self.serial is None:
-            raise ModbusException("The serial port instance is None")
-
-        if not self.serial.is_open:
-            self._print_debug("Opening port {}".format(self.serial.port))
-            self.serial.open()
-
-        portname: str = ""
-        if self.serial.port is not None:
-            portname = self.serial.port
-
-        if self.clear_buffers_before_each_transaction:
-            self._print_debug("Clearing serial buffers for port {}".format(portname))
-            self.serial.reset_input_buffer()
-            self.serial.reset_output_buffer()
-
-        # Sleep to make sure 3.5 character times have passed
-        minimum_silent_period = _calculate_minimum_silent_period(self.serial.baudrate)
-        time_since_read = time.monotonic() - _latest_read_times.get(portname, 0)
+            if number_of_bytes_to_read > 0:
+                answer = await port.read(number_of_bytes_to_read)
+            else:
+                answer = b""
 
-        if time_since_read < minimum_silent_period:
-            sleep_time = minimum_silent_period - time_since_read
+            read_time = time.monotonic()
+            _latest_read_times[port.port] = read_time
+            self._latest_roundtrip_time = read_time - write_time
 
-            if self.debug:
-                template = (
-                    "Sleeping {:.2f} ms before sending. "
-                    + "Minimum silent period: {:.2f} ms, time since read: {:.2f} ms."
-                )
-                text = template.format(
-                    sleep_time * _SECONDS_TO_MILLISECONDS,
-                    minimum_silent_period * _SECONDS_TO_MILLISECONDS,
-                    time_since_read * _SECONDS_TO_MILLISECONDS,
+            self._print_debug(
+                "Response from instrument: {}, roundtrip time: {:.1f} ms.".format(
+                    _describe_bytes(answer),
+                    self._latest_roundtrip_time * _SECONDS_TO_MILLISECONDS,
                 )
-                self._print_debug(text)
-
-            time.sleep(sleep_time)
-
-        elif self.debug:
-            template = (
-                "No sleep required before write. Time since "
-                + "previous read: {:.2f} ms, minimum silent period: {:.2f} ms."
-            )
-            text = template.format(
-                time_since_read * _SECONDS_TO_MILLISECONDS,
-                minimum_silent_period * _SECONDS_TO_MILLISECONDS,
             )
-            self._print_debug(text)
-
-        # Write request
-        write_time = time.monotonic()
-        self.serial.write(request)
 
-        # Read and discard local echo
-        if self.handle_local_echo:
-            local_echo_to_discard = self.serial.read(len(request))
-            if self.debug:
-                text = "Discarding this local echo: {}".format(
-                    _describe_bytes(local_echo_to_discard),
-                )
-                self._print_debug(text)
-            if local_echo_to_discard != request:
-                template = (
-                    "Local echo handling is enabled, but the local echo does "
-                    + "not match the sent request. "
-                    + "Request: {}, local echo: {}."
+            if not answer and number_of_bytes_to_read > 0:
+                raise NoResponseError(
+                    "No communication with the instrument (no answer)"
                 )
-                text = template.format(
-                    _describe_bytes(request),
-                    _describe_bytes(local_echo_to_discard),
-                )
-                raise LocalEchoError(text)
-
-        # Read response
-        if number_of_bytes_to_read > 0:
-            answer = self.serial.read(number_of_bytes_to_read)
-        else:
-            answer = b""
-            self.serial.flush()
 
-        read_time = time.monotonic()
-        _latest_read_times[portname] = read_time
-        roundtrip_time = read_time - write_time
-        self._latest_roundtrip_time = roundtrip_time
-
-        if self.close_port_after_each_call:
-            self._print_debug("Closing port {}".format(portname))
-            self.serial.close()
-
-        if self.debug:
-            if isinstance(self.serial.timeout, float):
-                timeout_time = self.serial.timeout * _SECONDS_TO_MILLISECONDS
-            else:
-                timeout_time = 0
-            text = (
-                "Response from instrument: {}, roundtrip time: {:.1f} ms."
-                " Timeout for reading: {:.1f} ms.\n"
-            ).format(
-                _describe_bytes(answer),
-                roundtrip_time,
-                timeout_time,
-            )
-            self._print_debug(text)
-
-        if not answer and number_of_bytes_to_read > 0:
-            raise NoResponseError("No communication with the instrument (no answer)")
-
-        if number_of_bytes_to_read == 0:
-            self._print_debug(
-                "Broadcast delay: Sleeping for {} s".format(_BROADCAST_DELAY)
-            )
-            time.sleep(_BROADCAST_DELAY)
+            if number_of_bytes_to_read == 0:
+                self._print_debug(
+                    "Broadcast delay: Sleeping for {} s".format(_BROADCAST_DELAY)
+                )
+                await asyncio.sleep(_BROADCAST_DELAY)
 
         return answer
 
@@ -1560,10 +4292,18 @@ class IllegalRequestError(SlaveReportedException):
     """The slave has received an illegal request."""
 
 
+class IllegalFunctionError(IllegalRequestError):
+    """The slave does not support the function code (exception code 01)."""
+
+
 class MasterReportedException(ModbusException):
     """Base class for exceptions that the master (computer) detects."""
 
 
+class BusBusyError(MasterReportedException):
+    """Another process or thread held the bus for longer than the lock timeout."""
+
+
 class NoResponseError(MasterReportedException):
     """No response from the slave."""
 
@@ -1581,6 +4321,275 @@ class InvalidResponseError(MasterReportedException):
 # ################ #
 
 
+def _check_generic_command(
+    slaveaddress: int,
+    functioncode: int,
+    registeraddress: int,
+    value: Union[None, str, int, float, List[int]],
+    number_of_decimals: int,
+    number_of_registers: int,
+    number_of_bits: int,
+    signed: bool,
+    byteorder: int,
+    payloadformat: _Payloadformat,
+    write_registeraddress: int = 0,
+) -> None:
+    """Check the arguments for a generic command, before creating the payload.
+
+    For argument descriptions, see the :py:meth:`Instrument._generic_command` method.
+
+    Raises:
+        TypeError, ValueError
+    """
+    ALL_ALLOWED_FUNCTIONCODES = [1, 2, 3, 4, 5, 6, 15, 16, 23]
+    ALLOWED_FUNCTIONCODES_BROADCAST = [5, 6, 15, 16]
+    ALLOWED_FUNCTIONCODES = {}
+    ALLOWED_FUNCTIONCODES[_Payloadformat.BIT] = [1, 2, 5, 15]
+    ALLOWED_FUNCTIONCODES[_Payloadformat.BITS] = [1, 2, 15]
+    ALLOWED_FUNCTIONCODES[_Payloadformat.REGISTER] = [3, 4, 6, 16]
+    ALLOWED_FUNCTIONCODES[_Payloadformat.FLOAT] = [3, 4, 16]
+    ALLOWED_FUNCTIONCODES[_Payloadformat.STRING] = [3, 4, 16]
+    ALLOWED_FUNCTIONCODES[_Payloadformat.LONG] = [3, 4, 16]
+    ALLOWED_FUNCTIONCODES[_Payloadformat.REGISTERS] = [3, 4, 16, 23]
+
+    # Check input values
+    _check_functioncode(functioncode, ALL_ALLOWED_FUNCTIONCODES)
+    _check_registeraddress(registeraddress)
+    _check_registeraddress(write_registeraddress)
+    _check_int(
+        number_of_decimals,
+        minvalue=0,
+        maxvalue=_MAX_NUMBER_OF_DECIMALS,
+        description="number of decimals",
+    )
+    _check_int(
+        number_of_registers,
+        minvalue=0,
+        maxvalue=max(
+            _MAX_NUMBER_OF_REGISTERS_TO_READ, _MAX_NUMBER_OF_REGISTERS_TO_WRITE
+        ),
+        description="number of registers",
+    )
+    _check_int(
+        number_of_bits,
+        minvalue=0,
+        maxvalue=max(_MAX_NUMBER_OF_BITS_TO_READ, _MAX_NUMBER_OF_BITS_TO_WRITE),
+        description="number of bits",
+    )
+    _check_bool(signed, description="signed")
+    _check_int(
+        byteorder,
+        minvalue=0,
+        maxvalue=_MAX_BYTEORDER_VALUE,
+        description="byteorder",
+    )
+
+    if not isinstance(payloadformat, _Payloadformat):
+        raise TypeError(
+            "The payload format should be an enum of type _Payloadformat. "
+            + "Given: {!r}".format(payloadformat)
+        )
+
+    number_of_register_bytes = number_of_registers * _NUMBER_OF_BYTES_PER_REGISTER
+
+    # Check combinations: Payload format and functioncode
+    if functioncode not in ALLOWED_FUNCTIONCODES[payloadformat]:
+        raise ValueError(
+            "Wrong functioncode for payloadformat "
+            + "{!r}. Given: {!r}.".format(payloadformat, functioncode)
+        )
+
+    # Check combinations: Broadcast and functioncode
+    if (
+        slaveaddress == _SLAVEADDRESS_BROADCAST
+        and functioncode not in ALLOWED_FUNCTIONCODES_BROADCAST
+    ):
+        raise ValueError(f"Wrong functioncode for broadcast. Given: {functioncode!r}")
+
+    # Check combinations: signed
+    if signed:
+        if payloadformat not in [_Payloadformat.REGISTER, _Payloadformat.LONG]:
+            raise ValueError(
+                'The "signed" parameter can not be used for this payload format. '
+                + "Given format: {!r}.".format(payloadformat)
+            )
+
+    # Check combinations: number_of_decimals
+    if number_of_decimals > 0:
+        if payloadformat != _Payloadformat.REGISTER:
+            raise ValueError(
+                'The "number_of_decimals" parameter can not be used for this '
+                + "payload format. Given format: {0!r}.".format(payloadformat)
+            )
+
+    # Check combinations: byteorder
+    if byteorder:
+        if payloadformat not in [_Payloadformat.FLOAT, _Payloadformat.LONG]:
+            raise ValueError(
+                'The "byteorder" parameter can not be used for this payload'
+                + " format. Given format: {0!r}.".format(payloadformat)
+            )
+
+    # Check combinations: number of bits
+    if payloadformat == _Payloadformat.BIT:
+        if number_of_bits != 1:
+            raise ValueError(
+                "For BIT payload format the number of bits should be 1. "
+                + "Given: {0!r}.".format(number_of_bits)
+            )
+    elif payloadformat == _Payloadformat.BITS:
+        if number_of_bits < 1:
+            raise ValueError(
+                "For BITS payload format the number of bits should be at least 1. "
+                + "Given: {0!r}.".format(number_of_bits)
+            )
+    elif number_of_bits:
+        raise ValueError(
+            "The number_of_bits parameter is wrong for payload format "
+            + "{0!r}. Given: {1!r}.".format(payloadformat, number_of_bits)
+        )
+
+    # Check combinations: Number of registers
+    if functioncode in [1, 2, 5, 15] and number_of_registers:
+        raise ValueError(
+            "The number_of_registers is not valid for this function code. "
+            + "number_of_registers: {0!r}, functioncode {1}.".format(
+                number_of_registers, functioncode
+            )
+        )
+    if functioncode in [3, 4, 16, 23] and not number_of_registers:
+        raise ValueError(
+            "The number_of_registers must be > 0 for functioncode "
+            + "{}.".format(functioncode)
+        )
+    if functioncode == 6 and number_of_registers != 1:
+        raise ValueError(
+            "The number_of_registers must be 1 for functioncode 6. "
+            + "Given: {}.".format(number_of_registers)
+        )
+    if (
+        functioncode == 16
+        and payloadformat == _Payloadformat.REGISTER
+        and number_of_registers != 1
+    ):
+        raise ValueError(
+            "Wrong number_of_registers when writing to a "
+            + "single register. Given {0!r}.".format(number_of_registers)
+        )
+        # Note: For function code 16 there is checking also in the content
+        # conversion functions.
+
+    # Number of registers for float and long
+    if payloadformat == _Payloadformat.FLOAT and number_of_registers not in [2, 4]:
+        raise ValueError(
+            "The number of registers for float must be 2 or 4. "
+            + "Given {0!r}".format(number_of_registers)
+        )
+    if payloadformat == _Payloadformat.LONG and number_of_registers not in [2, 4]:
+        raise ValueError(
+            "The number of registers for long must be 2 or 4. "
+            + "Given {0!r}".format(number_of_registers)
+        )
+
+    # Check combinations: Value
+    if functioncode in [5, 6, 15, 16, 23] and value is None:
+        raise ValueError(
+            "The input value must be given for this function code. "
+            + "Given {0!r} and {1}.".format(value, functioncode)
+        )
+    if functioncode in [1, 2, 3, 4] and value is not None:
+        raise ValueError(
+            "The input value should not be given for this function code. "
+            + "Given {0!r} and {1}.".format(value, functioncode)
+        )
+
+    # Check combinations: Value for numerical
+    if (
+        functioncode == 16
+        and payloadformat
+        in [
+            _Payloadformat.REGISTER,
+            _Payloadformat.FLOAT,
+            _Payloadformat.LONG,
+        ]
+    ) or (functioncode == 6 and payloadformat == _Payloadformat.REGISTER):
+        if not isinstance(value, (int, float)):
+            raise TypeError(f"The input value must be numerical. Given: {value!r}")
+
+    # Check combinations: Value for string
+    if functioncode == 16 and payloadformat == _Payloadformat.STRING:
+        if not isinstance(value, str):
+            raise TypeError(f"The input should be a string. Given: {value!r}")
+        _check_string(
+            value, "input string", minlength=1, maxlength=number_of_register_bytes
+        )
+        # Note: The string might be padded later, so the length might be shorter
+        # than number_of_register_bytes.
+
+    # Check combinations: Value for registers
+    if functioncode == 16 and payloadformat == _Payloadformat.REGISTERS:
+        if not isinstance(value, list):
+            raise TypeError(
+                "The value parameter for payloadformat REGISTERS must be a list. "
+                + "Given {0!r}.".format(value)
+            )
+
+        if len(value) != number_of_registers:
+            raise ValueError(
+                "The list length does not match number of registers. "
+                + "List: {0!r},  Number of registers: {1!r}.".format(
+                    value, number_of_registers
+                )
+            )
+
+    # Check combinations: Value for read/write registers
+    if functioncode == 23:
+        if not isinstance(value, list):
+            raise TypeError(
+                "The value parameter for function code 23 must be a list. "
+                + "Given {0!r}.".format(value)
+            )
+        _check_int(
+            len(value),
+            minvalue=1,
+            maxvalue=_MAX_NUMBER_OF_REGISTERS_TO_READWRITE,
+            description="length of input list",
+        )
+        _check_int(
+            number_of_registers,
+            minvalue=1,
+            maxvalue=_MAX_NUMBER_OF_REGISTERS_TO_READ,
+            description="number of registers to read",
+        )
+
+    # Check combinations: Value for bit
+    if functioncode in [5, 15] and payloadformat == _Payloadformat.BIT:
+        if not isinstance(value, int):
+            raise TypeError(f"The input should be an integer. Given: {value!r}")
+        _check_int(
+            value,
+            minvalue=0,
+            maxvalue=1,
+            description="input value for payload format BIT",
+        )
+
+    # Check combinations: Value for bits
+    if functioncode == 15 and payloadformat == _Payloadformat.BITS:
+        if not isinstance(value, list):
+            raise TypeError(
+                "The value parameter for payloadformat BITS must be a list. "
+                + "Given {0!r}.".format(value)
+            )
+
+        if len(value) != number_of_bits:
+            raise ValueError(
+                "The list length does not match number of bits. "
+                + "List: {0!r},  Number of registers: {1!r}.".format(
+                    value, number_of_registers
+                )
+            )
+
+
 def _create_payload(
     functioncode: int,
     registeraddress: int,
@@ -1591,6 +4600,7 @@ def _create_payload(
     signed: bool,
     byteorder: int,
     payloadformat: _Payloadformat,
+    write_registeraddress: int = 0,
 ) -> bytes:
     """Create the payload.
 
@@ -1658,6 +4668,17 @@ def _create_payload(
             + registerdata_bytecount.to_bytes(1, "big")
             + registerdata
         )
+    if functioncode == 23:
+        assert isinstance(value, list)
+        registerdata = _valuelist_to_bytes(value, len(value))
+        return (
+            _num_to_two_bytes(registeraddress)
+            + _num_to_two_bytes(number_of_registers)
+            + _num_to_two_bytes(write_registeraddress)
+            + _num_to_two_bytes(len(value))
+            + len(registerdata).to_bytes(1, "big")
+            + registerdata
+        )
     raise ValueError("Wrong function code: " + str(functioncode))
 
 
@@ -1710,7 +4731,7 @@ def _parse_payload(
         if payloadformat == _Payloadformat.BITS:
             return _bytes_to_bits(registerdata, number_of_bits)
 
-    if functioncode in [3, 4]:
+    if functioncode in [3, 4, 23]:
         registerdata = payload[_NUMBER_OF_BYTES_BEFORE_REGISTERDATA:]
         if payloadformat == _Payloadformat.STRING:
             return _bytes_to_textstring(registerdata, number_of_registers)
@@ -1982,7 +5003,7 @@ def _predict_response_size(
     if functioncode in [5, 6, 15, 16]:
         response_payload_size = NUMBER_OF_PAYLOAD_BYTES_IN_WRITE_CONFIRMATION
 
-    elif functioncode in [1, 2, 3, 4]:
+    elif functioncode in [1, 2, 3, 4, 23]:
         given_size = int(_two_bytes_to_num(payload_to_slave[BYTERANGE_FOR_GIVEN_SIZE]))
         if functioncode in [1, 2]:
             # Algorithm from MODBUS APPLICATION PROTOCOL SPECIFICATION V1.1b
@@ -3298,6 +6319,9 @@ def _is_serial_object(obj: Any) -> bool:
     """Check if an object is serialport-like."""
     KNOWN_ATTRIBUTES = ["open", "close", "read", "write", "is_open"]
 
+    if isinstance(obj, FramedTransport):
+        return True
+
     for attribute_name in KNOWN_ATTRIBUTES:
         if not hasattr(obj, attribute_name):
             return False
@@ -3490,7 +6514,7 @@ def _check_response_payload(
     Raises:
         ValueError, TypeError
     """
-    if functioncode in [1, 2, 3, 4]:
+    if functioncode in [1, 2, 3, 4, 23]:
         _check_response_bytecount(payload)
 
     if functioncode in [5, 6, 15, 16]:
@@ -3522,7 +6546,7 @@ def _check_response_payload(
             )
 
     # Response for read registers
-    if functioncode in [3, 4]:
+    if functioncode in [3, 4, 23]:
         registerdata = payload[_NUMBER_OF_BYTES_BEFORE_REGISTERDATA:]
         number_of_register_bytes = number_of_registers * _NUMBER_OF_BYTES_PER_REGISTER
         if len(registerdata) != number_of_register_bytes:
@@ -3551,7 +6575,7 @@ def _check_response_slaveerrorcode(response: bytes) -> None:
     """
     NON_ERRORS = [5]
     SLAVE_ERRORS = {
-        1: IllegalRequestError("Slave reported illegal function"),
+        1: IllegalFunctionError("Slave reported illegal function"),
         2: IllegalRequestError("Slave reported illegal data address"),
         3: IllegalRequestError("Slave reported illegal data value"),
         4: SlaveReportedException("Slave reported device failure"),
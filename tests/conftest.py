@@ -0,0 +1,116 @@
+import os
+import select
+import sys
+import threading
+import tty
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import minimalmodbus  # noqa: E402
+
+
+class FakeSlave:
+    """Modbus RTU slave on a pseudo terminal.
+
+    Answers FC03/FC04 reads and FC06/FC16/FC23 writes. Register values are
+    their addresses, modulo 0x10000, until written; ``registers`` holds the
+    written ones. Addresses in *missing* get exception 02, function codes in
+    *refused* exception 01.
+    """
+
+    def __init__(self, address=1, missing=(), refused=()):
+        self.address = address
+        self.missing = set(missing)
+        self.refused = set(refused)
+        self.registers = {}
+        self.requests = []
+        self._master, self._device = os.openpty()
+        tty.setraw(self._master)
+        tty.setraw(self._device)
+        self.port = os.ttyname(self._device)
+        self._stop = False
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def value(self, register):
+        return self.registers.get(register, register % 0x10000)
+
+    def _reply(self, fc, data):
+        body = bytes([self.address, fc]) + data
+        return body + minimalmodbus._calculate_crc(body)
+
+    def _write(self, start, data):
+        for i in range(len(data) // 2):
+            self.registers[start + i] = int.from_bytes(data[2 * i : 2 * i + 2], "big")
+
+    def _answer(self, frame):
+        fc = frame[1]
+        start = int.from_bytes(frame[2:4], "big")
+        count = 1 if fc == 6 else int.from_bytes(frame[4:6], "big")
+        if fc in self.refused or fc not in (3, 4, 6, 16, 23):
+            return self._reply(fc | 0x80, b"\x01")
+        if fc == 23:
+            write_start = int.from_bytes(frame[6:8], "big")
+            write_count = int.from_bytes(frame[8:10], "big")
+            if self.missing & set(range(write_start, write_start + write_count)):
+                return self._reply(fc | 0x80, b"\x02")
+            self._write(write_start, frame[11:-2])
+        if self.missing & set(range(start, start + count)):
+            return self._reply(fc | 0x80, b"\x02")
+        if fc == 6:
+            self._write(start, frame[4:6])
+            return self._reply(fc, frame[2:6])
+        if fc == 16:
+            self._write(start, frame[7:-2])
+            return self._reply(fc, frame[2:6])
+        data = b"".join(self.value(start + i).to_bytes(2, "big") for i in range(count))
+        return self._reply(fc, bytes([len(data)]) + data)
+
+    @staticmethod
+    def _frame_size(pending):
+        """Size of the request starting the pending bytes, None if not known yet."""
+        if pending[1] == 16:
+            return 9 + pending[6] if len(pending) > 6 else None
+        if pending[1] == 23:
+            return 13 + pending[10] if len(pending) > 10 else None
+        return 8
+
+    def _serve(self):
+        pending = b""
+        while not self._stop:
+            ready, _, _ = select.select([self._master], [], [], 0.05)
+            if not ready:
+                pending = b""
+                continue
+            pending += os.read(self._master, 256)
+            while len(pending) >= 2:
+                size = self._frame_size(pending)
+                if size is None or len(pending) < size:
+                    break
+                frame, pending = pending[:size], pending[size:]
+                self.requests.append(frame)
+                os.write(self._master, self._answer(frame))
+
+    def close(self):
+        self._stop = True
+        self._thread.join()
+        os.close(self._master)
+        os.close(self._device)
+
+
+@pytest.fixture
+def slave():
+    fake = FakeSlave()
+    yield fake
+    fake.close()
+
+
+@pytest.fixture
+def instrument(slave):
+    inst = minimalmodbus.Instrument(slave.port, slave.address)
+    inst.serial.baudrate = 115200
+    inst.serial.timeout = 0.5
+    yield inst
+    inst.close()
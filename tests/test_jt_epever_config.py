@@ -0,0 +1,73 @@
+import pytest
+
+import jt_epever_config as config
+
+OVR, CL, OVD, EQ, BOOST, FLOAT, BR = config.SETPOINT_REGS
+CURRENT = {OVR: 2700, CL: 2750, OVD: 2760, EQ: 2740, BOOST: 2700, FLOAT: 2600, BR: 2480}
+
+
+def replay(current, plan, constraints=config.CONSTRAINTS):
+    """Apply the plan write by write, checking that none breaks a new constraint."""
+    values = dict(current)
+    tolerated = config.violations(values, constraints)
+    for start, written in plan:
+        values.update((start + i, v) for i, v in enumerate(written))
+        assert config.violations(values, constraints) <= tolerated
+    return values
+
+
+def test_raising_setpoints_with_single_writes_goes_top_down():
+    targets = {CL: 2840, OVD: 2870, EQ: 2840, BOOST: 2840, FLOAT: 2760}
+    plan = config.plan_writes(CURRENT, targets, blocks=False)
+    assert [start for start, _ in plan] == [OVD, CL, EQ, BOOST, FLOAT]
+    assert replay(CURRENT, plan) == {**CURRENT, **targets}
+
+
+def test_lowering_setpoints_with_single_writes_goes_bottom_up():
+    current = {
+        OVR: 2800,
+        CL: 2900,
+        OVD: 2950,
+        EQ: 2900,
+        BOOST: 2900,
+        FLOAT: 2800,
+        BR: 2600,
+    }
+    targets = {CL: 2800, EQ: 2800, BOOST: 2780, FLOAT: 2760}
+    plan = config.plan_writes(current, targets, blocks=False)
+    assert [start for start, _ in plan] == [FLOAT, BOOST, EQ, CL]
+    assert replay(current, plan) == {**current, **targets}
+
+
+def test_block_write_covers_registers_that_have_to_move_together():
+    targets = {CL: 2840, OVD: 2870, EQ: 2840, BOOST: 2840, FLOAT: 2760}
+    plan = config.plan_writes(CURRENT, targets)
+    assert plan == [(CL, [2840, 2870, 2840, 2840, 2760])]
+
+
+def test_registers_at_target_are_not_written():
+    plan = config.plan_writes(CURRENT, {FLOAT: 2650}, blocks=False)
+    assert plan == [(FLOAT, [2650])]
+    assert config.plan_writes(CURRENT, {}) == []
+
+
+def test_broken_constraints_of_the_current_setpoints_are_tolerated():
+    current = {**CURRENT, FLOAT: 2760}  # Boost < Float already
+    targets = {OVD: 2800, CL: 2790, EQ: 2780, BOOST: 2770}
+    plan = config.plan_writes(current, targets, blocks=False)
+    assert [start for start, _ in plan] == [OVD, CL, EQ, BOOST]
+    assert replay(current, plan) == {**current, **targets}
+    assert not config.violations({**current, **targets})
+
+
+def test_unreachable_or_invalid_targets_raise_value_error():
+    with pytest.raises(ValueError, match="break constraints"):
+        config.plan_writes(CURRENT, {FLOAT: 2750})
+    with pytest.raises(ValueError, match="Not writable"):
+        config.plan_writes(CURRENT, {BR: 2400})
+    equal = [(1, 2, 0, "A >= B"), (2, 1, 0, "B >= A")]
+    with pytest.raises(ValueError, match="No write order"):
+        config.plan_writes({1: 5, 2: 5}, {1: 6, 2: 6}, False, [1, 2], equal)
+    assert config.plan_writes({1: 5, 2: 5}, {1: 6, 2: 6}, True, [1, 2], equal) == [
+        (1, [6, 6])
+    ]
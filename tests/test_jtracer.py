@@ -0,0 +1,63 @@
+import os
+from multiprocessing import shared_memory
+
+import pytest
+
+import jtracer
+
+
+class Done(Exception):
+    pass
+
+
+class FlakyTracer:
+    """Fails the first refresh, returns realtime values on the second, then stops."""
+
+    groups = {
+        "realtime": {"period": 0.01, "blocks": [(jtracer.PV_VOLTAGE, 8)]},
+        "battery": {"period": 60, "blocks": [(jtracer.BATT_SOC, 1)]},
+    }
+
+    def __init__(self):
+        self.calls = []
+
+    def refresh(self, groups):
+        self.calls.append(list(groups))
+        if len(self.calls) == 1:
+            raise IOError("no response")
+        if len(self.calls) == 2:
+            return jtracer.Sample(
+                0.0,
+                {
+                    "pv_voltage": 30.0,
+                    "pv_current": 1.0,
+                    "pv_power": 30.0,
+                    "batt_voltage": 27.0,
+                    "batt_current": 1.0,
+                },
+            )
+        raise Done()
+
+
+def test_report_after_failed_cycle_prints_missing_fields(capsys):
+    tracer = FlakyTracer()
+    with pytest.raises(Done):
+        jtracer.pollForever(tracer)
+    assert tracer.calls[:2] == [["realtime", "battery"], ["realtime"]]
+    line = capsys.readouterr().out.splitlines()[-1]
+    assert "Battery: 27.00 V  1.00 A  27.00 W - %" in line
+
+
+def test_snapshot_replaces_stale_segment_of_another_size():
+    name = "jt-test-%d" % os.getpid()
+    stale = shared_memory.SharedMemory(name, create=True, size=64)
+    snapshot = jtracer.Snapshot(name, create=True)
+    try:
+        assert snapshot.shm.size == snapshot.HEADER.size + snapshot.DATA.size
+        snapshot.publish({"pv_voltage": 30.0}, t=1.0)
+        reader = jtracer.Snapshot(name)
+        assert reader.read() == {"pv_voltage": (30.0, 1.0)}
+        reader.close()
+    finally:
+        stale.close()
+        snapshot.close()
@@ -0,0 +1,308 @@
+import threading
+import time
+
+import pytest
+
+import minimalmodbus
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+
+def test_concurrent_identical_reads_share_one_transaction(instrument, slave):
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(instrument.read_registers(0x3100, 4))
+        )
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert results == [[0x3100, 0x3101, 0x3102, 0x3103]] * 8
+    assert 1 <= len(slave.requests) < 8
+
+
+def test_read_under_bus_lock_does_not_wait_for_blocked_leader(instrument):
+    """A read in flight can not get the bus while another thread holds the bus lock."""
+    instrument.bus_lock = minimalmodbus.BusLock(instrument.serial.port, timeout=5)
+    locked = threading.Event()
+    results = {}
+
+    def holder():
+        with instrument.bus_lock:
+            locked.set()
+            wait_for(lambda: minimalmodbus._single_flight._reads)
+            results["holder"] = instrument.read_registers(0x3100, 2)
+
+    def leader():
+        results["leader"] = instrument.read_registers(0x3100, 2)
+
+    threads = [threading.Thread(target=holder, daemon=True)]
+    threads[0].start()
+    locked.wait(5)
+    threads.append(threading.Thread(target=leader, daemon=True))
+    threads[1].start()
+    for thread in threads:
+        thread.join(5)
+        assert not thread.is_alive(), "deadlock"
+    assert results == {"holder": [0x3100, 0x3101], "leader": [0x3100, 0x3101]}
+
+
+def test_read_leaves_single_flight_table_before_releasing_the_port():
+    flight = minimalmodbus.SingleFlight()
+    payload = minimalmodbus._num_to_two_bytes(0x3100) + minimalmodbus._num_to_two_bytes(
+        2
+    )
+    seen = []
+
+    class Lock:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            seen.append(dict(flight._reads))
+
+    flight.perform(("port", 1, 3), 3, payload, lambda: b"\x04\x00\x01\x00\x02", Lock())
+    assert seen == [{}]
+
+
+def test_waiting_readers_get_their_own_copy_of_the_error():
+    flight = minimalmodbus.SingleFlight()
+    payload = minimalmodbus._num_to_two_bytes(0x3100) + minimalmodbus._num_to_two_bytes(
+        2
+    )
+    started = threading.Event()
+    release = threading.Event()
+    errors = []
+
+    def fail():
+        started.set()
+        release.wait(5)
+        raise minimalmodbus.NoResponseError("no answer")
+
+    def read(perform):
+        try:
+            flight.perform(("port", 1, 3), 3, payload, perform)
+        except minimalmodbus.NoResponseError as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=read, args=(fail,))]
+    threads[0].start()
+    started.wait(5)
+    threads += [threading.Thread(target=read, args=(None,)) for _ in range(2)]
+    for thread in threads[1:]:
+        thread.start()
+    time.sleep(0.05)  # the followers join the read in flight
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert len(errors) == 3
+    assert len({id(e) for e in errors}) == 3
+    assert all(str(e) == "no answer" for e in errors)
+
+
+def test_transact_pdu_returns_response_and_exception_pdus(instrument):
+    instrument.serial.timeout = 0.1
+    assert instrument.transact_pdu(1, bytes.fromhex("0431000002")) == bytes.fromhex(
+        "040431003101"
+    )
+    assert instrument.transact_pdu(1, bytes.fromhex("0100000008")) == b"\x81\x01"
+
+
+def test_settle_needs_stable_reads_and_learns_only_from_changes(instrument, slave):
+    tracker = minimalmodbus.SettleTracker(initial=0.001, stable=3)
+    assert tracker.wait(instrument, 0x9000, [0x9000], previous=[0x9000]) == [0x9000]
+    assert len(slave.requests) == 3
+    assert tracker.latencies == {}
+    tracker.wait(instrument, 0x9000, [0x9000], readback=[0x9000])
+    assert len(slave.requests) == 5
+    assert tracker.latencies == {}
+    tracker.wait(instrument, 0x9000, [0x9000], previous=[1])
+    assert list(tracker.latencies) == ["1:3:0x9000"]
+
+
+def test_cache_answers_reads_within_their_ttl(instrument, slave):
+    instrument.cache = minimalmodbus.RegisterCache([(3, 0x9000, 4, 0.2)])
+    assert instrument.read_registers(0x9000, 2) == [0x9000, 0x9001]
+    assert instrument.read_registers(0x9001, 1) == [0x9001]
+    assert len(slave.requests) == 1
+    instrument.read_register(0x9010)  # Outside the ranges, default TTL 0
+    instrument.read_register(0x9010)
+    assert len(slave.requests) == 3
+    time.sleep(0.25)
+    instrument.read_registers(0x9000, 2)
+    assert len(slave.requests) == 4
+    assert (instrument.cache.hits, instrument.cache.misses) == (1, 4)
+
+
+def test_cache_evicts_least_recently_used_registers(instrument, slave):
+    instrument.cache = minimalmodbus.RegisterCache(default_ttl=60, maxsize=4)
+    instrument.read_registers(0x100, 2)
+    instrument.read_registers(0x200, 2)
+    instrument.read_registers(0x100, 2)  # Hit, now more recent than 0x200
+    instrument.read_registers(0x300, 2)
+    assert len(slave.requests) == 3
+    instrument.read_registers(0x100, 2)
+    assert len(slave.requests) == 3
+    instrument.read_registers(0x200, 2)
+    assert len(slave.requests) == 4
+
+
+def test_cache_drops_registers_written(instrument, slave):
+    instrument.cache = minimalmodbus.RegisterCache(default_ttl=60)
+    instrument.read_registers(0x9000, 3)
+    instrument.write_register(0x9001, 7, functioncode=6)
+    assert instrument.read_registers(0x9000, 3) == [0x9000, 7, 0x9002]
+    instrument.write_registers(0x9002, [8])
+    assert instrument.read_registers(0x9000, 3) == [0x9000, 7, 8]
+    assert instrument.read_registers(0x9000, 3) == [0x9000, 7, 8]
+    assert [frame[1] for frame in slave.requests] == [3, 6, 3, 16, 3]
+
+
+def read_requests(slave):
+    return [
+        (frame[1], int.from_bytes(frame[2:4], "big"), int.from_bytes(frame[4:6], "big"))
+        for frame in slave.requests
+    ]
+
+
+def test_batch_merges_touching_reads_and_slices_each_result(instrument, slave):
+    with instrument.batch() as batch:
+        pv = batch.read_registers(0x3100, 2, functioncode=4)
+        power = batch.read_register(0x3102, 2, functioncode=4)
+        overlap = batch.read_registers(0x3101, 3, functioncode=4)
+        apart = batch.read_register(0x3110, functioncode=4)
+        holding = batch.read_register(0x9000)
+        assert batch.plan() == [(3, 0x9000, 1), (4, 0x3100, 4), (4, 0x3110, 1)]
+    assert read_requests(slave) == [(3, 0x9000, 1), (4, 0x3100, 4), (4, 0x3110, 1)]
+    assert pv.result() == [0x3100, 0x3101]
+    assert power.result() == 0x3102 / 100
+    assert overlap.result() == [0x3101, 0x3102, 0x3103]
+    assert apart.result() == 0x3110
+    assert holding.result() == 0x9000
+
+
+def test_batch_merges_across_gaps_up_to_max_gap(instrument, slave):
+    with instrument.batch(max_gap=12) as batch:
+        first = batch.read_register(0x3100, functioncode=4)
+        last = batch.read_register(0x310D, functioncode=4)
+    assert read_requests(slave) == [(4, 0x3100, 14)]
+    assert (first.result(), last.result()) == (0x3100, 0x310D)
+
+
+def test_batch_keeps_reading_after_a_refused_block(instrument, slave):
+    slave.missing.add(0x3110)
+    batch = instrument.batch()
+    good = batch.read_registers(0x3100, 2, functioncode=4)
+    refused = batch.read_register(0x3110, functioncode=4)
+    later = batch.read_register(0x3300, functioncode=4)
+    with pytest.raises(minimalmodbus.IllegalRequestError):
+        batch.perform()
+    assert good.result() == [0x3100, 0x3101]
+    assert later.result() == 0x3300
+    with pytest.raises(minimalmodbus.IllegalRequestError):
+        refused.result()
+
+
+def test_write_buffer_plans_adjacent_registers_as_blocks(instrument):
+    buffer = instrument.write_buffer()
+    buffer.write_register(0x9008, 1)
+    buffer.write_registers(0x9006, [2, 3])
+    buffer.write_register(0x9007, 4)  # Replaces the earlier value
+    buffer.write_register(0x9010, 5)
+    buffer.write_registers(0x100, list(range(130)))
+    assert buffer.plan() == [
+        (0x100, list(range(123))),
+        (0x17B, list(range(123, 130))),
+        (0x9006, [2, 4, 1]),
+        (0x9010, [5]),
+    ]
+
+
+def test_write_buffer_flush_writes_blocks_with_fc16_singles_with_fc06(
+    instrument, slave
+):
+    with instrument.write_buffer() as buffer:
+        buffer.write_registers(0x9006, [2, 3])
+        buffer.write_register(0x9010, 5)
+    assert read_requests(slave) == [(16, 0x9006, 2), (6, 0x9010, 5)]
+    assert slave.registers == {0x9006: 2, 0x9007: 3, 0x9010: 5}
+
+
+def test_write_buffer_falls_back_to_fc06_when_blocks_are_refused(instrument, slave):
+    slave.refused.add(16)
+    instrument.serial.timeout = 0.1
+    buffer = instrument.write_buffer()
+    buffer.write_registers(0x9006, [2, 3])
+    buffer.write_registers(0x9020, [4, 5])
+    buffer.flush()
+    assert not buffer.block_writes
+    assert [frame[1] for frame in slave.requests] == [16, 6, 6, 6, 6]
+    assert slave.registers == {0x9006: 2, 0x9007: 3, 0x9020: 4, 0x9021: 5}
+
+
+def test_fc23_payload_codec():
+    payload = minimalmodbus._create_payload(
+        23,
+        0x9005,
+        [1, 2],
+        0,
+        4,
+        0,
+        False,
+        minimalmodbus.BYTEORDER_BIG,
+        minimalmodbus._Payloadformat.REGISTERS,
+        write_registeraddress=0x9006,
+    )
+    assert payload == bytes.fromhex("9005 0004 9006 0002 04 0001 0002")
+    assert (
+        minimalmodbus._predict_response_size(minimalmodbus.MODE_RTU, 23, payload) == 13
+    )
+    assert minimalmodbus._parse_payload(
+        bytes.fromhex("08 9005 0001 0002 9008"),
+        23,
+        0x9005,
+        [1, 2],
+        0,
+        4,
+        0,
+        False,
+        minimalmodbus.BYTEORDER_BIG,
+        minimalmodbus._Payloadformat.REGISTERS,
+    ) == [0x9005, 1, 2, 0x9008]
+
+
+def test_read_write_registers_writes_then_reads_in_one_transaction(instrument, slave):
+    assert instrument.read_write_registers(0x9006, [1, 2], 0x9005, 4) == [
+        0x9005,
+        1,
+        2,
+        0x9008,
+    ]
+    assert instrument.read_write_supported
+    assert [frame[1] for frame in slave.requests] == [23]
+    assert slave.registers == {0x9006: 1, 0x9007: 2}
+
+
+def test_read_write_registers_falls_back_when_fc23_is_illegal(instrument, slave):
+    slave.refused.add(23)
+    instrument.serial.timeout = 0.1
+    assert instrument.read_write_registers(0x9006, [1, 2], 0x9006, 2) == [1, 2]
+    assert instrument.read_write_supported is False
+    assert instrument.read_write_registers(0x9008, [3], 0x9008, 1) == [3]
+    assert [frame[1] for frame in slave.requests] == [23, 16, 3, 6, 3]
+
+
+def test_read_write_registers_other_exceptions_leave_support_unknown(instrument, slave):
+    slave.missing.add(0x9007)
+    instrument.serial.timeout = 0.1
+    with pytest.raises(minimalmodbus.IllegalRequestError):
+        instrument.read_write_registers(0x9006, [1, 2], 0x9006, 2)
+    assert instrument.read_write_supported is None